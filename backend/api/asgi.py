@@ -9,17 +9,24 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from core.routing import websocket_urlpatterns
-from core.middleware import TokenAuthMiddleware
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.settings')
 
-application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": TokenAuthMiddleware(
-        URLRouter(
-            websocket_urlpatterns
+# Inicializa o Django antes de importar módulos que usam models e settings
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from core.routing import websocket_urlpatterns  # noqa: E402
+from core.metricas import MetricasWebsocketMiddleware  # noqa: E402
+from core.middleware import DespachanteLoopMiddleware, TokenAuthMiddleware  # noqa: E402
+
+application = DespachanteLoopMiddleware(ProtocolTypeRouter({
+    "http": django_asgi_app,
+    "websocket": MetricasWebsocketMiddleware(
+        TokenAuthMiddleware(
+            URLRouter(
+                websocket_urlpatterns
+            )
         )
     ),
-})
+}))
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import copy
 from pathlib import Path
 import os
 
@@ -47,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metricas.MetricasMiddleware', # primeiro, para medir o tempo total da requisição
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -78,17 +80,138 @@ WSGI_APPLICATION = 'api.wsgi.application'
 ASGI_APPLICATION = 'api.asgi.application'
 
 # Channels Configuration
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
+# CHANNEL_LAYER escolhe o backend: 'memoria' (um único processo), 'redis'
+# (vários workers/containers) ou 'local' (layer em processo usado nos testes)
+CHANNEL_LAYER = os.environ.get('CHANNEL_LAYER', 'memoria')
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+CHANNEL_LAYER_CONFIG = {
+    'expiry': int(os.environ.get('CHANNEL_LAYER_EXPIRY', 60)), # segundos que uma mensagem espera na fila do canal
+    'group_expiry': int(os.environ.get('CHANNEL_LAYER_GROUP_EXPIRY', 86400)), # segundos até um canal sair do grupo
+    'capacity': int(os.environ.get('CHANNEL_LAYER_CAPACITY', 100)), # mensagens por canal antes de descartar
 }
 
+# Envio das notificações pelo WebSocket (core/consumers.py)
+WS_JANELA_MS = int(os.environ.get('WS_JANELA_MS', 50)) # notificações dentro da janela saem num único frame (0: sem espera)
+WS_FILA_MAXIMA = int(os.environ.get('WS_FILA_MAXIMA', 100)) # notificações pendentes por conexão
+WS_POLITICA_FILA = os.environ.get('WS_POLITICA_FILA', 'resumo') # com a fila cheia: 'resumo' ou 'descartar'
+WS_HEARTBEAT = float(os.environ.get('WS_HEARTBEAT', 30)) # segundos sem envios até mandar um ping (0 desliga)
+WS_TIMEOUT_OCIOSO = float(os.environ.get('WS_TIMEOUT_OCIOSO', 90)) # segundos sem mensagens do cliente até fechar (0 desliga)
+
+if CHANNEL_LAYER == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+                **CHANNEL_LAYER_CONFIG,
+            },
+        },
+    }
+elif CHANNEL_LAYER == 'local':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'core.layers.CanalLocalLayer',
+            'CONFIG': CHANNEL_LAYER_CONFIG,
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': CHANNEL_LAYER_CONFIG,
+        },
+    }
+
+
+
+# Cache
+# CACHE_BACKEND: 'memoria' (por processo) ou 'redis' (compartilhado entre
+# workers, necessário para a invalidação valer em todos os processos)
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memoria')
+TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 300)) # segundos que um token fica em cache
+# O cache de tokens exige um backend compartilhado: a revogação de um token ou
+# a desativação do usuário (core/signals.py) só apaga a entrada no cache, e
+# com um cache por processo os demais workers aceitariam o token até o TTL.
+# Sem Redis ele fica desligado (toda requisição consulta o banco), a menos
+# que TOKEN_CACHE_LOCAL=1, só para um único processo (desenvolvimento).
+TOKEN_CACHE_LOCAL = os.environ.get('TOKEN_CACHE_LOCAL', '0') == '1'
+SALDO_CACHE_ATIVO = os.environ.get('SALDO_CACHE_ATIVO', '1') == '1' # cache do /api/saldo/ (core/cache_saldo.py)
+SALDO_CACHE_TTL = int(os.environ.get('SALDO_CACHE_TTL', 300)) # segundos que um saldo fica em cache
+NOTIFICACOES_HISTORICO_MAX = int(os.environ.get('NOTIFICACOES_HISTORICO_MAX', 100)) # notificações guardadas por usuário para reenvio
+NOTIFICACOES_HISTORICO_TTL = int(os.environ.get('NOTIFICACOES_HISTORICO_TTL', 24 * 60 * 60)) # segundos que cada uma fica guardada
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        'tokens': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'auth',
+            'TIMEOUT': TOKEN_CACHE_TTL,
+        },
+        'saldos': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'saldos',
+            'TIMEOUT': SALDO_CACHE_TTL,
+        },
+        'notificacoes': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'notificacoes',
+            'TIMEOUT': NOTIFICACOES_HISTORICO_TTL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'tokens': {
+            'BACKEND': (
+                'django.core.cache.backends.locmem.LocMemCache' if TOKEN_CACHE_LOCAL
+                else 'django.core.cache.backends.dummy.DummyCache'
+            ),
+            'LOCATION': 'tokens',
+            'TIMEOUT': TOKEN_CACHE_TTL,
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.environ.get('TOKEN_CACHE_MAX_ENTRIES', 10000)),
+            },
+        },
+        'saldos': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'saldos',
+            'TIMEOUT': SALDO_CACHE_TTL,
+            'OPTIONS': {
+                # Duas entradas por conta: a versão e o saldo
+                'MAX_ENTRIES': int(os.environ.get('SALDO_CACHE_MAX_ENTRIES', 20000)),
+            },
+        },
+        'notificacoes': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'notificacoes',
+            'TIMEOUT': NOTIFICACOES_HISTORICO_TTL,
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.environ.get('NOTIFICACOES_CACHE_MAX_ENTRIES', 50000)),
+            },
+        },
+    }
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# DB_POOL=1 usa o pool de conexões do Django (psycopg 3 + psycopg_pool): cada
+# processo mantém de DB_POOL_MIN a DB_POOL_MAX conexões abertas, emprestadas a
+# cada requisição em vez de abrir uma conexão nova. Sem o pool, DB_CONN_MAX_AGE
+# deixa as conexões persistentes por thread, o que rende pouco no ASGI, onde
+# cada requisição síncrona pode rodar numa thread diferente.
+DB_POOL = os.environ.get('DB_POOL', '1') == '1'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -97,9 +220,47 @@ DATABASES = {
         'PASSWORD': os.environ.get('DB_PASSWORD'),
         'HOST': os.environ.get('DB_HOST'),
         'PORT': os.environ.get('DB_PORT'),
+        # Com o pool as conexões já são reaproveitadas (o Django exige CONN_MAX_AGE=0)
+        'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': True, # testa a conexão antes de reutilizá-la (no pool, ao emprestá-la)
+        'OPTIONS': {},
     }
 }
 
+if DB_POOL:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.environ.get('DB_POOL_MIN', 4)), # conexões mantidas abertas por processo
+        'max_size': int(os.environ.get('DB_POOL_MAX', 20)), # limite por processo (somado entre processos, abaixo do max_connections)
+        'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)), # segundos esperando uma conexão livre antes de erro
+        'max_idle': float(os.environ.get('DB_POOL_MAX_IDLE', 600)), # segundos até fechar conexões ociosas além do mínimo
+    }
+
+# Réplicas de leitura (core/replicas.py): DB_REPLICAS lista os hosts, com a
+# porta opcional ('replica1:5432,replica2'), com o mesmo banco e usuário do
+# primário. Cada uma vira um alias 'replicaN' com o seu próprio pool. Sem
+# DB_REPLICAS, 'replica1' é só uma segunda conexão ao primário, usada nos
+# testes, e as leituras não são desviadas. Nos testes, as réplicas espelham
+# o banco de testes do primário (TEST MIRROR).
+DB_REPLICAS = [endereco.strip() for endereco in os.environ.get('DB_REPLICAS', '').split(',') if endereco.strip()]
+for numero, endereco in enumerate(DB_REPLICAS or [''], start=1):
+    host, _, porta = endereco.partition(':')
+    replica = copy.deepcopy(DATABASES['default'])
+    replica['HOST'] = host or replica['HOST']
+    replica['PORT'] = porta or replica['PORT']
+    replica['TEST'] = {'MIRROR': 'default'}
+    DATABASES[f'replica{numero}'] = replica
+
+DATABASE_ROUTERS = ['core.replicas.RoteadorReplicas']
+# Aliases para onde o roteador manda as leituras das views marcadas
+REPLICAS_LEITURA = [f'replica{numero}' for numero in range(1, len(DB_REPLICAS) + 1)]
+# Segundos em que quem acabou de escrever lê só do primário (read-your-writes).
+# Deve passar de REPLICA_ATRASO_MAXIMO mais REPLICA_VERIFICACAO_INTERVALO.
+REPLICA_JANELA_PRIMARIO = int(os.environ.get('REPLICA_JANELA_PRIMARIO', 5))
+# Réplicas mais atrasadas que isso (segundos) ficam de fora até alcançarem o primário
+REPLICA_ATRASO_MAXIMO = float(os.environ.get('REPLICA_ATRASO_MAXIMO', 1))
+# Por quantos segundos cada processo reaproveita o atraso medido de uma réplica
+REPLICA_VERIFICACAO_INTERVALO = float(os.environ.get('REPLICA_VERIFICACAO_INTERVALO', 1))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -145,13 +306,62 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Configuração do Django REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication', # Diz ao DRF para verificar se existe um token válido no header da requisição
+        'core.authentication.CachedTokenAuthentication', # Diz ao DRF para verificar se existe um token válido no header da requisição (com cache)
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated', # Garante que apenas usuários autenticados possam acessar as views da API
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.metricas.JSONRendererMedido', # JSONRenderer que mede o tempo de serialização
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # Limites por usuário e endpoint das operações (core/limites.py): token bucket
+    # de N fichas, repostas à razão de N por período (s, m, h ou d)
+    'DEFAULT_THROTTLE_RATES': {
+        'pagamento': os.environ.get('LIMITE_PAGAMENTO', '10/s'),
+        'transferencia': os.environ.get('LIMITE_TRANSFERENCIA', '10/s'),
+        'saque': os.environ.get('LIMITE_SAQUE', '10/s'),
+        'deposito': os.environ.get('LIMITE_DEPOSITO', '10/s'),
+        'lote': os.environ.get('LIMITE_LOTE', '2/s'),
+    },
 }
 
+# LIMITES_ATIVOS=0 desliga os limites por usuário e a admissão (core/limites.py),
+# por exemplo num servidor medido pelo bench_api --servidor
+LIMITES_ATIVOS = os.environ.get('LIMITES_ATIVOS', '1') == '1'
+# Onde ficam os baldes dos limites por usuário: 'memoria' (por processo) ou
+# 'redis' (compartilhado entre os processos, em REDIS_URL)
+LIMITES_BACKEND = os.environ.get('LIMITES_BACKEND', CACHE_BACKEND)
+# Operações simultâneas por processo; as excedentes recebem 503 antes de abrir a
+# transação (0 desliga). O padrão é o tamanho máximo do pool de conexões.
+OPERACOES_SIMULTANEAS_MAX = int(os.environ.get(
+    'OPERACOES_SIMULTANEAS_MAX', DATABASES['default']['OPTIONS'].get('pool', {}).get('max_size', 20)
+))
+
+# Número máximo de operações aceitas em um único lote (/api/lote/)
+LOTE_MAX_OPERACOES = int(os.environ.get('LOTE_MAX_OPERACOES', 5000))
+
+# Como as operações gravam (core/operacoes.py):
+# - 'lock': travam a linha da conta e alteram o saldo na transação (padrão);
+# - 'otimista': saques, depósitos e pagamentos alteram o saldo com um UPDATE
+#   condicional e gravam a movimentação na mesma instrução, sem SELECT ... FOR
+#   UPDATE; transferências e lotes seguem como no 'lock';
+# - 'diario': só acrescentam lançamentos ao diário, aplicados depois pelo
+#   projetor (manage.py projetar_diario). Ao trocar de modo, projete o diário antes.
+OPERACOES_MODO = os.environ.get('OPERACOES_MODO', 'lock')
+DIARIO_LOTE_PROJECAO = int(os.environ.get('DIARIO_LOTE_PROJECAO', 5000)) # lançamentos aplicados por transação do projetor
+
+# Métricas de desempenho (/api/metricas/, formato Prometheus)
+METRICAS_ATIVAS = os.environ.get('METRICAS_ATIVAS', '1') == '1'
+# Fração das requisições e conexões WebSocket medidas em detalhe (banco, locks, serialização)
+METRICAS_AMOSTRAGEM = float(os.environ.get('METRICAS_AMOSTRAGEM', 0.1))
+# Token do scrape ('Authorization: Bearer <token>'). Sem ele, /api/metricas/ só
+# responde a usuários staff com sessão (admin)
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN', '')
+
+# Segundos que uma Idempotency-Key continua valendo (limpeza: manage.py limpar_idempotencia)
+IDEMPOTENCIA_TTL = int(os.environ.get('IDEMPOTENCIA_TTL', 24 * 60 * 60))
+
 # Define quais origens (endereços) podem fazer requisições para a API
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -171,6 +381,7 @@ CORS_ALLOW_HEADERS = [
     'authorization',
     'content-type',
     'dnt',
+    'idempotency-key',
     'origin',
     'user-agent',
     'x-csrftoken',
@@ -1,6 +1,12 @@
 from django.contrib import admin
 from .models import Correntista, Movimentacao
 
-admin.site.register(Correntista)
-admin.site.register(Movimentacao)
 
+@admin.register(Correntista)
+class CorrentistaAdmin(admin.ModelAdmin):
+    list_select_related = ('user',) # __str__ usa user.username
+
+
+@admin.register(Movimentacao)
+class MovimentacaoAdmin(admin.ModelAdmin):
+    list_select_related = ('correntista__user',) # __str__ usa correntista.user.username
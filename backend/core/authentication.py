@@ -0,0 +1,109 @@
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+# Marca gravada no lugar do token invalidado: enquanto ela existir, uma
+# leitura do banco feita antes da invalidação não volta para o cache (add)
+INVALIDADO = 'invalidado'
+DURACAO_INVALIDADO = 30 # segundos
+
+
+def chave_cache_token(key):
+    return f"token:{key}"
+
+
+def _token_do_cache(key, valor):
+    """
+    Token montado a partir do que o cache guarda, (user_id, is_active): o
+    usuário vem só com esses campos, e os demais (inclusive o hash da senha,
+    que nunca vai para o cache) são carregados do banco se forem usados.
+    """
+    user_id, ativo = valor
+    token = Token.from_db('default', ['key', 'user_id'], [key, user_id])
+    token.user = User.from_db('default', ['id', 'is_active'], [user_id, ativo])
+    return token
+
+
+def obter_token(key):
+    """
+    Resolve a chave do token para o Token (com o usuário), consultando o
+    banco apenas quando não estiver no cache 'tokens' ou tiver acabado de
+    ser invalidado. Retorna None se o token não existir.
+    """
+    cache = caches['tokens']
+    valor = cache.get(chave_cache_token(key))
+    if isinstance(valor, tuple):
+        return _token_do_cache(key, valor)
+    try:
+        token = Token.objects.select_related('user').get(key=key)
+    except Token.DoesNotExist:
+        return None
+    cache.add(chave_cache_token(key), (token.user_id, token.user.is_active))
+    return token
+
+
+async def aobter_token(key):
+    """
+    Versão assíncrona de obter_token, para views assíncronas e o WebSocket.
+    """
+    cache = caches['tokens']
+    valor = await cache.aget(chave_cache_token(key))
+    if isinstance(valor, tuple):
+        return _token_do_cache(key, valor)
+    try:
+        token = await Token.objects.select_related('user').aget(key=key)
+    except Token.DoesNotExist:
+        return None
+    await cache.aadd(chave_cache_token(key), (token.user_id, token.user.is_active))
+    return token
+
+
+def invalidar_token(key):
+    """
+    Troca a entrada do token pela marca INVALIDADO, por DURACAO_INVALIDADO
+    segundos: um delete deixaria uma leitura do banco ainda em andamento
+    gravar de novo os dados antigos.
+    """
+    caches['tokens'].set(chave_cache_token(key), INVALIDADO, timeout=DURACAO_INVALIDADO)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication que resolve o token pelo cache compartilhado com o
+    middleware de WebSocket, evitando as consultas de Token e User por requisição.
+    """
+
+    def authenticate_credentials(self, key):
+        token = obter_token(key)
+        if token is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (token.user, token)
+
+
+async def autenticar_async(request):
+    """
+    Autentica uma requisição de view assíncrona pelo header
+    'Authorization: Token <chave>', com as mesmas regras e o mesmo cache do
+    CachedTokenAuthentication. Retorna o usuário, None sem credenciais, ou
+    levanta AuthenticationFailed.
+    """
+    partes = request.headers.get('Authorization', '').split()
+    if not partes or partes[0].lower() != CachedTokenAuthentication.keyword.lower():
+        return None
+    if len(partes) != 2:
+        raise exceptions.AuthenticationFailed(_('Invalid token header. No credentials provided.'))
+
+    token = await aobter_token(partes[1])
+    if token is None:
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+    if not token.user.is_active:
+        raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+    return token.user
@@ -0,0 +1,74 @@
+import json
+import math
+import statistics
+import subprocess
+
+
+def percentil(ordenados, p):
+    """
+    Percentil pelo método do vizinho mais próximo sobre uma lista já ordenada.
+    """
+    if not ordenados:
+        return None
+    indice = max(0, math.ceil(p / 100 * len(ordenados)) - 1)
+    return ordenados[indice]
+
+
+def resumo_latencias(valores_ms):
+    """
+    Resume uma lista de latências em milissegundos (contagem, média, p50, p95, p99 e máximo).
+    """
+    ordenados = [round(valor, 3) for valor in sorted(valores_ms)]
+    return {
+        'amostras': len(ordenados),
+        'media_ms': round(statistics.fmean(ordenados), 3) if ordenados else None,
+        'p50_ms': percentil(ordenados, 50),
+        'p95_ms': percentil(ordenados, 95),
+        'p99_ms': percentil(ordenados, 99),
+        'max_ms': ordenados[-1] if ordenados else None,
+    }
+
+
+def formatar_resumo(nome, resumo):
+    if not resumo['amostras']:
+        return f"{nome}: sem amostras"
+    return (
+        f"{nome}: n={resumo['amostras']} "
+        f"p50={resumo['p50_ms']:.2f}ms p95={resumo['p95_ms']:.2f}ms "
+        f"p99={resumo['p99_ms']:.2f}ms max={resumo['max_ms']:.2f}ms"
+    )
+
+
+def salvar_resultado(caminho, resultado):
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        json.dump(resultado, arquivo, indent=2, ensure_ascii=False, default=str)
+
+
+def versao_codigo():
+    """
+    Commit atual do repositório (com '-sujo' se houver alterações), para
+    identificar de onde veio cada resultado.
+    """
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        sujo = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-sujo" if sujo else commit
+
+
+def comparar_resultados(anterior, atual, metrica='p95_ms'):
+    """
+    Compara a mesma métrica de latência de dois resultados do bench_api,
+    endpoint a endpoint. Retorna linhas (endpoint, antes, depois, variação %).
+    """
+    linhas = []
+    for endpoint, dados in atual['endpoints'].items():
+        antes = anterior.get('endpoints', {}).get(endpoint, {}).get('latencia', {}).get(metrica)
+        depois = dados['latencia'].get(metrica)
+        variacao = round((depois - antes) / antes * 100, 1) if antes and depois is not None else None
+        linhas.append((endpoint, antes, depois, variacao))
+    return linhas
@@ -0,0 +1,184 @@
+"""
+Cache do saldo por usuário, para as consultas frequentes de /api/saldo/.
+
+Cada conta tem no cache uma versão (um contador) e o saldo guardado sob a
+chave da versão corrente. Uma leitura só usa o saldo da versão atual; na
+falta dele, lê o banco e o guarda com add, sem sobrescrever.
+
+As operações (write-through):
+- contas não fatiadas: a versão é incrementada dentro da transação, com a
+  linha da conta travada, e o saldo novo é gravado sob essa versão logo após
+  o commit. Como as escritas da conta são serializadas pelo lock, as versões
+  seguem a ordem dos commits e nenhum valor antigo sobrescreve um mais novo;
+- contas fatiadas (créditos sem lock) e operações do modo diário: a versão
+  é incrementada após o commit, e a próxima leitura busca o saldo no banco.
+
+No modo diário (OPERACOES_MODO='diario') o saldo lido do banco já inclui
+os lançamentos ainda não projetados.
+
+Assim, a partir do momento em que a operação responde, nenhuma leitura
+devolve o saldo anterior a ela. Com mais de um processo, use o backend
+'redis' (CACHE_BACKEND); o 'memoria' vale só dentro de cada processo.
+"""
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Sum
+from django.utils.http import parse_etags, quote_etag
+
+from . import metricas, replicas
+from .models import Correntista
+
+
+def _cache():
+    return caches['saldos']
+
+
+def chave_versao(user_id):
+    return f"saldo:{user_id}:versao"
+
+
+def chave_saldo(user_id, versao):
+    return f"saldo:{user_id}:{versao}"
+
+
+def _versao_inicial():
+    # Maior que qualquer versão anterior da mesma conta, caso a chave da
+    # versão tenha sido descartada do cache, para não reaproveitar saldos antigos
+    return time.time_ns()
+
+
+def _nova_versao(user_id):
+    cache = _cache()
+    try:
+        return cache.incr(chave_versao(user_id))
+    except ValueError:
+        cache.add(chave_versao(user_id), _versao_inicial(), timeout=None)
+        return cache.incr(chave_versao(user_id))
+
+
+def _versao_atual(cache, user_id):
+    versao = cache.get(chave_versao(user_id))
+    if versao is None:
+        cache.add(chave_versao(user_id), _versao_inicial(), timeout=None)
+        versao = cache.get(chave_versao(user_id))
+    return versao
+
+
+async def _aversao_atual(cache, user_id):
+    versao = await cache.aget(chave_versao(user_id))
+    if versao is None:
+        await cache.aadd(chave_versao(user_id), _versao_inicial(), timeout=None)
+        versao = await cache.aget(chave_versao(user_id))
+    return versao
+
+
+def carregar_saldo(user_id):
+    """
+    Saldo total da conta do usuário lido do banco, ou None sem conta.
+    """
+    if settings.OPERACOES_MODO == 'diario':
+        from . import diario
+        return diario.disponivel_usuario(user_id)
+    correntista = Correntista.objects.filter(user_id=user_id).only('saldo', 'fatias').first()
+    return None if correntista is None else correntista.saldo_total
+
+
+async def acarregar_saldo(user_id):
+    """
+    Versão assíncrona de carregar_saldo.
+    """
+    if settings.OPERACOES_MODO == 'diario':
+        from . import diario
+        return await sync_to_async(diario.disponivel_usuario)(user_id)
+    correntista = await Correntista.objects.filter(user_id=user_id).only('saldo', 'fatias').afirst()
+    if correntista is None:
+        return None
+    saldo = correntista.saldo
+    if correntista.fatias:
+        saldo += (await correntista.subsaldos.aaggregate(total=Sum('saldo')))['total'] or 0
+    return saldo
+
+
+def obter_saldo(user_id):
+    """
+    Saldo da conta do usuário, pelo cache quando possível. Retorna None se
+    o usuário não tiver conta.
+    """
+    if not settings.SALDO_CACHE_ATIVO:
+        return carregar_saldo(user_id)
+
+    cache = _cache()
+    versao = _versao_atual(cache, user_id)
+    saldo = cache.get(chave_saldo(user_id, versao))
+    if saldo is not None:
+        metricas.cache_saldo.somar(1, 'hit')
+        return saldo
+
+    metricas.cache_saldo.somar(1, 'miss')
+    saldo = carregar_saldo(user_id)
+    # O saldo lido numa réplica não é guardado: ela pode estar atrás do primário
+    if saldo is not None and replicas.replica_atual.get() is None:
+        cache.add(chave_saldo(user_id, versao), saldo)
+    return saldo
+
+
+async def aobter_saldo(user_id):
+    """
+    Versão assíncrona de obter_saldo, para views assíncronas.
+    """
+    if not settings.SALDO_CACHE_ATIVO:
+        return await acarregar_saldo(user_id)
+
+    cache = _cache()
+    versao = await _aversao_atual(cache, user_id)
+    saldo = await cache.aget(chave_saldo(user_id, versao))
+    if saldo is not None:
+        metricas.cache_saldo.somar(1, 'hit')
+        return saldo
+
+    metricas.cache_saldo.somar(1, 'miss')
+    saldo = await acarregar_saldo(user_id)
+    if saldo is not None and replicas.replica_atual.get() is None:
+        await cache.aadd(chave_saldo(user_id, versao), saldo)
+    return saldo
+
+
+def registrar_escrita(correntista):
+    """
+    Atualiza o cache com o saldo de uma conta alterada pela transação em
+    andamento. Para contas não fatiadas, deve ser chamada com a linha da
+    conta travada e com o saldo final em correntista.saldo (exceto no modo
+    diário, em que só a versão é incrementada). Faz também o dono da conta
+    ler do primário por um tempo (core/replicas.py).
+    """
+    replicas.fixar_primario(correntista.user_id)
+    if not settings.SALDO_CACHE_ATIVO:
+        return
+
+    user_id = correntista.user_id
+    if correntista.fatias or settings.OPERACOES_MODO == 'diario':
+        transaction.on_commit(lambda: _nova_versao(user_id))
+        return
+
+    versao = _nova_versao(user_id)
+    saldo = correntista.saldo
+    transaction.on_commit(lambda: _cache().set(chave_saldo(user_id, versao), saldo))
+
+
+def etag(saldo):
+    return quote_etag(str(saldo))
+
+
+def etag_confere(request, saldo):
+    """
+    Se o If-None-Match da requisição corresponde ao saldo (resposta 304).
+    """
+    cabecalho = request.headers.get('If-None-Match')
+    if not cabecalho:
+        return False
+    etags = parse_etags(cabecalho)
+    return '*' in etags or etag(saldo) in etags
@@ -0,0 +1,87 @@
+from decimal import Decimal
+
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Correntista, Movimentacao, SaldoCheckpoint, SubSaldo
+
+ZERO = Value(Decimal('0.00'), output_field=DecimalField(max_digits=10, decimal_places=2))
+
+
+def _liquido(movimentacoes):
+    """
+    Subconsulta com a soma dos créditos menos os débitos das movimentações
+    de uma conta (0 quando não há nenhuma).
+    """
+    liquido = (
+        movimentacoes.order_by()
+        .values('correntista')
+        .annotate(total=Sum(Case(
+            When(tipo_operacao='C', then=F('valor_operacao')),
+            default=-F('valor_operacao'),
+        )))
+        .values('total')
+    )
+    return Coalesce(Subquery(liquido), ZERO)
+
+
+def conciliar_intervalo(id_inicio, id_fim, corte_id, registrar=False):
+    """
+    Confere o saldo das contas com id em [id_inicio, id_fim) contra o razão,
+    partindo do checkpoint mais recente de cada uma.
+
+    Saldo, checkpoint e somas vêm de uma única consulta, portanto do mesmo
+    snapshot. Com 'registrar', as contas sem divergência e com movimentações
+    até 'corte_id' ganham um checkpoint novo na última delas, para que a
+    próxima conciliação comece dali.
+
+    Retorna (contas verificadas, lista de divergências).
+    """
+    ultimo_checkpoint = SaldoCheckpoint.objects.filter(correntista=OuterRef('pk')).order_by('-movimentacao_id')
+    posteriores = Movimentacao.objects.filter(correntista=OuterRef('pk'), id__gt=OuterRef('checkpoint_mov'))
+    subsaldos = (
+        SubSaldo.objects.filter(correntista=OuterRef('pk')).order_by()
+        .values('correntista').annotate(total=Sum('saldo')).values('total')
+    )
+
+    contas = (
+        Correntista.objects.filter(pk__gte=id_inicio, pk__lt=id_fim)
+        .annotate(
+            checkpoint_mov=Coalesce(Subquery(ultimo_checkpoint.values('movimentacao_id')[:1]), Value(0)),
+            checkpoint_saldo=Coalesce(Subquery(ultimo_checkpoint.values('saldo')[:1]), ZERO),
+            saldo_subsaldos=Coalesce(Subquery(subsaldos), ZERO),  # contas fatiadas
+        )
+        .annotate(
+            liquido_total=_liquido(posteriores),
+            liquido_corte=_liquido(posteriores.filter(id__lte=corte_id)),
+            ultima_corte=Subquery(posteriores.filter(id__lte=corte_id).order_by('-id').values('id')[:1]),
+        )
+        .values(
+            'pk', 'saldo', 'saldo_subsaldos', 'checkpoint_mov', 'checkpoint_saldo',
+            'liquido_total', 'liquido_corte', 'ultima_corte',
+        )
+    )
+
+    verificadas = 0
+    divergencias = []
+    checkpoints = []
+    for conta in contas:
+        verificadas += 1
+        saldo = conta['saldo'] + conta['saldo_subsaldos']
+        esperado = conta['checkpoint_saldo'] + conta['liquido_total']
+        if saldo != esperado:
+            divergencias.append({
+                'correntista_id': conta['pk'],
+                'saldo': saldo,
+                'esperado': esperado,
+                'diferenca': saldo - esperado,
+            })
+        elif registrar and conta['ultima_corte'] is not None:
+            checkpoints.append(SaldoCheckpoint(
+                correntista_id=conta['pk'],
+                movimentacao_id=conta['ultima_corte'],
+                saldo=conta['checkpoint_saldo'] + conta['liquido_corte'],
+            ))
+
+    SaldoCheckpoint.objects.bulk_create(checkpoints, batch_size=1000)
+    return verificadas, divergencias
@@ -1,33 +1,129 @@
+import asyncio
 import json
+import time
+from collections import deque
+from urllib.parse import parse_qs
+
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+
+from . import historico_notificacoes, metricas
+
+# Código de fechamento usado quando o cliente fica em silêncio por WS_TIMEOUT_OCIOSO
+CODIGO_OCIOSO = 4000
+
+
+class FilaSaida:
+    """
+    Fila limitada das notificações de uma conexão que ainda não foram
+    enviadas. Quando cheia, aplica a política configurada:
+    - 'descartar': descarta a notificação mais antiga;
+    - 'resumo': troca as notificações pendentes por um resumo com a
+      quantidade delas, enviado no próximo frame.
+    """
+
+    def __init__(self, limite, politica):
+        self.limite = max(limite, 1)
+        self.politica = politica
+        self.itens = deque()
+        self.resumidas = 0
+
+    def __len__(self):
+        return len(self.itens) + (1 if self.resumidas else 0)
+
+    def adicionar(self, notificacao):
+        if len(self.itens) >= self.limite:
+            if self.politica == 'descartar':
+                self.itens.popleft()
+                metricas.ws_notificacoes.somar(1, 'descartada')
+            else:
+                self.resumidas += len(self.itens)
+                metricas.ws_notificacoes.somar(len(self.itens), 'resumida')
+                self.itens.clear()
+        self.itens.append(notificacao)
+
+    def retirar(self):
+        """
+        Notificações pendentes (com o resumo na frente, se houver), esvaziando a fila.
+        """
+        lote = []
+        if self.resumidas:
+            lote.append({
+                'message': f'Você recebeu {self.resumidas} notificações enquanto a conexão estava lenta.',
+                'tipo': 'info',
+                'resumidas': self.resumidas,
+            })
+            self.resumidas = 0
+        lote.extend(self.itens)
+        self.itens.clear()
+        return lote
 
 
 class NotificationConsumer(AsyncWebsocketConsumer):
+    """
+    Notificações do usuário. Os handlers do channel layer só colocam a
+    notificação na fila da conexão, sem esperar pelo cliente; uma tarefa
+    separada envia o que chegou a cada WS_JANELA_MS num único frame (o objeto,
+    se for uma só notificação, ou uma lista). Assim um cliente lento não
+    segura a leitura do canal, e a fila dele é que descarta ou resume.
+
+    Com WS_HEARTBEAT, a conexão sem envios nesse intervalo recebe um
+    {"tipo": "ping"}; com WS_TIMEOUT_OCIOSO, é fechada se o cliente não
+    mandar nada (por exemplo o {"tipo": "pong"}) nesse tempo.
+
+    Cada notificação tem a sequência 'seq' do usuário. O cliente que
+    reconecta com ?seq=<última recebida> recebe, logo após as boas-vindas,
+    as notificações perdidas nesse intervalo; se parte delas não estiver
+    mais no histórico, recebe um {"tipo": "lacuna"} para recarregar o extrato.
+    As que chegam ao vivo podem vir fora de ordem de sequência.
+    """
+
     async def connect(self):
         # Pega o usuário da conexão
         self.user = self.scope.get("user")
-        
+        self.tarefas = []
+
         if self.user and self.user.is_authenticated:
             # Cada usuário tem seu próprio grupo de notificações
             self.group_name = f"notifications_{self.user.id}"
-            
+
             # Adiciona este canal ao grupo do usuário
             await self.channel_layer.group_add(
                 self.group_name,
                 self.channel_name
             )
-            
+
             await self.accept()
-            
-            # Envia mensagem de confirmação
+
+            # Sequência atual lida depois do group_add: o que vier depois chega pelo grupo
+            ultima = self._ultima_sequencia()
+            self.sequencia = await historico_notificacoes.asequencia_atual(self.user.id)
+
+            # Envia mensagem de confirmação, com a sequência a partir da qual o cliente está em dia
             await self.send(text_data=json.dumps({
                 'message': 'WebSocket conectado com sucesso!',
-                'tipo': 'info'
+                'tipo': 'info',
+                'conectado': True,
+                'seq': self.sequencia,
             }))
+            if ultima is not None:
+                await self._reenviar_perdidas(ultima)
+            # Ao vivo só são ignoradas as já cobertas pelas boas-vindas e pelo reenvio;
+            # as demais podem chegar fora de ordem (vários commits ou processos)
+            self.reenviadas_ate = self.sequencia
+
+            self.fila = FilaSaida(settings.WS_FILA_MAXIMA, settings.WS_POLITICA_FILA)
+            self.pendente = asyncio.Event()
+            self.ultimo_envio = self.ultima_entrada = time.monotonic()
+            self.tarefas.append(asyncio.create_task(self._enviar_pendentes()))
+            if settings.WS_HEARTBEAT or settings.WS_TIMEOUT_OCIOSO:
+                self.tarefas.append(asyncio.create_task(self._vigiar_conexao()))
         else:
             await self.close()
 
     async def disconnect(self, close_code):
+        for tarefa in self.tarefas:
+            tarefa.cancel()
         if hasattr(self, 'user') and self.user and self.user.is_authenticated:
             # Remove este canal do grupo
             await self.channel_layer.group_discard(
@@ -35,13 +131,64 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
 
-    async def receive(self, text_data):
-        # Pode ser usado para receber mensagens do cliente (opcional)
-        pass
+    async def receive(self, text_data=None, bytes_data=None):
+        # Qualquer mensagem do cliente (o pong, por exemplo) mantém a conexão viva
+        self.ultima_entrada = time.monotonic()
 
     # Handler para receber notificações do channel layer
     async def send_notification(self, event):
-        notification = event['notification']
-        
-        # Envia a notificação para o WebSocket
-        await self.send(text_data=json.dumps(notification))
+        notificacao = event['notification']
+        seq = notificacao.get('seq')
+        if seq is not None and seq <= self.reenviadas_ate:
+            return # já reenviada do histórico
+        self.fila.adicionar(notificacao)
+        self.pendente.set()
+
+    def _ultima_sequencia(self):
+        valor = parse_qs(self.scope.get('query_string', b'').decode()).get('seq', [None])[0]
+        try:
+            return int(valor)
+        except (TypeError, ValueError):
+            return None
+
+    async def _reenviar_perdidas(self, ultima):
+        perdidas, lacuna = await historico_notificacoes.aperdidas(self.user.id, ultima)
+        if lacuna:
+            await self.send(text_data=json.dumps({
+                'message': 'Algumas notificações não puderam ser recuperadas.',
+                'tipo': 'lacuna',
+                'seq': self.sequencia,
+            }))
+        if perdidas:
+            self.sequencia = max(self.sequencia, perdidas[-1]['seq'])
+            await self.send(text_data=json.dumps(perdidas[0] if len(perdidas) == 1 else perdidas))
+
+    async def _enviar_pendentes(self):
+        janela = settings.WS_JANELA_MS / 1000
+        while True:
+            await self.pendente.wait()
+            if janela:
+                # Junta as notificações que chegarem durante a janela
+                await asyncio.sleep(janela)
+            self.pendente.clear()
+            lote = self.fila.retirar()
+            if not lote:
+                continue
+            metricas.ws_notificacoes.somar(len(lote), 'enviada')
+            await self._enviar(lote[0] if len(lote) == 1 else lote)
+
+    async def _vigiar_conexao(self):
+        heartbeat, ocioso = settings.WS_HEARTBEAT, settings.WS_TIMEOUT_OCIOSO
+        intervalo = min(valor for valor in (heartbeat, ocioso) if valor)
+        while True:
+            await asyncio.sleep(intervalo)
+            agora = time.monotonic()
+            if ocioso and agora - self.ultima_entrada >= ocioso:
+                await self.close(code=CODIGO_OCIOSO)
+                return
+            if heartbeat and agora - self.ultimo_envio >= heartbeat:
+                await self._enviar({'tipo': 'ping'})
+
+    async def _enviar(self, conteudo):
+        self.ultimo_envio = time.monotonic()
+        await self.send(text_data=json.dumps(conteudo))
@@ -0,0 +1,245 @@
+"""
+Modo diário das operações (OPERACOES_MODO='diario').
+
+As operações não travam nem alteram a linha do Correntista: cada uma só
+acrescenta lançamentos (Lancamento) ao diário. O projetor (comando
+projetar_diario) os aplica em lotes: soma-os aos saldos e aos resumos
+diários e os move para Movimentacao, tudo na mesma transação. O diário só
+guarda, portanto, os lançamentos pendentes.
+
+O saldo disponível de uma conta é o saldo da linha, mais o dos subsaldos,
+mais o líquido dos lançamentos pendentes, lido numa única consulta. Os
+créditos não esperam por nada; os débitos de uma mesma conta são
+serializados por um advisory lock do Postgres (não pela linha da conta, que
+o projetor atualiza) e conferem o disponível antes de lançar.
+
+O extrato e os resumos mostram as operações depois de projetadas; saldo e
+conferência de débitos já as consideram ao serem lançadas.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, connections, router, transaction
+from django.db.models import Q
+
+from . import operacoes, resumos
+from .cache_saldo import registrar_escrita
+from .models import Correntista, Lancamento, Movimentacao
+
+# Primeira chave dos advisory locks de débito (a segunda é o id da conta)
+CHAVE_LOCK_DEBITOS = 0x6469
+# Advisory lock das projeções: compartilhado pelos projetores, exclusivo
+# para a conciliação calcular o corte
+CHAVE_LOCK_PROJECAO = (0x7072, 0)
+
+CAMPOS = (
+    'tipo_operacao', 'correntista_id', 'valor_operacao', 'data_operacao', 'descricao', 'correntista_beneficiario_id',
+)
+
+# SQL fixo: no caminho de todo débito, montar as subconsultas pelo ORM custa mais que executá-las
+_DISPONIVEL = (
+    "SELECT c.saldo "
+    "  + coalesce((SELECT sum(s.saldo) FROM core_subsaldo s WHERE s.correntista_id = c.id), 0) "
+    "  + coalesce((SELECT sum(CASE WHEN l.tipo_operacao = 'C' THEN l.valor_operacao ELSE -l.valor_operacao END) "
+    "              FROM core_lancamento l WHERE l.correntista_id = c.id), 0) "
+    "FROM core_correntista c WHERE c.{coluna} = %s"
+)
+
+
+def ativo():
+    return settings.OPERACOES_MODO == 'diario'
+
+
+def _disponivel(coluna, valor):
+    # Na réplica, quando chamado numa view de leitura (core/replicas.py)
+    with connections[router.db_for_read(Correntista)].cursor() as cursor:
+        cursor.execute(_DISPONIVEL.format(coluna=coluna), [valor])
+        linha = cursor.fetchone()
+    return None if linha is None else linha[0]
+
+
+def disponivel(correntista):
+    """
+    Saldo disponível da conta: saldo da linha, dos subsaldos e líquido dos
+    lançamentos pendentes, numa única consulta (mesmo snapshot).
+    """
+    return _disponivel('id', correntista.pk)
+
+
+def disponivel_usuario(user_id):
+    """
+    Saldo disponível da conta do usuário, ou None sem conta.
+    """
+    return _disponivel('user_id', user_id)
+
+
+def travar_debitos(correntista):
+    """
+    Serializa os débitos da conta até o fim da transação, sem travar a linha.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [CHAVE_LOCK_DEBITOS, correntista.pk])
+
+
+def esperar_projecoes():
+    """
+    Espera as projeções em andamento terminarem e segura as novas até o fim
+    da transação. As movimentações projetadas recebem ids novos, mas mantêm a
+    data do lançamento: sem isso, um corte calculado pela data poderia passar
+    do id de uma projeção ainda não confirmada.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", CHAVE_LOCK_PROJECAO)
+
+
+def _conta(user):
+    correntista = Correntista.objects.filter(user=user).first()
+    if correntista is None:
+        raise operacoes.ContaNaoEncontrada("Correntista não encontrado.")
+    return correntista
+
+
+def _lancar(lancamentos):
+    lancamentos = Lancamento.objects.bulk_create(lancamentos, batch_size=1000)
+    for conta in {lancamento.correntista.pk: lancamento.correntista for lancamento in lancamentos}.values():
+        registrar_escrita(conta)
+    return lancamentos
+
+
+def debitar(user, valor, descricao):
+    correntista = _conta(user)
+    travar_debitos(correntista)
+    if disponivel(correntista) < valor:
+        raise operacoes.SaldoInsuficiente("Saldo insuficiente.")
+    return _lancar([
+        Lancamento(tipo_operacao='D', correntista=correntista, valor_operacao=valor, descricao=descricao)
+    ])[0]
+
+
+def creditar(user, valor, descricao):
+    correntista = _conta(user)
+    return _lancar([
+        Lancamento(tipo_operacao='C', correntista=correntista, valor_operacao=valor, descricao=descricao)
+    ])[0]
+
+
+def transferir(user, destino_id, valor):
+    contas = list(Correntista.objects.filter(Q(user=user) | Q(pk=destino_id)))
+    origem = next((conta for conta in contas if conta.user_id == user.pk), None)
+    destino = next((conta for conta in contas if conta.pk == destino_id), None)
+    if origem is None or destino is None:
+        raise operacoes.ContaNaoEncontrada("Correntista de origem ou destino não encontrado.")
+    if origem.pk == destino.pk:
+        raise operacoes.MesmaConta("A conta de origem e destino não podem ser a mesma.")
+
+    travar_debitos(origem)
+    if disponivel(origem) < valor:
+        raise operacoes.SaldoInsuficiente("Saldo insuficiente no correntista de origem.")
+
+    debito, credito = _lancar([
+        Lancamento(
+            tipo_operacao='D', correntista=origem, valor_operacao=valor,
+            descricao=operacoes.descricao_transferencia_enviada(destino), correntista_beneficiario=destino,
+        ),
+        Lancamento(
+            tipo_operacao='C', correntista=destino, valor_operacao=valor,
+            descricao=operacoes.descricao_transferencia_recebida(origem), correntista_beneficiario=origem,
+        ),
+    ])
+    return debito, credito
+
+
+def processar_lote(user, itens, atomico):
+    """
+    Como operacoes.processar_lote, conferindo as operações contra o saldo
+    disponível da conta de origem e lançando tudo com um único bulk_create.
+    """
+    destino_ids = {dados['correntista_destino_id'] for _, tipo, dados in itens if tipo == 'transferencia'}
+    contas = {conta.pk: conta for conta in Correntista.objects.filter(Q(user=user) | Q(pk__in=destino_ids))}
+    origem = next((conta for conta in contas.values() if conta.user_id == user.pk), None)
+    if origem is None:
+        raise operacoes.ContaNaoEncontrada("Correntista não encontrado.")
+    travar_debitos(origem)
+    # Os itens são aplicados em memória sobre o saldo disponível
+    origem.saldo = disponivel(origem)
+
+    resultados = []
+    movimentacoes = []
+    for indice, tipo, dados in itens:
+        try:
+            movimentacoes.extend(operacoes.aplicar_item_lote(origem, contas, tipo, dados))
+        except operacoes.OperacaoError as erro:
+            resultados.append({'indice': indice, 'status': erro.status, 'erro': erro.mensagem})
+            continue
+        resultados.append({'indice': indice, 'status': 200})
+
+    if atomico and any('erro' in resultado for resultado in resultados):
+        raise operacoes.LoteRejeitado("Lote rejeitado: nenhuma operação foi aplicada.", resultados)
+
+    lancamentos = _lancar([
+        Lancamento(
+            tipo_operacao=movimentacao.tipo_operacao,
+            correntista=movimentacao.correntista,
+            valor_operacao=movimentacao.valor_operacao,
+            descricao=movimentacao.descricao,
+            correntista_beneficiario=movimentacao.correntista_beneficiario,
+        )
+        for movimentacao in movimentacoes
+    ]) if movimentacoes else []
+    return resultados, lancamentos
+
+
+def pendentes():
+    return Lancamento.objects.count()
+
+
+def projetar(limite=None):
+    """
+    Aplica até 'limite' lançamentos do diário, em ordem de id, numa
+    transação. Lançamentos travados por outro projetor são pulados (SKIP
+    LOCKED), e as contas são travadas em ordem de chave primária. Retorna
+    quantos foram aplicados.
+    """
+    limite = limite or settings.DIARIO_LOTE_PROJECAO
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            # Ver esperar_projecoes
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock_shared(%s, %s)", CHAVE_LOCK_PROJECAO)
+        lancamentos = list(
+            Lancamento.objects.select_for_update(skip_locked=True).order_by('id')[:limite]
+        )
+        if not lancamentos:
+            return 0
+
+        liquido = defaultdict(Decimal)
+        for lancamento in lancamentos:
+            sinal = 1 if lancamento.tipo_operacao == 'C' else -1
+            liquido[lancamento.correntista_id] += sinal * lancamento.valor_operacao
+        contas = {
+            conta.pk: conta
+            for conta in Correntista.objects.select_for_update(no_key=True).filter(pk__in=liquido).order_by('pk')
+        }
+        for conta in contas.values():
+            conta.saldo += liquido[conta.pk]
+        Correntista.objects.bulk_update(contas.values(), ['saldo'], batch_size=500)
+
+        for lancamento in lancamentos:
+            lancamento.correntista = contas[lancamento.correntista_id]
+        resumos.registrar(lancamentos)
+
+        # Movidos pelo banco, com a data do lançamento (auto_now_add a trocaria no bulk_create)
+        ids = [lancamento.pk for lancamento in lancamentos]
+        colunas = ', '.join(CAMPOS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"WITH movidos AS ("
+                f"  DELETE FROM {Lancamento._meta.db_table} WHERE id IN ({', '.join(['%s'] * len(ids))}) "
+                f"  RETURNING id, {colunas}"
+                f") INSERT INTO {Movimentacao._meta.db_table} ({colunas}) SELECT {colunas} FROM movidos ORDER BY id",
+                ids,
+            )
+    return len(lancamentos)
@@ -0,0 +1,135 @@
+"""
+Exportação do extrato completo em CSV ou NDJSON, gerada enquanto é enviada.
+
+As movimentações são lidas com um cursor do lado do servidor
+(QuerySet.iterator/aiterator), em lotes de TAMANHO_LOTE linhas, e cada lote
+vira um pedaço da resposta. A memória usada não depende do tamanho do
+histórico, e o cabeçalho sai antes da primeira consulta.
+"""
+import csv
+import io
+import json
+import zlib
+
+from .serializers import MovimentacaoExtratoSerializer
+
+TAMANHO_LOTE = 2000
+
+FORMATOS = {
+    # formato: (content type, extensão)
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+COLUNAS_CSV = (
+    'id', 'data_operacao', 'tipo_operacao', 'valor_operacao', 'descricao',
+    'correntista_beneficiario_id', 'correntista_beneficiario_nome',
+)
+
+
+class Formatador:
+    """
+    Converte lotes de linhas de consulta_extrato no texto do formato pedido.
+    """
+
+    def __init__(self, formato, correntista):
+        self.formato = formato
+        self.serializer = MovimentacaoExtratoSerializer(context={'correntista': correntista})
+
+    def cabecalho(self):
+        if self.formato == 'csv':
+            return self._csv([COLUNAS_CSV])
+        return ''
+
+    def lote(self, linhas):
+        if self.formato == 'csv':
+            return self._csv(
+                (
+                    linha['id'],
+                    MovimentacaoExtratoSerializer.formatar_data(linha['data_operacao']),
+                    linha['tipo_operacao'],
+                    linha['valor_operacao'],
+                    linha['descricao'],
+                    linha['correntista_beneficiario_id'],
+                    linha['correntista_beneficiario__nome_correntista'],
+                )
+                for linha in linhas
+            )
+        return ''.join(
+            json.dumps(self.serializer.to_representation(linha), ensure_ascii=False) + '\n'
+            for linha in linhas
+        )
+
+    @staticmethod
+    def _csv(linhas):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(linhas)
+        return buffer.getvalue()
+
+
+class Compressor:
+    """
+    gzip incremental: cada pedaço é descarregado com Z_SYNC_FLUSH, para o
+    cliente receber os dados à medida que são gerados.
+    """
+
+    def __init__(self):
+        self._zlib = zlib.compressobj(wbits=31)  # 31: formato gzip
+
+    def pedaco(self, dados):
+        return self._zlib.compress(dados) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def fim(self):
+        return self._zlib.flush()
+
+
+def _lotes(iterador, tamanho):
+    lote = []
+    for linha in iterador:
+        lote.append(linha)
+        if len(lote) == tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def gerar(queryset, formatador, compactar=False):
+    """
+    Pedaços (bytes) da exportação, lendo o queryset com um cursor do lado do servidor.
+    """
+    compressor = Compressor() if compactar else None
+
+    def saida(texto):
+        dados = texto.encode('utf-8')
+        return compressor.pedaco(dados) if compressor else dados
+
+    yield saida(formatador.cabecalho())
+    for lote in _lotes(queryset.iterator(chunk_size=TAMANHO_LOTE), TAMANHO_LOTE):
+        yield saida(formatador.lote(lote))
+    if compressor:
+        yield compressor.fim()
+
+
+async def agerar(queryset, formatador, compactar=False):
+    """
+    Versão assíncrona de gerar, para servir pelo ASGI sem juntar a resposta
+    inteira em memória (o Django faz isso com iteradores síncronos no ASGI).
+    """
+    compressor = Compressor() if compactar else None
+
+    def saida(texto):
+        dados = texto.encode('utf-8')
+        return compressor.pedaco(dados) if compressor else dados
+
+    yield saida(formatador.cabecalho())
+    lote = []
+    async for linha in queryset.aiterator(chunk_size=TAMANHO_LOTE):
+        lote.append(linha)
+        if len(lote) == TAMANHO_LOTE:
+            yield saida(formatador.lote(lote))
+            lote = []
+    if lote:
+        yield saida(formatador.lote(lote))
+    if compressor:
+        yield compressor.fim()
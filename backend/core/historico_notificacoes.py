@@ -0,0 +1,110 @@
+"""
+Histórico curto das notificações de cada usuário, para o WebSocket
+reenviar o que o cliente perdeu enquanto estava desconectado.
+
+Cada notificação recebe um número de sequência por usuário, crescente, e
+fica guardada no cache 'notificacoes' sob esse número. Só as últimas
+NOTIFICACOES_HISTORICO_MAX de cada usuário são mantidas: ao gravar a de
+número n, a de número n - NOTIFICACOES_HISTORICO_MAX é removida (e todas
+expiram após o TIMEOUT do cache).
+
+Ao reconectar, o cliente informa a última sequência que recebeu e o
+consumer reenvia só as seguintes. Se alguma delas não estiver mais no
+histórico, o cliente é avisado para recarregar o extrato. Com mais de um
+processo, use o backend 'redis' (CACHE_BACKEND).
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def _cache():
+    return caches['notificacoes']
+
+
+def chave_sequencia(user_id):
+    return f"notif:{user_id}:seq"
+
+
+def chave_notificacao(user_id, seq):
+    return f"notif:{user_id}:{seq}"
+
+
+def _sequencia_inicial():
+    # Maior que qualquer sequência anterior do usuário, caso a chave tenha
+    # sido descartada do cache; em milissegundos, para caber num Number do JS
+    return time.time_ns() // 1_000_000
+
+
+def _nova_sequencia(cache, user_id):
+    try:
+        return cache.incr(chave_sequencia(user_id))
+    except ValueError:
+        cache.add(chave_sequencia(user_id), _sequencia_inicial(), timeout=None)
+        return cache.incr(chave_sequencia(user_id))
+
+
+async def _anova_sequencia(cache, user_id):
+    try:
+        return await cache.aincr(chave_sequencia(user_id))
+    except ValueError:
+        await cache.aadd(chave_sequencia(user_id), _sequencia_inicial(), timeout=None)
+        return await cache.aincr(chave_sequencia(user_id))
+
+
+def registrar(user_id, notificacao):
+    """
+    Numera a notificação (campo 'seq', preenchido no próprio dicionário) e a
+    guarda no histórico do usuário.
+    """
+    cache = _cache()
+    seq = notificacao['seq'] = _nova_sequencia(cache, user_id)
+    cache.set(chave_notificacao(user_id, seq), notificacao)
+    cache.delete(chave_notificacao(user_id, seq - settings.NOTIFICACOES_HISTORICO_MAX))
+
+
+async def aregistrar(user_id, notificacao):
+    """
+    Versão assíncrona de registrar.
+    """
+    cache = _cache()
+    seq = notificacao['seq'] = await _anova_sequencia(cache, user_id)
+    await cache.aset(chave_notificacao(user_id, seq), notificacao)
+    await cache.adelete(chave_notificacao(user_id, seq - settings.NOTIFICACOES_HISTORICO_MAX))
+
+
+async def asequencia_atual(user_id):
+    """
+    Última sequência usada para o usuário. Se ainda não houver, inicia a
+    contagem, para o cliente ter desde já a referência a informar ao reconectar.
+    """
+    cache = _cache()
+    seq = await cache.aget(chave_sequencia(user_id))
+    if seq is None:
+        await cache.aadd(chave_sequencia(user_id), _sequencia_inicial(), timeout=None)
+        seq = await cache.aget(chave_sequencia(user_id))
+    return seq
+
+
+async def aperdidas(user_id, ultima):
+    """
+    Notificações do usuário posteriores à sequência 'ultima', em ordem, e
+    se parte delas já saiu do histórico (lacuna).
+    """
+    atual = await _cache().aget(chave_sequencia(user_id))
+    if atual is None:
+        # Sem sequência no cache não há como saber o que foi perdido
+        return [], True
+    if ultima >= atual:
+        return [], False
+
+    primeira = max(ultima + 1, atual - settings.NOTIFICACOES_HISTORICO_MAX + 1)
+    sequencias = range(primeira, atual + 1)
+    guardadas = await _cache().aget_many([chave_notificacao(user_id, seq) for seq in sequencias])
+    notificacoes = [
+        guardadas[chave_notificacao(user_id, seq)]
+        for seq in sequencias
+        if chave_notificacao(user_id, seq) in guardadas
+    ]
+    return notificacoes, len(notificacoes) < atual - ultima
@@ -0,0 +1,134 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import ChaveIdempotencia
+
+HEADER = 'Idempotency-Key'
+HEADER_REPETIDA = 'Idempotent-Replayed'
+
+
+def hash_requisicao(path, dados):
+    """
+    Resumo do caminho e do corpo da requisição, para detectar a mesma chave
+    reutilizada com outra operação.
+    """
+    corpo = json.dumps(dados, sort_keys=True, default=str)
+    return hashlib.sha256(f"{path}\n{corpo}".encode()).hexdigest()
+
+
+def limite_validade():
+    """
+    Instante a partir do qual uma chave registrada ainda vale.
+    """
+    return timezone.now() - timedelta(seconds=settings.IDEMPOTENCIA_TTL)
+
+
+def chave_valida(chave):
+    return len(chave) <= ChaveIdempotencia._meta.get_field('chave').max_length
+
+
+def resposta_guardada(registro, hash_atual):
+    """
+    Status e corpo a devolver para uma chave já processada, e se é uma
+    repetição legítima (False quando a chave veio com outra requisição).
+    """
+    if registro.hash_requisicao != hash_atual:
+        return status.HTTP_422_UNPROCESSABLE_ENTITY, {"erro": f"{HEADER} já utilizada com outra requisição."}, False
+    return registro.status_code, registro.resposta, True
+
+
+def _repetir(registro, hash_atual):
+    """
+    Devolve a resposta guardada de uma requisição já processada.
+    """
+    status_code, corpo, repetida = resposta_guardada(registro, hash_atual)
+    resposta = Response(corpo, status=status_code)
+    if repetida:
+        resposta[HEADER_REPETIDA] = 'true'
+    return resposta
+
+
+def executar_idempotente(user, chave, endpoint, hash_atual, executar, expirado=None):
+    """
+    Executa 'executar' registrando a chave no mesmo commit, junto com a
+    resposta devolvida (qualquer objeto com status_code e data).
+
+    Duas requisições simultâneas com a mesma chave esperam uma pela outra no
+    índice único: a segunda só segue depois do commit da primeira (e recebe
+    o registro dela) ou do rollback (e executa normalmente).
+
+    Retorna (resposta, None), ou (None, registro) quando outra requisição com
+    a mesma chave terminou antes. 'expirado' é o registro vencido da mesma
+    chave, se houver, removido na mesma transação.
+    """
+    with transaction.atomic():
+        if expirado is not None:
+            # Chave expirada que a limpeza ainda não removeu
+            expirado.delete()
+        try:
+            with transaction.atomic():
+                registro = ChaveIdempotencia.objects.create(
+                    user=user,
+                    chave=chave,
+                    endpoint=endpoint,
+                    hash_requisicao=hash_atual,
+                )
+        except IntegrityError:
+            # Outra requisição com a mesma chave terminou enquanto esta esperava
+            return None, ChaveIdempotencia.objects.get(user=user, chave=chave)
+
+        resposta = executar()
+
+        registro.status_code = resposta.status_code
+        registro.resposta = resposta.data
+        registro.save(update_fields=['status_code', 'resposta'])
+
+    return resposta, None
+
+
+def idempotente(endpoint):
+    """
+    Torna uma view de operação idempotente pelo header Idempotency-Key.
+
+    Deve ficar entre @api_view e @limitar (ou @transaction.atomic): as
+    repetições não passam pelos limites das operações. A primeira requisição
+    com uma chave grava um registro no mesmo commit da operação, junto com a
+    resposta enviada. As repetições devolvem essa resposta com uma única
+    leitura, sem travar contas nem tocar no razão.
+
+    Requisições sem o header funcionam como antes. Erros de validação e
+    exceções desfazem o registro, então a chave pode ser usada de novo.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            chave = request.headers.get(HEADER)
+            if not chave:
+                return view(request, *args, **kwargs)
+            if not chave_valida(chave):
+                return Response({"erro": f"{HEADER} muito longa."}, status=status.HTTP_400_BAD_REQUEST)
+
+            hash_atual = hash_requisicao(request.path, request.data)
+            registro = ChaveIdempotencia.objects.filter(user=request.user, chave=chave).first()
+            if registro is not None and registro.criado_em >= limite_validade():
+                return _repetir(registro, hash_atual)
+
+            response, anterior = executar_idempotente(
+                request.user, chave, endpoint, hash_atual,
+                lambda: view(request, *args, **kwargs),
+                expirado=registro,
+            )
+            if anterior is not None:
+                return _repetir(anterior, hash_atual)
+            return response
+        return wrapper
+    return decorator
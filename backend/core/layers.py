@@ -0,0 +1,22 @@
+from channels.layers import InMemoryChannelLayer
+
+
+class CanalLocalLayer(InMemoryChannelLayer):
+    """
+    Channel layer em processo para os testes. Aceita a mesma configuração
+    (expiry, group_expiry, capacity) do layer Redis e guarda cada group_send
+    em 'enviados', para que os testes verifiquem as notificações sem precisar
+    de um consumer conectado.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.enviados = []
+
+    async def group_send(self, group, message):
+        self.enviados.append((group, message))
+        await super().group_send(group, message)
+
+    async def flush(self):
+        self.enviados = []
+        await super().flush()
@@ -0,0 +1,257 @@
+"""
+Limites das operações: taxa por usuário e endpoint e admissão por processo.
+
+Cada usuário tem, por endpoint, um token bucket com as taxas de
+REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] ('N/periodo'): até N fichas,
+repostas à razão de N por período. Cada operação gasta uma ficha; sem
+fichas, a requisição recebe 429 com Retry-After. Os baldes ficam na memória
+do processo ('memoria') ou no Redis ('redis', compartilhado entre os
+processos, atualizados por um script Lua atômico), conforme LIMITES_BACKEND.
+
+Depois do limite do usuário, a admissão conta as operações em andamento no
+processo: acima de OPERACOES_SIMULTANEAS_MAX, a requisição recebe 503 na
+hora, em vez de esperar pelo lock de uma conta. As repetições de uma
+Idempotency-Key já processada não passam pelas barreiras; numa chave nova,
+uma recusa desfaz o registro dela. LIMITES_ATIVOS=False desliga as duas
+barreiras.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from rest_framework import exceptions
+from rest_framework.settings import api_settings
+
+from . import metricas
+
+DURACOES = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Baldes guardados num hash por chave, com o relógio do próprio Redis
+_SCRIPT_BALDE = """
+local capacidade = tonumber(ARGV[1])
+local taxa = tonumber(ARGV[2])
+local tempo = redis.call('TIME')
+local agora = tonumber(tempo[1]) + tonumber(tempo[2]) / 1000000
+local balde = redis.call('HMGET', KEYS[1], 'fichas', 'instante')
+local fichas = tonumber(balde[1]) or capacidade
+local instante = tonumber(balde[2]) or agora
+fichas = math.min(capacidade, fichas + math.max(0, agora - instante) * taxa)
+local permitido = 0
+if fichas >= 1 then
+    fichas = fichas - 1
+    permitido = 1
+end
+redis.call('HSET', KEYS[1], 'fichas', tostring(fichas), 'instante', tostring(agora))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacidade / taxa) + 1)
+return {permitido, tostring(fichas)}
+"""
+
+
+class Sobrecarga(exceptions.APIException):
+    status_code = 503
+    default_detail = "Servidor sobrecarregado, tente novamente em instantes."
+    default_code = 'sobrecarga'
+    wait = 1 # segundos do Retry-After
+
+
+def interpretar_taxa(taxa):
+    """
+    'N/periodo' (periodo começando por s, m, h ou d, como no DRF) em
+    (capacidade, fichas por segundo).
+    """
+    quantidade, periodo = taxa.split('/')
+    quantidade = int(quantidade)
+    return quantidade, quantidade / DURACOES[periodo[0]]
+
+
+class BaldesMemoria:
+    """
+    Baldes deste processo, num dicionário protegido por um lock.
+    """
+    # Acima disso, os baldes já cheios (iguais a um balde novo) são descartados
+    MAXIMO = 10000
+
+    def __init__(self):
+        self._baldes = {}
+        self._lock = threading.Lock()
+
+    def consumir(self, chave, capacidade, taxa):
+        """
+        Tenta gastar uma ficha. Retorna (permitido, segundos até a próxima ficha).
+        """
+        agora = time.monotonic()
+        with self._lock:
+            fichas, instante, _, _ = self._baldes.get(chave, (capacidade, agora, capacidade, taxa))
+            fichas = min(capacidade, fichas + (agora - instante) * taxa)
+            permitido = fichas >= 1
+            if permitido:
+                fichas -= 1
+            if len(self._baldes) >= self.MAXIMO and chave not in self._baldes:
+                self._descartar_cheios(agora)
+            self._baldes[chave] = (fichas, agora, capacidade, taxa)
+        return permitido, 0 if permitido else (1 - fichas) / taxa
+
+    async def aconsumir(self, chave, capacidade, taxa):
+        return self.consumir(chave, capacidade, taxa)
+
+    def _descartar_cheios(self, agora):
+        self._baldes = {
+            chave: balde for chave, balde in self._baldes.items()
+            if balde[0] + (agora - balde[1]) * balde[3] < balde[2]
+        }
+
+    def limpar(self):
+        with self._lock:
+            self._baldes.clear()
+
+
+class BaldesRedis:
+    """
+    Baldes compartilhados no Redis (REDIS_URL).
+    """
+
+    def __init__(self, url):
+        import redis
+        self._script = redis.Redis.from_url(url).register_script(_SCRIPT_BALDE)
+
+    def consumir(self, chave, capacidade, taxa):
+        permitido, fichas = self._script(keys=[f"limite:{chave}"], args=[capacidade, taxa])
+        if permitido:
+            return True, 0
+        return False, (1 - float(fichas)) / taxa
+
+    async def aconsumir(self, chave, capacidade, taxa):
+        return await sync_to_async(self.consumir, thread_sensitive=False)(chave, capacidade, taxa)
+
+
+@lru_cache
+def _criar_baldes(backend):
+    if backend == 'redis':
+        return BaldesRedis(settings.REDIS_URL)
+    return BaldesMemoria()
+
+
+def baldes():
+    return _criar_baldes(settings.LIMITES_BACKEND)
+
+
+def _taxa(endpoint):
+    taxa = api_settings.DEFAULT_THROTTLE_RATES.get(endpoint)
+    return None if taxa is None else interpretar_taxa(taxa)
+
+
+def _recusar(endpoint, espera):
+    metricas.rejeicoes.somar(1, endpoint, 'limite')
+    raise exceptions.Throttled(wait=espera)
+
+
+def conferir_limite(endpoint, user_id):
+    """
+    Gasta uma ficha do balde do usuário no endpoint, ou levanta Throttled (429).
+    """
+    taxa = _taxa(endpoint)
+    if taxa is None:
+        return
+    permitido, espera = baldes().consumir(f"{endpoint}:{user_id}", *taxa)
+    if not permitido:
+        _recusar(endpoint, espera)
+
+
+async def aconferir_limite(endpoint, user_id):
+    """
+    Versão assíncrona de conferir_limite.
+    """
+    taxa = _taxa(endpoint)
+    if taxa is None:
+        return
+    permitido, espera = await baldes().aconsumir(f"{endpoint}:{user_id}", *taxa)
+    if not permitido:
+        _recusar(endpoint, espera)
+
+
+class Admissao:
+    """
+    Operações em andamento neste processo (views síncronas e assíncronas).
+    """
+
+    def __init__(self):
+        self.em_andamento = 0
+        self._lock = threading.Lock()
+
+    def entrar(self, maximo):
+        with self._lock:
+            if maximo and self.em_andamento >= maximo:
+                return False
+            self.em_andamento += 1
+        metricas.operacoes_em_andamento.somar(1)
+        return True
+
+    def sair(self):
+        with self._lock:
+            self.em_andamento -= 1
+        metricas.operacoes_em_andamento.somar(-1)
+
+
+admissao = Admissao()
+
+
+@contextmanager
+def admitir(endpoint):
+    """
+    Ocupa uma vaga de operação durante o bloco, ou levanta Sobrecarga (503).
+    """
+    if not admissao.entrar(settings.OPERACOES_SIMULTANEAS_MAX):
+        metricas.rejeicoes.somar(1, endpoint, 'sobrecarga')
+        raise Sobrecarga()
+    try:
+        yield
+    finally:
+        admissao.sair()
+
+
+def executar_limitado(endpoint, user_id, executar):
+    """
+    Chama executar() depois do limite do usuário no endpoint e dentro da
+    admissão. Com LIMITES_ATIVOS=False, chama direto.
+    """
+    if not settings.LIMITES_ATIVOS:
+        return executar()
+    conferir_limite(endpoint, user_id)
+    with admitir(endpoint):
+        return executar()
+
+
+async def aexecutar_limitado(endpoint, user_id, executar):
+    """
+    Versão assíncrona de executar_limitado, para uma corrotina executar().
+    """
+    if not settings.LIMITES_ATIVOS:
+        return await executar()
+    await aconferir_limite(endpoint, user_id)
+    with admitir(endpoint):
+        return await executar()
+
+
+def limitar(endpoint):
+    """
+    Aplica à view de operação o limite do usuário e a admissão, antes de
+    tudo o que usa o banco. Vai abaixo do @api_view (ou do @api_async), com
+    request.user já autenticado, e do @idempotente: as repetições de uma
+    Idempotency-Key já processada devolvem a resposta guardada sem gastar
+    fichas nem vaga.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                return await aexecutar_limitado(endpoint, request.user.pk, lambda: view(request, *args, **kwargs))
+            return wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            return executar_limitado(endpoint, request.user.pk, lambda: view(request, *args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,340 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from http.client import HTTPConnection
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import resumos, semeadura
+from core.benchmark import (
+    comparar_resultados,
+    formatar_resumo,
+    resumo_latencias,
+    salvar_resultado,
+    versao_codigo,
+)
+from core.metricas import MedidorConsultas
+from core.models import Correntista
+
+PREFIXO = 'bench_'
+SALDO_INICIAL = Decimal('1000000.00')
+# Período das movimentações semeadas, até agora
+DIAS = 30
+VALOR = Decimal('1.00')
+
+# nome: (método, caminho)
+ENDPOINTS = {
+    'extrato': ('get', '/api/extrato/'),
+    'saldo': ('get', '/api/saldo/'),
+    'resumo': ('get', '/api/extrato/resumo/?periodo=mes'),
+    'pagamento': ('post', '/api/pagar/'),
+    'transferencia': ('post', '/api/transferir/'),
+    'saque': ('post', '/api/sacar/'),
+    'deposito': ('post', '/api/depositar/'),
+}
+
+
+def _dados_requisicao(endpoint, rng, conta, destinos):
+    if endpoint == 'pagamento':
+        return {'valor': str(VALOR), 'descricao': 'Benchmark'}
+    if endpoint == 'transferencia':
+        destino = rng.choice(destinos)
+        while destino.pk == conta.pk and len(destinos) > 1:
+            destino = rng.choice(destinos)
+        return {'correntista_destino_id': destino.pk, 'valor': str(VALOR)}
+    if endpoint in ('saque', 'deposito'):
+        return {'valor': str(VALOR)}
+    return None
+
+
+def _fechar_conexao():
+    connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Semeia contas e movimentações de benchmark e mede latência, consultas por "
+        "requisição e espera por lock dos endpoints da API, além da entrega das "
+        "notificações pelo WebSocket. Grava o resultado em JSON para comparar commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contas', type=int, default=100, help="Contas de benchmark (usuários bench_*).")
+        parser.add_argument('--movimentacoes', type=int, default=10000, help="Movimentações semeadas no total.")
+        parser.add_argument('--recriar', action='store_true', help="Apaga e recria as contas de benchmark.")
+        parser.add_argument('--requisicoes', type=int, default=500, help="Requisições por endpoint.")
+        parser.add_argument('--concorrencia', type=int, default=8, help="Threads enviando requisições ao mesmo tempo.")
+        parser.add_argument('--contas-ativas', type=int,
+                            help="Sorteia as requisições entre só estas contas (poucas contas = mais disputa por lock).")
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                            help="Endpoints medidos, separados por vírgula.")
+        parser.add_argument('--ws-mensagens', type=int, default=100,
+                            help="Notificações medidas pelo WebSocket (0 desativa).")
+        parser.add_argument('--destino-unico', action='store_true',
+                            help="Todas as transferências vão para a primeira conta (conta quente); "
+                                 "fatie-a antes com fatiar_saldo para comparar.")
+        parser.add_argument('--servidor',
+                            help="URL de um servidor já rodando (ex.: http://localhost:8000): as requisições vão "
+                                 "por HTTP, incluindo o custo de conexão ao banco do servidor, sem contar consultas e locks.")
+        parser.add_argument('--com-limites', action='store_true',
+                            help="Mantém os limites por usuário e a admissão (core/limites.py), desligados por padrão "
+                                 "para as latências não virem de recusas rápidas. Com --servidor, valem os do servidor.")
+        parser.add_argument('--timeout', type=float, default=5.0, help="Segundos de espera por notificação.")
+        parser.add_argument('--semente', type=int, default=42)
+        parser.add_argument('--saida', help="Arquivo JSON para gravar o resultado.")
+        parser.add_argument('--comparar', help="Resultado JSON anterior para comparar o p95.")
+
+    def handle(self, *args, **options):
+        endpoints = [nome.strip() for nome in options['endpoints'].split(',') if nome.strip()]
+        desconhecidos = set(endpoints) - set(ENDPOINTS)
+        if desconhecidos:
+            raise CommandError(f"Endpoints desconhecidos: {', '.join(sorted(desconhecidos))}.")
+        if connection.vendor != 'postgresql':
+            self.stdout.write(self.style.WARNING(
+                f"Banco '{connection.vendor}': os números de lock só são representativos no Postgres."
+            ))
+
+        contas = self._semear(options['contas'], options['movimentacoes'], options['recriar'], options['semente'])
+        ativas = contas[:options['contas_ativas']] if options['contas_ativas'] else contas
+        destinos = contas
+        if options['destino_unico']:
+            destinos = contas[:1]
+            ativas = [conta for conta in ativas if conta.pk != destinos[0].pk]
+
+        resultado = {
+            'versao': versao_codigo(),
+            'executado_em': timezone.now().isoformat(),
+            'banco': connection.vendor,
+            'parametros': {
+                chave: options[chave]
+                for chave in (
+                    'contas', 'movimentacoes', 'requisicoes', 'concorrencia', 'contas_ativas', 'destino_unico',
+                'servidor', 'semente', 'com_limites'
+                )
+            },
+            'endpoints': {},
+        }
+
+        limites = override_settings() if options['com_limites'] else override_settings(LIMITES_ATIVOS=False)
+        for endpoint in endpoints:
+            with limites:
+                dados = self._medir_endpoint(endpoint, ativas, destinos, options)
+            resultado['endpoints'][endpoint] = dados
+            banco = '' if options['servidor'] else (
+                f"{dados['consultas_por_requisicao']['media']} consultas/req | "
+                f"lock p95={dados['espera_lock']['p95_ms']}ms | "
+            )
+            self.stdout.write(
+                f"{formatar_resumo(endpoint, dados['latencia'])} | {dados['vazao_rps']} req/s | "
+                f"{banco}erros={dados['erros']}"
+            )
+
+        if options['ws_mensagens']:
+            resultado['websocket'] = asyncio.run(
+                self._medir_websocket(contas[0], options['ws_mensagens'], options['timeout'])
+            )
+            self.stdout.write(formatar_resumo('websocket', resultado['websocket']['ponta_a_ponta']))
+
+        if options['comparar']:
+            with open(options['comparar'], encoding='utf-8') as arquivo:
+                anterior = json.load(arquivo)
+            self.stdout.write(f"p95 em relação a {anterior.get('versao')}:")
+            for endpoint, antes, depois, variacao in comparar_resultados(anterior, resultado):
+                sinal = '' if variacao is None else f" ({variacao:+.1f}%)"
+                self.stdout.write(f"  {endpoint}: {antes} -> {depois} ms{sinal}")
+
+        if options['saida']:
+            salvar_resultado(options['saida'], resultado)
+            self.stdout.write(self.style.SUCCESS(f"Resultado gravado em {options['saida']}"))
+
+    def _semear(self, total_contas, total_movimentacoes, recriar, semente):
+        """
+        Cria as contas de benchmark pelo mesmo caminho do seed_bank
+        (core/semeadura.py): usuários com senha 123456, contas, movimentações
+        do último mês sem contas quentes e saldos coerentes com o razão, a
+        partir do saldo de abertura SALDO_INICIAL, mais um token por conta.
+        Contas já semeadas com a mesma quantidade são reaproveitadas.
+        """
+        existentes = Correntista.objects.filter(user__username__startswith=PREFIXO)
+        if not recriar and existentes.count() == total_contas:
+            return self._carregar_contas()
+
+        inicio = time.monotonic()
+        semeadura.apagar_contas(PREFIXO)
+        fim_periodo = timezone.now()
+        inicio_periodo = fim_periodo - timedelta(days=DIAS)
+        semeadura.garantir_particoes(inicio_periodo, fim_periodo)
+
+        nomes = semeadura.nomes_contas(semente, total_contas)
+        ids = semeadura.criar_contas(nomes, PREFIXO)
+        Token.objects.bulk_create([
+            Token(key=Token.generate_key(), user_id=user_id)
+            for user_id in Correntista.objects.filter(pk__in=ids).values_list('user_id', flat=True)
+        ], batch_size=1000)
+
+        saldos = semeadura.Saldos([int(SALDO_INICIAL * 100)] * total_contas)
+        if total_movimentacoes:
+            linhas, totais = semeadura.gerar_lote(
+                semente, 0, total_movimentacoes, ids, nomes, semeadura.Distribuicao(total_contas, 0, 0),
+                inicio_periodo, fim_periodo - inicio_periodo,
+            )
+            semeadura.gravar_lote(semeadura.reservar_ids_movimentacoes(total_movimentacoes), linhas)
+            saldos.somar(totais)
+        semeadura.gravar_saldos(ids, saldos.finais())
+        if connection.vendor != 'postgresql':
+            # No Postgres, os resumos diários já foram somados junto do COPY
+            resumos.reconstruir(ids)
+
+        self.stdout.write(
+            f"Semeadas {total_contas} contas e {total_movimentacoes} movimentações "
+            f"em {time.monotonic() - inicio:.1f}s."
+        )
+        return self._carregar_contas()
+
+    def _carregar_contas(self):
+        contas = list(
+            Correntista.objects.filter(user__username__startswith=PREFIXO)
+            .select_related('user__auth_token')
+            .order_by('pk')
+        )
+        for conta in contas:
+            conta.token = conta.user.auth_token.key
+        return contas
+
+    def _medir_endpoint(self, endpoint, ativas, destinos, options):
+        metodo, caminho = ENDPOINTS[endpoint]
+        concorrencia = options['concorrencia']
+        total = options['requisicoes']
+        cotas = [total // concorrencia + (1 if i < total % concorrencia else 0) for i in range(concorrencia)]
+
+        def trabalhador(indice):
+            if options['servidor']:
+                return self._trabalhador_http(endpoint, indice, cotas[indice], ativas, destinos, options)
+
+            rng = random.Random(f"{options['semente']}-{endpoint}-{indice}")
+            client = APIClient()
+            medidor = MedidorConsultas()
+            amostras = []
+            try:
+                with connection.execute_wrapper(medidor):
+                    for _ in range(cotas[indice]):
+                        conta = rng.choice(ativas)
+                        dados = _dados_requisicao(endpoint, rng, conta, destinos)
+                        client.credentials(HTTP_AUTHORIZATION=f'Token {conta.token}')
+
+                        consultas, banco, lock = medidor.consultas, medidor.tempo_banco, medidor.tempo_lock
+                        inicio = time.perf_counter()
+                        response = getattr(client, metodo)(caminho, dados, format='json')
+                        amostras.append({
+                            'latencia': (time.perf_counter() - inicio) * 1000,
+                            'consultas': medidor.consultas - consultas,
+                            'banco': (medidor.tempo_banco - banco) * 1000,
+                            'lock': (medidor.tempo_lock - lock) * 1000,
+                            'status': response.status_code,
+                        })
+            finally:
+                connection.close()
+            return amostras
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+            amostras = [amostra for lote in executor.map(trabalhador, range(concorrencia)) for amostra in lote]
+        duracao = time.perf_counter() - inicio
+
+        consultas = [amostra['consultas'] for amostra in amostras if amostra['consultas'] is not None]
+        return {
+            'requisicoes': len(amostras),
+            'erros': sum(1 for amostra in amostras if amostra['status'] >= 400),
+            'status': dict(Counter(str(amostra['status']) for amostra in amostras)),
+            'duracao_s': round(duracao, 3),
+            'vazao_rps': round(len(amostras) / duracao, 1) if duracao else None,
+            'latencia': resumo_latencias([amostra['latencia'] for amostra in amostras]),
+            'consultas_por_requisicao': {
+                'media': round(sum(consultas) / len(consultas), 2) if consultas else None,
+                'max': max(consultas, default=None),
+            },
+            'tempo_banco': resumo_latencias([amostra['banco'] for amostra in amostras if amostra['banco'] is not None]),
+            'espera_lock': resumo_latencias([amostra['lock'] for amostra in amostras if amostra['lock'] is not None]),
+        }
+
+    def _trabalhador_http(self, endpoint, indice, cota, ativas, destinos, options):
+        """
+        Envia a cota de requisições de uma thread ao servidor externo, numa
+        conexão HTTP persistente. Consultas e locks não são visíveis daqui.
+        """
+        metodo, caminho = ENDPOINTS[endpoint]
+        rng = random.Random(f"{options['semente']}-{endpoint}-{indice}")
+        url = urlsplit(options['servidor'])
+        conexao = HTTPConnection(url.hostname, url.port or 80, timeout=options['timeout'])
+        amostras = []
+        try:
+            for _ in range(cota):
+                conta = rng.choice(ativas)
+                dados = _dados_requisicao(endpoint, rng, conta, destinos)
+                cabecalhos = {'Authorization': f'Token {conta.token}', 'Content-Type': 'application/json'}
+
+                inicio = time.perf_counter()
+                conexao.request(metodo.upper(), caminho, json.dumps(dados) if dados else None, cabecalhos)
+                response = conexao.getresponse()
+                response.read()
+                amostras.append({
+                    'latencia': (time.perf_counter() - inicio) * 1000,
+                    'consultas': None, 'banco': None, 'lock': None,
+                    'status': response.status,
+                })
+        finally:
+            conexao.close()
+        return amostras
+
+    async def _medir_websocket(self, conta, mensagens, timeout):
+        """
+        Conecta um NotificationConsumer pela aplicação ASGI completa e mede o
+        tempo entre o início de um depósito e a chegada da notificação.
+        """
+        from api.asgi import application
+
+        communicator = WebsocketCommunicator(application, f"/ws/notifications/?token={conta.token}")
+        conectado, _ = await communicator.connect(timeout)
+        if not conectado:
+            raise CommandError("O WebSocket de benchmark não conectou.")
+        await communicator.receive_json_from(timeout) # mensagem de boas-vindas
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {conta.token}')
+        depositar = sync_to_async(client.post)
+
+        latencias = []
+        perdidas = 0
+        try:
+            for _ in range(mensagens):
+                inicio = time.perf_counter()
+                await depositar('/api/depositar/', {'valor': str(VALOR)}, format='json')
+                try:
+                    await communicator.receive_json_from(timeout)
+                except asyncio.TimeoutError:
+                    # O communicator encerra o consumer no timeout: as restantes contam como perdidas
+                    perdidas = mensagens - len(latencias)
+                    break
+                latencias.append((time.perf_counter() - inicio) * 1000)
+        finally:
+            await communicator.disconnect()
+            await sync_to_async(_fechar_conexao)()
+
+        return {
+            'mensagens': mensagens,
+            'perdidas': perdidas,
+            'ponta_a_ponta': resumo_latencias(latencias),
+        }
@@ -0,0 +1,123 @@
+import asyncio
+import multiprocessing
+import queue
+import time
+
+import django
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import formatar_resumo, resumo_latencias, salvar_resultado
+
+GRUPO = 'bench_fanout'
+
+
+def _worker(indice, total_mensagens, timeout, prontos, resultados):
+    """
+    Processo que entra no grupo do benchmark e mede, para cada mensagem
+    recebida, o tempo desde o group_send no processo principal.
+    """
+    django.setup()
+
+    async def receber():
+        channel_layer = get_channel_layer()
+        canal = await channel_layer.new_channel()
+        await channel_layer.group_add(GRUPO, canal)
+        prontos.put(indice)
+
+        latencias = {}
+        try:
+            while len(latencias) < total_mensagens:
+                mensagem = await asyncio.wait_for(channel_layer.receive(canal), timeout)
+                latencias[mensagem['seq']] = (time.time() - mensagem['enviado_em']) * 1000
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await channel_layer.group_discard(GRUPO, canal)
+        return latencias
+
+    resultados.put((indice, asyncio.run(receber())))
+
+
+class Command(BaseCommand):
+    help = "Mede a latência de fan-out do channel layer entre N processos worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help="Processos que recebem as mensagens.")
+        parser.add_argument('--mensagens', type=int, default=200, help="Mensagens enviadas ao grupo.")
+        parser.add_argument('--intervalo-ms', type=float, default=5.0, help="Pausa entre os envios.")
+        parser.add_argument('--timeout', type=float, default=5.0, help="Segundos sem mensagens até o worker desistir.")
+        parser.add_argument('--saida', help="Arquivo JSON para gravar o resultado.")
+
+    def handle(self, *args, **options):
+        if isinstance(get_channel_layer(), InMemoryChannelLayer):
+            raise CommandError(
+                "O channel layer em memória não é compartilhado entre processos; "
+                "use CHANNEL_LAYER=redis para este benchmark."
+            )
+
+        workers = options['workers']
+        total = options['mensagens']
+        contexto = multiprocessing.get_context('spawn')
+        prontos = contexto.Queue()
+        resultados = contexto.Queue()
+
+        processos = [
+            contexto.Process(target=_worker, args=(i, total, options['timeout'], prontos, resultados))
+            for i in range(workers)
+        ]
+        for processo in processos:
+            processo.start()
+
+        try:
+            for _ in range(workers):
+                prontos.get(timeout=60)
+        except queue.Empty:
+            for processo in processos:
+                processo.terminate()
+            raise CommandError("Os workers não entraram no grupo a tempo.")
+
+        async def enviar():
+            channel_layer = get_channel_layer()
+            for seq in range(total):
+                await channel_layer.group_send(GRUPO, {
+                    'type': 'bench.mensagem',
+                    'seq': seq,
+                    'enviado_em': time.time(),
+                })
+                if options['intervalo_ms']:
+                    await asyncio.sleep(options['intervalo_ms'] / 1000)
+
+        asyncio.run(enviar())
+
+        por_worker = dict(resultados.get() for _ in range(workers))
+        for processo in processos:
+            processo.join()
+
+        entregas = [lat for latencias in por_worker.values() for lat in latencias.values()]
+        # Latência do fan-out completo: a última entrega de cada mensagem
+        completas = [
+            max(latencias[seq] for latencias in por_worker.values())
+            for seq in range(total)
+            if all(seq in latencias for latencias in por_worker.values())
+        ]
+
+        resultado = {
+            'backend': type(get_channel_layer()).__name__,
+            'workers': workers,
+            'mensagens': total,
+            'entregues': len(entregas),
+            'esperadas': total * workers,
+            'entrega': resumo_latencias(entregas),
+            'fanout_completo': resumo_latencias(completas),
+        }
+
+        self.stdout.write(formatar_resumo('entrega', resultado['entrega']))
+        self.stdout.write(formatar_resumo('fan-out completo', resultado['fanout_completo']))
+        if resultado['entregues'] < resultado['esperadas']:
+            self.stdout.write(self.style.WARNING(
+                f"{resultado['esperadas'] - resultado['entregues']} entregas perdidas (capacidade do canal ou timeout)."
+            ))
+        if options['saida']:
+            salvar_resultado(options['saida'], resultado)
+            self.stdout.write(self.style.SUCCESS(f"Resultado gravado em {options['saida']}"))
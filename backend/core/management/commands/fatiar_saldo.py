@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.operacoes import MAX_FATIAS, OperacaoError, ativar_fatias, desativar_fatias
+
+
+class Command(BaseCommand):
+    help = (
+        "Divide o saldo de uma conta muito acessada em subsaldos, para que "
+        "créditos simultâneos não esperem pelo lock da mesma linha, ou desfaz a divisão."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('conta', type=int, help="Id do correntista.")
+        parser.add_argument('--fatias', type=int, default=16, help=f"Quantidade de subsaldos (1 a {MAX_FATIAS}).")
+        parser.add_argument('--desfazer', action='store_true',
+                            help="Devolve os subsaldos para a linha da conta e os remove.")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['desfazer']:
+                    correntista = desativar_fatias(options['conta'])
+                else:
+                    correntista = ativar_fatias(options['conta'], options['fatias'])
+        except OperacaoError as erro:
+            raise CommandError(erro.mensagem)
+
+        if correntista.fatias:
+            mensagem = f"Conta {correntista.pk} dividida em {correntista.fatias} subsaldos."
+        else:
+            mensagem = f"Conta {correntista.pk} sem subsaldos; saldo de {correntista.saldo}."
+        self.stdout.write(self.style.SUCCESS(mensagem))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from core.idempotencia import limite_validade
+from core.models import ChaveIdempotencia
+
+
+class Command(BaseCommand):
+    help = "Remove as Idempotency-Keys mais antigas que IDEMPOTENCIA_TTL, em lotes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=5000, help="Registros removidos por DELETE.")
+
+    def handle(self, *args, **options):
+        limite = limite_validade()
+        removidas = 0
+        while True:
+            ids = list(
+                ChaveIdempotencia.objects.filter(criado_em__lt=limite)
+                .values_list('pk', flat=True)[:options['lote']]
+            )
+            if not ids:
+                break
+            removidas += ChaveIdempotencia.objects.filter(pk__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f"{removidas} chaves de idempotência removidas."))
@@ -0,0 +1,79 @@
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core import particoes
+
+
+class Command(BaseCommand):
+    help = (
+        "Cria as partições mensais futuras de core_movimentacao e arquiva as "
+        "partições antigas em core_movimentacao_arquivo. Feito para rodar "
+        "periodicamente (cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--meses-futuros', type=int, default=3,
+                            help="Garante as partições do mês atual e destes meses seguintes.")
+        parser.add_argument('--manter-meses', type=int,
+                            help="Arquiva as partições anteriores aos últimos N meses (incluindo o atual).")
+        parser.add_argument('--simular', action='store_true', help="Só mostra o que seria feito.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("O particionamento só existe no Postgres.")
+
+        atual = datetime.now(timezone.utc).date().replace(day=1)
+        with connection.cursor() as cursor:
+            existentes = set(particoes.listar_particoes(cursor))
+
+        mes = atual
+        for _ in range(options['meses_futuros'] + 1):
+            if mes not in existentes:
+                self._criar(mes, options['simular'])
+            mes = particoes.mes_seguinte(mes)
+
+        if options['manter_meses'] is not None:
+            if options['manter_meses'] < 1:
+                raise CommandError("--manter-meses deve ser pelo menos 1.")
+            corte = atual
+            for _ in range(options['manter_meses'] - 1):
+                corte = particoes.mes_anterior(corte)
+            for mes in sorted(existentes):
+                if mes < corte:
+                    self._arquivar(mes, options['simular'])
+
+        with connection.cursor() as cursor:
+            fora = particoes.linhas_na_padrao(cursor)
+        if fora:
+            self.stdout.write(self.style.WARNING(
+                f"{fora} movimentações na partição padrão (fora das partições mensais)."
+            ))
+
+    def _criar(self, mes, simular):
+        nome = particoes.nome_particao(mes)
+        if simular:
+            self.stdout.write(f"Criaria {nome}.")
+            return
+        with transaction.atomic(), connection.cursor() as cursor:
+            movidas = particoes.criar_particao(cursor, mes)
+        detalhe = f" ({movidas} movimentações trazidas da partição padrão)" if movidas else ""
+        self.stdout.write(self.style.SUCCESS(f"Criada {nome}{detalhe}."))
+
+    def _arquivar(self, mes, simular):
+        nome = particoes.nome_particao(mes)
+        with transaction.atomic(), connection.cursor() as cursor:
+            pendentes = particoes.contas_sem_checkpoint(cursor, mes)
+            if pendentes:
+                # Arquivar essas linhas quebraria a conciliação das contas
+                self.stdout.write(self.style.WARNING(
+                    f"{nome} não arquivada: {len(pendentes)} conta(s) sem checkpoint cobrindo o mês "
+                    f"(ex.: {', '.join(map(str, pendentes[:5]))}). Rode conciliar_saldos --registrar antes."
+                ))
+                return
+            if simular:
+                self.stdout.write(f"Arquivaria {nome}.")
+                return
+            arquivadas = particoes.arquivar_particao(cursor, mes)
+        self.stdout.write(self.style.SUCCESS(f"Arquivada {nome}: {arquivadas} movimentações."))
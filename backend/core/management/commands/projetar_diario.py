@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import diario
+
+
+class Command(BaseCommand):
+    help = (
+        "Aplica os lançamentos pendentes do diário (OPERACOES_MODO='diario') "
+        "aos saldos, ao extrato e aos resumos, em lotes. Com --continuo, fica "
+        "rodando como worker; vários workers podem rodar ao mesmo tempo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=settings.DIARIO_LOTE_PROJECAO,
+                            help="Lançamentos aplicados por transação.")
+        parser.add_argument('--continuo', action='store_true',
+                            help="Continua aguardando novos lançamentos em vez de sair quando o diário esvazia.")
+        parser.add_argument('--intervalo', type=float, default=0.5,
+                            help="Segundos de espera, no modo contínuo, quando não há lançamentos pendentes.")
+
+    def handle(self, *args, **options):
+        total = 0
+        try:
+            while True:
+                aplicados = diario.projetar(options['lote'])
+                total += aplicados
+                if aplicados < options['lote']:
+                    if not options['continuo']:
+                        break
+                    time.sleep(options['intervalo'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"{total} lançamentos projetados."))
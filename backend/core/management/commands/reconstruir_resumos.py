@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core import resumos
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula do razão (inclusive das movimentações arquivadas) os resumos "
+        "diários usados por /api/extrato/resumo/. Necessário só para movimentações "
+        "gravadas sem passar pelas operações."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('contas', nargs='*', type=int, help="Ids dos correntistas (padrão: todos).")
+
+    def handle(self, *args, **options):
+        dias = resumos.reconstruir(options['contas'] or None)
+        self.stdout.write(self.style.SUCCESS(f"{dias} resumos diários recalculados."))
@@ -0,0 +1,139 @@
+import math
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils import timezone
+
+from core import resumos, semeadura
+
+# Preenchido antes do fork: os processos filhos herdam ids e nomes das
+# contas sem que eles sejam serializados a cada tarefa
+_contexto = {}
+
+
+def _semear_lote(numero):
+    try:
+        contexto = _contexto
+        tamanho = min(contexto['lote'], contexto['movimentacoes'] - numero * contexto['lote'])
+        linhas, totais = semeadura.gerar_lote(
+            contexto['semente'], numero, tamanho, contexto['ids'], contexto['nomes'], contexto['distribuicao'],
+            contexto['inicio'] + contexto['duracao'] * numero, contexto['duracao'],
+        )
+        semeadura.gravar_lote(contexto['primeiro_id'] + numero * contexto['lote'], linhas)
+        return totais
+    finally:
+        connections.close_all()
+
+
+def _reconstruir_resumos(ids):
+    try:
+        return resumos.reconstruir(ids)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Gera contas e movimentações sintéticas (usuários seed_*) em escala de "
+        "produção, com contas quentes e uma mistura de transferências, "
+        "pagamentos, saques e depósitos, carregadas com COPY por um pool de "
+        "processos. Contas, valores e ordem das movimentações dependem só da "
+        "semente e do tamanho do lote (as datas, do momento da execução), e os "
+        "saldos batem com o razão."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contas', type=int, default=10000)
+        parser.add_argument('--movimentacoes', type=int, default=1_000_000)
+        parser.add_argument('--quentes', type=float, default=0.01,
+                            help="Fração das contas que são quentes.")
+        parser.add_argument('--trafego-quentes', type=float, default=0.5,
+                            help="Fração das operações (origens e destinos) sorteada entre as contas quentes.")
+        parser.add_argument('--dias', type=int, default=365, help="Período das movimentações, até agora.")
+        parser.add_argument('--lote', type=int, default=50000, help="Movimentações por tarefa.")
+        parser.add_argument('--processos', type=int, default=multiprocessing.cpu_count(),
+                            help="Processos do pool (1 executa no próprio processo).")
+        parser.add_argument('--semente', type=int, default=42)
+        parser.add_argument('--recriar', action='store_true', help="Apaga antes as contas semeadas existentes.")
+
+    def handle(self, *args, **options):
+        total_contas, total_movimentacoes = options['contas'], options['movimentacoes']
+        if total_contas < 1 or total_movimentacoes < 0 or options['lote'] < 2 or options['dias'] < 1:
+            raise CommandError("--contas, --lote e --dias devem ser positivos (--lote pelo menos 2).")
+        if not (0 <= options['quentes'] <= 1 and 0 <= options['trafego_quentes'] <= 1):
+            raise CommandError("--quentes e --trafego-quentes devem estar entre 0 e 1.")
+
+        if User.objects.filter(username__startswith=semeadura.PREFIXO).exists():
+            if not options['recriar']:
+                raise CommandError(f"Já existem contas semeadas ({semeadura.PREFIXO}*): use --recriar.")
+            removidas = semeadura.apagar_contas()
+            self.stdout.write(f"{removidas} contas semeadas removidas.")
+
+        inicio = time.monotonic()
+        semente = options['semente']
+        fim_periodo = timezone.now()
+        inicio_periodo = fim_periodo - timedelta(days=options['dias'])
+        semeadura.garantir_particoes(inicio_periodo, fim_periodo)
+
+        nomes = semeadura.nomes_contas(semente, total_contas)
+        ids = semeadura.criar_contas(nomes)
+        self.stdout.write(f"{total_contas} contas criadas em {time.monotonic() - inicio:.1f}s.")
+
+        lotes = math.ceil(total_movimentacoes / options['lote'])
+        saldos = semeadura.Saldos(semeadura.aberturas_sorteadas(semente, total_contas))
+        if lotes:
+            _contexto.update(
+                semente=semente,
+                lote=options['lote'],
+                movimentacoes=total_movimentacoes,
+                ids=ids,
+                nomes=nomes,
+                distribuicao=semeadura.Distribuicao(total_contas, options['quentes'], options['trafego_quentes']),
+                inicio=inicio_periodo,
+                duracao=(fim_periodo - inicio_periodo) / lotes,
+                primeiro_id=semeadura.reservar_ids_movimentacoes(total_movimentacoes),
+            )
+            # Os totais chegam na ordem dos lotes, que é a ordem do tempo
+            for totais in self._executar(_semear_lote, range(lotes), options['processos']):
+                saldos.somar(totais)
+        self.stdout.write(f"{total_movimentacoes} movimentações gravadas em {time.monotonic() - inicio:.1f}s.")
+
+        finais = saldos.finais()
+        if max(saldo for _, saldo in finais) > semeadura.SALDO_MAXIMO:
+            raise CommandError(
+                "Algum saldo passou do limite do campo: use mais contas ou menos movimentações, com --recriar."
+            )
+        semeadura.gravar_saldos(ids, finais)
+
+        if connection.vendor == 'postgresql':
+            # Os resumos diários já foram somados por lote, junto do COPY
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE auth_user, core_correntista, core_movimentacao, core_resumodiario")
+        else:
+            # Contas intercaladas entre as tarefas, para as quentes (as primeiras) não caírem todas na mesma
+            quantidade = min(total_contas, max(options['processos'] * 4, math.ceil(total_contas / 1000)))
+            tarefas = [ids[posicao::quantidade] for posicao in range(quantidade)]
+            list(self._executar(_reconstruir_resumos, tarefas, options['processos']))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Semeadas {total_contas} contas e {total_movimentacoes} movimentações em "
+            f"{time.monotonic() - inicio:.1f}s (semente {semente})."
+        ))
+
+    def _executar(self, funcao, tarefas, processos):
+        if processos <= 1:
+            yield from map(funcao, tarefas)
+            return
+        # Os filhos (fork, já com o Django configurado) abrem suas próprias
+        # conexões: nem a conexão nem o pool do processo pai podem ser herdados
+        connections.close_all()
+        for conexao in connections.all():
+            if getattr(conexao, 'pool', None) is not None:
+                conexao.close_pool()
+        with ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context('fork')) as pool:
+            yield from pool.map(funcao, tarefas)
@@ -0,0 +1,378 @@
+import bisect
+import contextvars
+import random
+import secrets
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.renderers import JSONRenderer
+
+# Limites (em segundos) dos buckets dos histogramas de tempo
+BUCKETS_TEMPO = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTAS = (1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+class MedidorConsultas:
+    """
+    Wrapper de execução (connection.execute_wrapper) que conta as consultas
+    de uma conexão e soma o tempo gasto no banco. As consultas com FOR UPDATE
+    (ou FOR NO KEY UPDATE) são somadas à parte: o tempo delas é dominado pela
+    espera pelo lock.
+    """
+
+    def __init__(self):
+        self.consultas = 0
+        self.tempo_banco = 0.0
+        self.tempo_lock = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duracao = time.perf_counter() - inicio
+            self.consultas += 1
+            self.tempo_banco += duracao
+            if 'FOR UPDATE' in sql or 'FOR NO KEY UPDATE' in sql:
+                self.tempo_lock += duracao
+
+
+class Histograma:
+    """
+    Histograma cumulativo no formato do Prometheus, com uma série por
+    combinação de labels.
+    """
+
+    def __init__(self, nome, ajuda, labels, buckets=BUCKETS_TEMPO):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *valores_labels):
+        with self._lock:
+            serie = self._series.get(valores_labels)
+            if serie is None:
+                serie = self._series[valores_labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][bisect.bisect_left(self.buckets, valor)] += 1
+            serie[1] += valor
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        with self._lock:
+            series = [(chave, list(contagens), soma) for chave, (contagens, soma) in self._series.items()]
+        for valores_labels, contagens, soma in sorted(series):
+            labels = _formatar_labels(self.labels, valores_labels)
+            acumulado = 0
+            for limite, contagem in zip(self.buckets, contagens):
+                acumulado += contagem
+                linhas.append(f'{self.nome}_bucket{{{labels}{"," if labels else ""}le="{limite}"}} {acumulado}')
+            acumulado += contagens[-1]
+            linhas.append(f'{self.nome}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {acumulado}')
+            linhas.append(f"{self.nome}_sum{{{labels}}} {soma}")
+            linhas.append(f"{self.nome}_count{{{labels}}} {acumulado}")
+        return linhas
+
+
+class Contador:
+    """
+    Contador (ou gauge, com 'tipo') no formato do Prometheus, por labels.
+    """
+
+    def __init__(self, nome, ajuda, labels, tipo='counter'):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.labels = labels
+        self.tipo = tipo
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def somar(self, valor, *valores_labels):
+        with self._lock:
+            self._valores[valores_labels] = self._valores.get(valores_labels, 0) + valor
+
+    def definir(self, valor, *valores_labels):
+        with self._lock:
+            self._valores[valores_labels] = valor
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        with self._lock:
+            valores = sorted(self._valores.items())
+        for valores_labels, valor in valores:
+            labels = _formatar_labels(self.labels, valores_labels)
+            linhas.append(f"{self.nome}{{{labels}}} {valor}" if labels else f"{self.nome} {valor}")
+        return linhas
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatar_labels(nomes, valores):
+    return ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores))
+
+
+# Métricas HTTP (todas as requisições)
+requisicoes = Histograma('api_requisicao_segundos', "Tempo total da requisição.", ('view', 'metodo', 'status'))
+
+# Métricas HTTP detalhadas (só requisições amostradas)
+consultas = Histograma('api_banco_consultas', "Consultas ao banco por requisição (amostrada).",
+                       ('view',), buckets=BUCKETS_CONSULTAS)
+tempo_banco = Histograma('api_banco_segundos', "Tempo gasto no banco por requisição (amostrada).", ('view',))
+espera_lock = Histograma('api_lock_espera_segundos',
+                         "Tempo das consultas SELECT ... FOR UPDATE por requisição (amostrada).", ('view',))
+serializacao = Histograma('api_serializacao_segundos',
+                          "Tempo de renderização da resposta por requisição (amostrada).", ('view',))
+
+# Channel layer e WebSocket
+envio_canal = Histograma('canal_envio_segundos', "Tempo de cada group_send de notificação.", ('view',))
+ws_conexoes_abertas = Contador('ws_conexoes_abertas', "Conexões WebSocket abertas.", ('rota',), tipo='gauge')
+ws_conexao = Histograma('ws_conexao_segundos', "Duração das conexões WebSocket.", ('rota',),
+                        buckets=(1, 10, 60, 300, 900, 3600, 14400))
+ws_mensagens = Contador('ws_mensagens_total', "Mensagens WebSocket por direção.", ('rota', 'direcao'))
+ws_envio = Histograma('ws_envio_segundos', "Tempo de cada envio ao cliente WebSocket (amostrado).", ('rota',))
+ws_notificacoes = Contador('ws_notificacoes_total',
+                           "Notificações do consumer por resultado (enviada, descartada ou resumida).", ('resultado',))
+
+# Cache do saldo (core/cache_saldo.py)
+cache_saldo = Contador('saldo_cache_total', "Leituras do saldo pelo cache, por resultado (hit ou miss).", ('resultado',))
+
+# Limites das operações (core/limites.py)
+rejeicoes = Contador('api_rejeicoes_total',
+                     "Operações recusadas antes da transação, por endpoint e motivo (limite ou sobrecarga).",
+                     ('endpoint', 'motivo'))
+operacoes_em_andamento = Contador('api_operacoes_em_andamento', "Operações em andamento no processo.", (),
+                                  tipo='gauge')
+
+# Réplicas de leitura (core/replicas.py)
+leituras = Contador('db_leituras_total',
+                    "Requisições de leitura por banco usado e motivo (replica, escrita_recente ou atraso).",
+                    ('banco', 'motivo'))
+atraso_replica = Contador('db_replica_atraso_segundos',
+                          "Último atraso medido de cada réplica (-1 se indisponível).", ('replica',), tipo='gauge')
+
+METRICAS = (
+    requisicoes, consultas, tempo_banco, espera_lock, serializacao,
+    envio_canal, ws_conexoes_abertas, ws_conexao, ws_mensagens, ws_envio, ws_notificacoes,
+    cache_saldo, rejeicoes, operacoes_em_andamento, leituras, atraso_replica,
+)
+
+
+class Medicao:
+    """
+    Dados da requisição em andamento, acessíveis pelo contextvar
+    'medicao_atual' (wrapper de consultas, renderer e notificações).
+    """
+
+    def __init__(self, request, amostrada):
+        self.request = request
+        self.amostrada = amostrada
+        self.medidor = MedidorConsultas() if amostrada else None
+        self.tempo_serializacao = 0.0
+
+    @property
+    def view(self):
+        return _nome_view(self.request)
+
+
+medicao_atual = contextvars.ContextVar('medicao_atual', default=None)
+
+
+def view_atual():
+    """
+    Nome da view da requisição em andamento, ou None fora de uma requisição.
+    """
+    medicao = medicao_atual.get()
+    return medicao.view if medicao else None
+
+
+def amostrar():
+    return random.random() < settings.METRICAS_AMOSTRAGEM
+
+
+def _nome_view(request):
+    match = getattr(request, 'resolver_match', None)
+    # Rotas não encontradas ficam agrupadas, para não criar uma série por URL
+    return match.url_name or match.view_name if match else 'nao_encontrada'
+
+
+def medir_consulta(execute, sql, params, many, context):
+    """
+    Wrapper de execução instalado em toda conexão (sinal connection_created).
+    Só mede quando a requisição do contexto atual foi amostrada; como o
+    contextvar acompanha o sync_to_async, vale também para as consultas das
+    views assíncronas, feitas em outra thread.
+    """
+    medicao = medicao_atual.get()
+    if medicao is None or not medicao.amostrada:
+        return execute(sql, params, many, context)
+    return medicao.medidor(execute, sql, params, many, context)
+
+
+class MetricasMiddleware:
+    """
+    Mede o tempo total de toda requisição HTTP, por view, método e status.
+
+    Nas requisições amostradas (METRICAS_AMOSTRAGEM) mede também consultas e
+    tempo no banco, a espera por lock dos SELECT ... FOR UPDATE e o tempo de
+    renderização da resposta. A amostragem mantém o custo da medição fora da
+    maior parte das requisições.
+
+    Funciona nos modos síncrono e assíncrono, para não forçar uma troca de
+    thread antes das views assíncronas.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.METRICAS_ATIVAS:
+            return self.get_response(request)
+
+        medicao = Medicao(request, amostrar())
+        token = medicao_atual.set(medicao)
+        inicio = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            medicao_atual.reset(token)
+        self.registrar(medicao, response, time.perf_counter() - inicio)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICAS_ATIVAS:
+            return await self.get_response(request)
+
+        medicao = Medicao(request, amostrar())
+        token = medicao_atual.set(medicao)
+        inicio = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            medicao_atual.reset(token)
+        self.registrar(medicao, response, time.perf_counter() - inicio)
+        return response
+
+    def registrar(self, medicao, response, duracao):
+        view = medicao.view
+        requisicoes.observar(duracao, view, medicao.request.method, str(response.status_code))
+        if medicao.amostrada:
+            consultas.observar(medicao.medidor.consultas, view)
+            tempo_banco.observar(medicao.medidor.tempo_banco, view)
+            espera_lock.observar(medicao.medidor.tempo_lock, view)
+            serializacao.observar(medicao.tempo_serializacao, view)
+
+
+class JSONRendererMedido(JSONRenderer):
+    """
+    JSONRenderer que soma o tempo de renderização à medição da requisição.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        medicao = medicao_atual.get()
+        if medicao is None or not medicao.amostrada:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        inicio = time.perf_counter()
+        try:
+            return super().render(data, accepted_media_type, renderer_context)
+        finally:
+            medicao.tempo_serializacao += time.perf_counter() - inicio
+
+
+def _nome_rota_ws(path):
+    from .routing import websocket_urlpatterns
+
+    for padrao in websocket_urlpatterns:
+        if padrao.pattern.match(path.lstrip('/')):
+            return padrao.name or padrao.pattern.describe()
+    return 'nao_encontrada'
+
+
+class MetricasWebsocketMiddleware:
+    """
+    Middleware ASGI para o caminho websocket do ProtocolTypeRouter: conta as
+    conexões abertas e as mensagens em cada direção, mede a duração das
+    conexões e, nas conexões amostradas, o tempo de cada envio ao cliente.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not settings.METRICAS_ATIVAS:
+            return await self.app(scope, receive, send)
+
+        rota = _nome_rota_ws(scope.get('path', ''))
+        amostrada = amostrar()
+
+        async def receive_medido():
+            mensagem = await receive()
+            if mensagem['type'] == 'websocket.receive':
+                ws_mensagens.somar(1, rota, 'entrada')
+            return mensagem
+
+        async def send_medido(mensagem):
+            if mensagem['type'] != 'websocket.send':
+                return await send(mensagem)
+            ws_mensagens.somar(1, rota, 'saida')
+            if not amostrada:
+                return await send(mensagem)
+            inicio = time.perf_counter()
+            try:
+                return await send(mensagem)
+            finally:
+                ws_envio.observar(time.perf_counter() - inicio, rota)
+
+        ws_conexoes_abertas.somar(1, rota)
+        inicio = time.monotonic()
+        try:
+            return await self.app(scope, receive_medido, send_medido)
+        finally:
+            ws_conexoes_abertas.somar(-1, rota)
+            ws_conexao.observar(time.monotonic() - inicio, rota)
+
+
+def exportar():
+    """
+    Todas as métricas no formato de texto do Prometheus.
+    """
+    linhas = []
+    for metrica in METRICAS:
+        linhas.extend(metrica.exportar())
+    return '\n'.join(linhas) + '\n'
+
+
+def _scrape_autorizado(request):
+    if settings.METRICAS_TOKEN:
+        esperado = f"Bearer {settings.METRICAS_TOKEN}"
+        if secrets.compare_digest(request.headers.get('Authorization', '').encode(), esperado.encode()):
+            return True
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_active and user.is_staff)
+
+
+def metricas_view(request):
+    """
+    Endpoint de scrape do Prometheus. Fica fora do DRF (sem token de usuário)
+    e expõe o tráfego e o estado interno, então é negado por padrão: aceita
+    'Authorization: Bearer <METRICAS_TOKEN>' (se o token estiver definido) ou
+    um usuário staff com sessão.
+    Acesso via /api/metricas/
+    """
+    if not _scrape_autorizado(request):
+        return HttpResponseForbidden()
+    return HttpResponse(exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,17 +1,20 @@
-from channels.db import database_sync_to_async
+import asyncio
+
 from urllib.parse import parse_qs
 
+from .notificacoes import despachante
+
 
-@database_sync_to_async
-def get_user_from_token(token_key):
+async def get_user_from_token(token_key):
     from django.contrib.auth.models import AnonymousUser
-    from rest_framework.authtoken.models import Token
-    
-    try:
-        token = Token.objects.get(key=token_key)
-        return token.user
-    except Token.DoesNotExist:
+    from .authentication import aobter_token
+
+    # Mesmo cache de tokens usado pela autenticação do DRF; com o token no
+    # cache, não passa pela thread do banco
+    token = await aobter_token(token_key)
+    if token is None or not token.user.is_active:
         return AnonymousUser()
+    return token.user
 
 
 class TokenAuthMiddleware:
@@ -35,3 +38,17 @@ class TokenAuthMiddleware:
             scope['user'] = AnonymousUser()
 
         return await self.app(scope, receive, send)
+
+
+class DespachanteLoopMiddleware:
+    """
+    Middleware ASGI que informa ao despachante de notificações qual é o event
+    loop do servidor, para que os envios feitos por views síncronas sejam
+    agendados nele sem bloquear a thread da requisição.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        despachante.vincular_loop(asyncio.get_running_loop())
+        return await self.app(scope, receive, send)
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, F, Sum, When
+
+
+def criar_checkpoints_de_abertura(apps, schema_editor):
+    """
+    Cria, para cada conta existente, um checkpoint na movimentação 0 com o
+    saldo de abertura (saldo atual menos o que o razão explica). As contas do
+    0002_seed_initial_data nasceram com saldo sem movimentação correspondente.
+    """
+    Correntista = apps.get_model('core', 'Correntista')
+    Movimentacao = apps.get_model('core', 'Movimentacao')
+    SaldoCheckpoint = apps.get_model('core', 'SaldoCheckpoint')
+
+    liquido_por_conta = dict(
+        Movimentacao.objects.values('correntista')
+        .annotate(liquido=Sum(Case(
+            When(tipo_operacao='C', then=F('valor_operacao')),
+            default=-F('valor_operacao'),
+        )))
+        .values_list('correntista', 'liquido')
+    )
+    SaldoCheckpoint.objects.bulk_create([
+        SaldoCheckpoint(
+            correntista_id=conta.pk,
+            movimentacao_id=0,
+            saldo=conta.saldo - liquido_por_conta.get(conta.pk, 0),
+        )
+        for conta in Correntista.objects.all()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_movimentacao_extrato_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movimentacao_id', models.BigIntegerField()),
+                ('saldo', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        # O índice composto é criado antes de remover o índice simples da FK
+        migrations.AddIndex(
+            model_name='movimentacao',
+            index=models.Index(fields=['correntista', 'id'], name='core_mov_conta_id_idx'),
+        ),
+        migrations.AlterField(
+            model_name='movimentacao',
+            name='correntista',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='movimentacoes', to='core.correntista'),
+        ),
+        migrations.AddField(
+            model_name='saldocheckpoint',
+            name='correntista',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='core.correntista'),
+        ),
+        migrations.AddIndex(
+            model_name='saldocheckpoint',
+            index=models.Index(fields=['correntista', '-movimentacao_id'], name='core_checkpoint_conta_idx'),
+        ),
+        migrations.RunPython(criar_checkpoints_de_abertura, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_chave_idempotencia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='correntista',
+            name='fatias',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='SubSaldo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fatia', models.PositiveSmallIntegerField()),
+                ('saldo', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('correntista', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subsaldos', to='core.correntista')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('correntista', 'fatia'), name='core_subsaldo_fatia_unica')],
+            },
+        ),
+    ]
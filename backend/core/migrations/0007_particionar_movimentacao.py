@@ -0,0 +1,133 @@
+from datetime import date, datetime, timezone
+
+from django.db import migrations
+
+# Meses criados além do atual; os seguintes ficam com o comando particoes_movimentacao
+MESES_FUTUROS = 3
+
+
+def _mes_seguinte(mes):
+    return date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+
+def _limite(mes):
+    return datetime(mes.year, mes.month, 1, tzinfo=timezone.utc)
+
+
+def _indices_e_fks(cursor):
+    """
+    Definições dos índices (menos a chave primária) e das chaves
+    estrangeiras de core_movimentacao, para recriá-los com os mesmos nomes.
+    """
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE tablename = 'core_movimentacao' "
+        "AND indexname <> 'core_movimentacao_pkey'"
+    )
+    indices = [linha[0] for linha in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = 'core_movimentacao'::regclass AND contype = 'f'"
+    )
+    return indices, cursor.fetchall()
+
+
+def _trocar_tabela(cursor, criar_nova, chave_primaria):
+    """
+    Substitui core_movimentacao pela tabela core_movimentacao_nova (criada
+    por 'criar_nova'), copiando as linhas e recriando índices, chaves
+    estrangeiras e a sequência do id.
+    """
+    indices, fks = _indices_e_fks(cursor)
+    # A sequência nova continua de onde a atual parou
+    cursor.execute("SELECT pg_get_serial_sequence('core_movimentacao', 'id')")
+    cursor.execute(f"SELECT last_value, is_called FROM {cursor.fetchone()[0]}")
+    ultimo_valor, chamada = cursor.fetchone()
+
+    cursor.execute("CREATE SEQUENCE core_movimentacao_nova_id_seq")
+    cursor.execute("SELECT setval('core_movimentacao_nova_id_seq', %s, %s)", [ultimo_valor, chamada])
+    criar_nova(cursor)
+    cursor.execute(
+        "ALTER TABLE core_movimentacao_nova ALTER COLUMN id SET DEFAULT nextval('core_movimentacao_nova_id_seq')"
+    )
+    cursor.execute("INSERT INTO core_movimentacao_nova SELECT * FROM core_movimentacao")
+
+    # A sequência antiga pertence à coluna (identity ou OWNED BY) e sai junto com a tabela
+    cursor.execute("DROP TABLE core_movimentacao")
+    cursor.execute("ALTER TABLE core_movimentacao_nova RENAME TO core_movimentacao")
+    cursor.execute("ALTER SEQUENCE core_movimentacao_nova_id_seq RENAME TO core_movimentacao_id_seq")
+    cursor.execute("ALTER SEQUENCE core_movimentacao_id_seq OWNED BY core_movimentacao.id")
+    cursor.execute(f"ALTER TABLE core_movimentacao ADD CONSTRAINT core_movimentacao_pkey PRIMARY KEY ({chave_primaria})")
+    for indice in indices:
+        cursor.execute(indice)
+    for nome, definicao in fks:
+        cursor.execute(f"ALTER TABLE core_movimentacao ADD CONSTRAINT {nome} {definicao}")
+
+
+def particionar(apps, schema_editor):
+    """
+    Converte core_movimentacao em uma tabela particionada por mês de
+    data_operacao, com as partições do mês da movimentação mais antiga até
+    MESES_FUTUROS à frente, a partição padrão e a tabela de arquivo.
+    A chave primária passa a ser (id, data_operacao), como o Postgres exige.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT min(data_operacao) FROM core_movimentacao")
+        primeira = cursor.fetchone()[0]
+        hoje = datetime.now(timezone.utc).date()
+        mes = (primeira.astimezone(timezone.utc).date() if primeira else hoje).replace(day=1)
+        ultimo = hoje.replace(day=1)
+        for _ in range(MESES_FUTUROS):
+            ultimo = _mes_seguinte(ultimo)
+
+        def criar_nova(cursor):
+            nonlocal mes
+            cursor.execute(
+                "CREATE TABLE core_movimentacao_nova (LIKE core_movimentacao) PARTITION BY RANGE (data_operacao)"
+            )
+            while mes <= ultimo:
+                cursor.execute(
+                    f"CREATE TABLE core_movimentacao_p{mes.year:04d}_{mes.month:02d} "
+                    f"PARTITION OF core_movimentacao_nova FOR VALUES FROM (%s) TO (%s)",
+                    [_limite(mes), _limite(_mes_seguinte(mes))],
+                )
+                mes = _mes_seguinte(mes)
+            cursor.execute("CREATE TABLE core_movimentacao_padrao PARTITION OF core_movimentacao_nova DEFAULT")
+
+        _trocar_tabela(cursor, criar_nova, 'id, data_operacao')
+
+        # Partições arquivadas: sem chave primária nem chaves estrangeiras,
+        # só o índice para consultar o histórico de uma conta
+        cursor.execute("CREATE TABLE core_movimentacao_arquivo (LIKE core_movimentacao)")
+        cursor.execute(
+            "CREATE INDEX core_mov_arquivo_conta_idx ON core_movimentacao_arquivo (correntista_id, data_operacao)"
+        )
+
+
+def desfazer_particionamento(apps, schema_editor):
+    """
+    Volta para uma tabela comum, trazendo de volta as linhas arquivadas.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        def criar_nova(cursor):
+            cursor.execute("CREATE TABLE core_movimentacao_nova (LIKE core_movimentacao)")
+            cursor.execute("INSERT INTO core_movimentacao_nova SELECT * FROM core_movimentacao_arquivo")
+
+        _trocar_tabela(cursor, criar_nova, 'id')
+        cursor.execute("DROP TABLE core_movimentacao_arquivo")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_subsaldo'),
+    ]
+
+    operations = [
+        migrations.RunPython(particionar, desfazer_particionamento),
+    ]
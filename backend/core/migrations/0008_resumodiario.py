@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def preencher_resumos(apps, schema_editor):
+    """
+    Calcula os resumos diários das movimentações existentes, inclusive as
+    arquivadas, em uma única consulta. Só no Postgres (onde há o arquivo);
+    nos demais bancos use o comando reconstruir_resumos.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO core_resumodiario (correntista_id, dia, parte, creditos, debitos, qtd_creditos, qtd_debitos) "
+            "SELECT correntista_id, (data_operacao AT TIME ZONE %s)::date, 0, "
+            "  coalesce(sum(valor_operacao) FILTER (WHERE tipo_operacao = 'C'), 0), "
+            "  coalesce(sum(valor_operacao) FILTER (WHERE tipo_operacao = 'D'), 0), "
+            "  count(*) FILTER (WHERE tipo_operacao = 'C'), "
+            "  count(*) FILTER (WHERE tipo_operacao = 'D') "
+            "FROM (SELECT * FROM core_movimentacao UNION ALL SELECT * FROM core_movimentacao_arquivo) m "
+            "GROUP BY 1, 2",
+            [settings.TIME_ZONE],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_particionar_movimentacao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('parte', models.PositiveSmallIntegerField(default=0)),
+                ('creditos', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('debitos', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('qtd_creditos', models.PositiveIntegerField(default=0)),
+                ('qtd_debitos', models.PositiveIntegerField(default=0)),
+                ('correntista', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='resumos', to='core.correntista')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('correntista', 'dia', 'parte'), name='core_resumo_dia_unico')],
+            },
+        ),
+        migrations.RunPython(preencher_resumos, migrations.RunPython.noop),
+    ]
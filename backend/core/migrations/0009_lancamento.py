@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_resumodiario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lancamento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo_operacao', models.CharField(choices=[('C', 'Crédito'), ('D', 'Débito')], max_length=1)),
+                ('valor_operacao', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('data_operacao', models.DateTimeField(auto_now_add=True)),
+                ('descricao', models.CharField(max_length=50)),
+                ('correntista', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lancamentos', to='core.correntista')),
+                ('correntista_beneficiario', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.correntista')),
+            ],
+        ),
+    ]
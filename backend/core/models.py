@@ -1,18 +1,34 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import Sum
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 
 class Correntista(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='correntista')
     # CorrentistaID é criado automaticamente pelo Django como 'id'
     nome_correntista = models.CharField(max_length=50)
     saldo = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    # Quantidade de subsaldos da conta (0 = saldo só nesta linha). Ver SubSaldo.
+    fatias = models.PositiveSmallIntegerField(default=0)
 
     def __str__(self):
         return self.user.username
 
+    @property
+    def saldo_total(self):
+        """
+        Saldo da conta: o desta linha mais o dos subsaldos, se houver.
+        """
+        if not self.fatias:
+            return self.saldo
+        return self.saldo + (self.subsaldos.aggregate(total=Sum('saldo'))['total'] or Decimal('0.00'))
+
 class Movimentacao(models.Model):
 
     # MovimentacaoID é criado automaticamente como 'id'
+    # No Postgres a tabela é particionada por mês de data_operacao (ver core/particoes.py)
 
     TIPO_OPERACAO_CHOICES = [
         ('C', 'Crédito'),
@@ -21,11 +37,12 @@ class Movimentacao(models.Model):
 
     tipo_operacao = models.CharField(max_length=1, choices=TIPO_OPERACAO_CHOICES)
     
-    # Chave estrangeira para Correntista
+    # Chave estrangeira para Correntista (indexada pelos índices compostos abaixo)
     correntista = models.ForeignKey(
         Correntista, 
         on_delete=models.CASCADE, 
-        related_name='movimentacoes'
+        related_name='movimentacoes',
+        db_index=False
     )
     
     valor_operacao = models.DecimalField(max_digits=10, decimal_places=2)
@@ -41,5 +58,143 @@ class Movimentacao(models.Model):
         blank=True
     )
 
+    class Meta:
+        indexes = [
+            # Índice usado pela paginação por cursor do extrato
+            models.Index(
+                fields=['correntista', '-data_operacao', '-id'],
+                name='core_mov_extrato_idx',
+            ),
+            # Índice usado pela conciliação incremental (movimentações após um checkpoint)
+            models.Index(
+                fields=['correntista', 'id'],
+                name='core_mov_conta_id_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_operacao_display()} - {self.correntista.user.username} - R$ {self.valor_operacao}"
+
+class Lancamento(models.Model):
+    """
+    Operação registrada no diário (OPERACOES_MODO='diario', ver core/diario.py).
+    As operações só acrescentam lançamentos, sem travar nem alterar a linha do
+    Correntista; o projetor (comando projetar_diario) os aplica em lotes ao
+    saldo e os move para Movimentacao, então a tabela só guarda os pendentes.
+    Os campos têm os nomes dos de Movimentacao, para as views tratarem os dois
+    da mesma forma.
+    """
+    tipo_operacao = models.CharField(max_length=1, choices=Movimentacao.TIPO_OPERACAO_CHOICES)
+    correntista = models.ForeignKey(Correntista, on_delete=models.CASCADE, related_name='lancamentos')
+    valor_operacao = models.DecimalField(max_digits=10, decimal_places=2)
+    data_operacao = models.DateTimeField(auto_now_add=True)
+    descricao = models.CharField(max_length=50)
+    correntista_beneficiario = models.ForeignKey(
+        Correntista,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        null=True,
+        blank=True,
+        db_index=False
+    )
+
+    def __str__(self):
+        return f"{self.get_tipo_operacao_display()} - {self.correntista_id} - R$ {self.valor_operacao}"
+
+class SubSaldo(models.Model):
+    """
+    Parte do saldo de uma conta muito disputada (modo opt-in, ver o comando
+    fatiar_saldo). Os créditos vão para um subsaldo livre qualquer, sem travar
+    a linha do Correntista; os débitos travam a conta e, se o saldo dela não
+    bastar, os subsaldos necessários para cobrir o valor.
+    """
+    correntista = models.ForeignKey(Correntista, on_delete=models.CASCADE, related_name='subsaldos')
+    fatia = models.PositiveSmallIntegerField()
+    saldo = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['correntista', 'fatia'], name='core_subsaldo_fatia_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.correntista_id}[{self.fatia}]"
+
+
+class ResumoDiario(models.Model):
+    """
+    Totais das movimentações de um correntista em um dia (no fuso TIME_ZONE),
+    mantidos pelas operações (core/resumos.py) e usados pelo resumo do extrato.
+    Contas fatiadas têm até uma linha por fatia em cada dia ('parte'), para
+    que os créditos simultâneos, que não travam a conta, não disputem a mesma linha.
+    """
+    correntista = models.ForeignKey(
+        Correntista,
+        on_delete=models.CASCADE,
+        related_name='resumos',
+        db_index=False # coberto pela restrição de unicidade
+    )
+    dia = models.DateField()
+    parte = models.PositiveSmallIntegerField(default=0)
+    creditos = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    debitos = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    qtd_creditos = models.PositiveIntegerField(default=0)
+    qtd_debitos = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['correntista', 'dia', 'parte'], name='core_resumo_dia_unico'),
+        ]
+
+    def __str__(self):
+        return f"{self.correntista_id} - {self.dia}"
+
+
+class SaldoCheckpoint(models.Model):
+    """
+    Saldo de um correntista conferido contra o razão até a movimentação
+    'movimentacao_id' (inclusive). A conciliação parte do checkpoint mais
+    recente e soma apenas as movimentações posteriores.
+    """
+    correntista = models.ForeignKey(
+        Correntista,
+        on_delete=models.CASCADE,
+        related_name='checkpoints'
+    )
+    # Apenas o id, sem chave estrangeira: o razão pode ser arquivado
+    movimentacao_id = models.BigIntegerField()
+    saldo = models.DecimalField(max_digits=10, decimal_places=2)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['correntista', '-movimentacao_id'],
+                name='core_checkpoint_conta_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.correntista_id} - mov {self.movimentacao_id} - R$ {self.saldo}"
+
+class ChaveIdempotencia(models.Model):
+    """
+    Resposta registrada para uma requisição enviada com o header
+    Idempotency-Key. Repetições com a mesma chave recebem esta resposta sem
+    executar a operação de novo.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chaves_idempotencia')
+    chave = models.CharField(max_length=255)
+    endpoint = models.CharField(max_length=50)
+    hash_requisicao = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    resposta = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    criado_em = models.DateTimeField(auto_now_add=True, db_index=True) # usado na limpeza por TTL
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'chave'], name='core_idempotencia_chave_unica'),
+        ]
+
     def __str__(self):
-        return f"{self.get_tipo_operacao_display()} - {self.correntista.user.username} - R$ {self.valor_operacao}"
\ No newline at end of file
+        return f"{self.user_id} - {self.chave}"
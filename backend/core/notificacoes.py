@@ -0,0 +1,177 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from . import historico_notificacoes, metricas
+
+logger = logging.getLogger(__name__)
+
+
+class DespachanteNotificacoes:
+    """
+    Envia as notificações ao channel layer sem bloquear quem as enfileira.
+
+    As notificações são acumuladas e descarregadas em lote, no event loop do
+    servidor ASGI (vinculado pelo DespachanteLoopMiddleware): cada descarga
+    numera e guarda no histórico as notificações do lote e faz um group_send
+    concorrente por item. Fora do ASGI (testes, comandos de gerenciamento) é
+    usado um event loop próprio em uma thread de fundo.
+    """
+
+    def __init__(self):
+        self._pendentes = deque()
+        self._lock = threading.Lock()
+        self._descarga_agendada = False
+        self._loop = None
+        self._loop_proprio = None
+
+    def vincular_loop(self, loop):
+        self._loop = loop
+
+    def enfileirar(self, grupo, evento, user_id=None):
+        """
+        Agenda o envio do evento ao grupo. Com user_id, a notificação recebe a
+        sua sequência e entra no histórico do usuário na descarga.
+        """
+        view = metricas.view_atual() or 'desconhecida'
+        with self._lock:
+            self._pendentes.append((user_id, grupo, evento, view))
+            if self._descarga_agendada:
+                return
+            self._descarga_agendada = True
+
+        descarga = self._descarregar()
+        agendada = False
+        try:
+            # Num contexto vazio: com o da requisição, a descarga herdaria o
+            # ThreadSensitiveContext dela (já encerrada) e a trava contra
+            # deadlock do asgiref, que recusa os sync_to_async do cache
+            contextvars.Context().run(asyncio.run_coroutine_threadsafe, descarga, self._obter_loop())
+            agendada = True
+        finally:
+            if not agendada:
+                # Sem isso, nenhum enfileiramento seguinte agendaria a descarga
+                descarga.close()
+                with self._lock:
+                    self._descarga_agendada = False
+
+    def _obter_loop(self):
+        if self._loop is not None and self._loop.is_running():
+            return self._loop
+
+        with self._lock:
+            if self._loop_proprio is None:
+                self._loop_proprio = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop_proprio.run_forever,
+                    name='despachante-notificacoes',
+                    daemon=True,
+                ).start()
+        return self._loop_proprio
+
+    async def _descarregar(self):
+        with self._lock:
+            lote = list(self._pendentes)
+            self._pendentes.clear()
+            self._descarga_agendada = False
+
+        await registrar_historico([(user_id, evento) for user_id, _, evento, _ in lote if user_id is not None])
+        await enviar_ao_canal([(grupo, evento, view) for _, grupo, evento, view in lote])
+
+
+async def _enviar(channel_layer, grupo, evento, view):
+    inicio = time.perf_counter()
+    try:
+        await channel_layer.group_send(grupo, evento)
+    finally:
+        metricas.envio_canal.observar(time.perf_counter() - inicio, view)
+
+
+async def enviar_ao_canal(lote):
+    """
+    Envia (grupo, evento, view) ao channel layer com um group_send concorrente
+    por item. Falhas são registradas no log sem interromper os demais envios.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    resultados = await asyncio.gather(
+        *(_enviar(channel_layer, grupo, evento, view) for grupo, evento, view in lote),
+        return_exceptions=True,
+    )
+    for (grupo, _, _), resultado in zip(lote, resultados):
+        if isinstance(resultado, Exception):
+            logger.warning("Falha ao enviar notificação para %s: %s", grupo, resultado)
+
+
+async def registrar_historico(itens):
+    """
+    Numera e guarda no histórico as notificações de (user_id, evento), na
+    ordem em que aparecem para cada usuário; usuários diferentes em paralelo.
+    Uma falha deixa a notificação sem 'seq', mas não impede o envio.
+    """
+    por_usuario = {}
+    for user_id, evento in itens:
+        por_usuario.setdefault(user_id, []).append(evento['notification'])
+
+    async def registrar_em_ordem(user_id, notificacoes):
+        for notificacao in notificacoes:
+            await historico_notificacoes.aregistrar(user_id, notificacao)
+
+    resultados = await asyncio.gather(
+        *(registrar_em_ordem(user_id, notificacoes) for user_id, notificacoes in por_usuario.items()),
+        return_exceptions=True,
+    )
+    for user_id, resultado in zip(por_usuario, resultados):
+        if isinstance(resultado, Exception):
+            logger.warning("Falha ao registrar notificação de %s no histórico: %s", user_id, resultado)
+
+
+despachante = DespachanteNotificacoes()
+
+
+def grupo_notificacoes(user_id):
+    return f"notifications_{user_id}"
+
+
+def evento_notificacao(mensagem, tipo='info', timestamp=''):
+    return {
+        'type': 'send_notification',
+        'notification': {
+            'message': mensagem,
+            'tipo': tipo,
+            'timestamp': str(timestamp),
+        }
+    }
+
+
+def enviar_notificacao(user_id, mensagem, tipo='info', timestamp=''):
+    """
+    Envia uma notificação via WebSocket para um usuário específico.
+    O envio só é enfileirado depois do commit da transação atual, para não
+    segurar os locks de linha enquanto o channel layer responde; a sequência
+    e o histórico do usuário ficam com o despachante, fora da requisição.
+    """
+    evento = evento_notificacao(mensagem, tipo, timestamp)
+    transaction.on_commit(lambda: despachante.enfileirar(grupo_notificacoes(user_id), evento, user_id))
+
+
+async def aenviar_notificacoes(notificacoes):
+    """
+    Envia notificações (user_id, mensagem, tipo, timestamp) direto ao channel
+    layer, com await. Para views assíncronas, depois do commit da operação.
+    """
+    view = metricas.view_atual() or 'desconhecida'
+    itens = [
+        (user_id, evento_notificacao(mensagem, tipo, timestamp))
+        for user_id, mensagem, tipo, timestamp in notificacoes
+    ]
+    await registrar_historico(itens)
+    await enviar_ao_canal([(grupo_notificacoes(user_id), evento, view) for user_id, evento in itens])
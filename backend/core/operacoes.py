@@ -0,0 +1,493 @@
+import random
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, Q, Subquery, When
+from django.utils import timezone
+
+from . import diario, resumos
+from .cache_saldo import registrar_escrita
+from .models import Correntista, Movimentacao, SubSaldo
+
+# Limite de subsaldos por conta fatiada
+MAX_FATIAS = 256
+
+# Modo otimista: saldo e movimentação numa única instrução, sem SELECT ... FOR UPDATE
+_OPERACAO_CONDICIONAL = (
+    "WITH conta AS ("
+    "  UPDATE core_correntista SET saldo = saldo {sinal} %(valor)s"
+    "  WHERE user_id = %(user_id)s AND {condicao} RETURNING id, saldo, fatias"
+    "), nova AS ("
+    "  INSERT INTO core_movimentacao (tipo_operacao, correntista_id, valor_operacao, data_operacao, descricao)"
+    "  SELECT %(tipo)s, id, %(valor)s, %(data)s, %(descricao)s FROM conta RETURNING id"
+    ") SELECT nova.id, conta.id, conta.saldo, conta.fatias FROM conta, nova"
+)
+_DEBITO_CONDICIONAL = _OPERACAO_CONDICIONAL.format(sinal='-', condicao='saldo >= %(valor)s')
+# Contas fatiadas creditam num subsaldo, pelo caminho normal
+_CREDITO_CONDICIONAL = _OPERACAO_CONDICIONAL.format(sinal='+', condicao='fatias = 0')
+
+
+class OperacaoError(Exception):
+    """
+    Erro de regra de negócio de uma operação, com a mensagem e o status HTTP
+    que a view deve devolver.
+    """
+    status = 400
+
+    def __init__(self, mensagem):
+        super().__init__(mensagem)
+        self.mensagem = mensagem
+
+
+class ContaNaoEncontrada(OperacaoError):
+    status = 404
+
+
+class SaldoInsuficiente(OperacaoError):
+    pass
+
+
+class MesmaConta(OperacaoError):
+    pass
+
+
+class LoteRejeitado(OperacaoError):
+    """
+    Lote no modo tudo-ou-nada com alguma operação recusada. Nada foi gravado.
+    """
+
+    def __init__(self, mensagem, resultados):
+        super().__init__(mensagem)
+        self.resultados = resultados
+
+
+def descricao_pagamento(descricao):
+    return f"Pagamento: {descricao}"
+
+
+def descricao_transferencia_enviada(destino):
+    return f"Transferência para {destino.nome_correntista}"
+
+
+def descricao_transferencia_recebida(origem):
+    return f"Transferência de {origem.nome_correntista}"
+
+
+def travar_conta(user):
+    try:
+        return Correntista.objects.select_for_update(no_key=True).get(user=user)
+    except Correntista.DoesNotExist:
+        raise ContaNaoEncontrada("Correntista não encontrado.")
+
+
+def creditar_subsaldo(correntista_id, fatias, valor):
+    """
+    Credita 'valor' em um subsaldo de uma conta fatiada, sem travar a linha
+    do Correntista. Escolhe ao acaso um subsaldo que nenhuma outra transação
+    esteja travando (SKIP LOCKED); se todos estiverem travados, espera por um
+    deles. Retorna False se a conta não tiver subsaldos (fatiamento desfeito
+    no meio do caminho): o crédito deve então ir para a linha da conta.
+    """
+    subsaldos = SubSaldo.objects.filter(correntista_id=correntista_id)
+    # Escolha e crédito em um único UPDATE ... WHERE pk = (SELECT ... SKIP LOCKED)
+    livre = subsaldos.select_for_update(skip_locked=True).order_by('?').values('pk')[:1]
+    if SubSaldo.objects.filter(pk=Subquery(livre)).update(saldo=F('saldo') + valor):
+        return True
+    return bool(subsaldos.filter(fatia=random.randrange(fatias)).update(saldo=F('saldo') + valor))
+
+
+def cobrir_com_subsaldos(correntista, falta):
+    """
+    Retira 'falta' dos subsaldos de uma conta fatiada já travada, para
+    completar um débito maior que o saldo da linha da conta. Retorna o valor
+    retirado (o chamador o soma ao saldo da conta) ou levanta SaldoInsuficiente.
+
+    Só os subsaldos necessários são travados, escolhidos pelos maiores saldos
+    de uma leitura sem lock. Créditos só aumentam os subsaldos e os débitos da
+    conta são serializados pelo lock do Correntista, então os valores travados
+    cobrem pelo menos o que a leitura indicou.
+    """
+    escolhidos = []
+    disponivel = Decimal('0.00')
+    for pk, saldo in (
+        SubSaldo.objects.filter(correntista=correntista, saldo__gt=0)
+        .order_by('-saldo').values_list('pk', 'saldo')
+    ):
+        escolhidos.append(pk)
+        disponivel += saldo
+        if disponivel >= falta:
+            break
+    if disponivel < falta:
+        raise SaldoInsuficiente("Saldo insuficiente.")
+
+    restante = falta
+    alterados = []
+    for subsaldo in SubSaldo.objects.select_for_update().filter(pk__in=escolhidos).order_by('fatia'):
+        retirada = min(subsaldo.saldo, restante)
+        subsaldo.saldo -= retirada
+        restante -= retirada
+        alterados.append(subsaldo)
+        if not restante:
+            break
+    SubSaldo.objects.bulk_update(alterados, ['saldo'])
+    return falta
+
+
+def consolidar_subsaldos(correntista):
+    """
+    Zera os subsaldos de uma conta já travada e devolve a soma deles, para
+    ser somada ao saldo da linha da conta.
+    """
+    # Trava os subsaldos antes de somar, para nenhum crédito se perder no zeramento
+    saldos = SubSaldo.objects.select_for_update().filter(correntista=correntista).values_list('saldo', flat=True)
+    total = sum(saldos, Decimal('0.00'))
+    SubSaldo.objects.filter(correntista=correntista).update(saldo=0)
+    return total
+
+
+def ativar_fatias(correntista_id, fatias):
+    """
+    Divide o saldo da conta em 'fatias' subsaldos (começando em zero; o saldo
+    atual continua na linha da conta). Deve ser chamada dentro de uma transação.
+    """
+    if not 1 <= fatias <= MAX_FATIAS:
+        raise OperacaoError(f"A quantidade de fatias deve estar entre 1 e {MAX_FATIAS}.")
+    try:
+        correntista = Correntista.objects.select_for_update(no_key=True).get(pk=correntista_id)
+    except Correntista.DoesNotExist:
+        raise ContaNaoEncontrada("Correntista não encontrado.")
+
+    existentes = set(SubSaldo.objects.filter(correntista=correntista).values_list('fatia', flat=True))
+    SubSaldo.objects.bulk_create([
+        SubSaldo(correntista=correntista, fatia=fatia) for fatia in range(fatias) if fatia not in existentes
+    ])
+    if correntista.fatias > fatias:
+        # Reduzindo: o saldo das fatias removidas volta para a linha da conta
+        removidas = SubSaldo.objects.select_for_update().filter(correntista=correntista, fatia__gte=fatias)
+        correntista.saldo += sum(removidas.values_list('saldo', flat=True), Decimal('0.00'))
+        removidas.delete()
+    correntista.fatias = fatias
+    correntista.save(update_fields=['saldo', 'fatias'])
+    return correntista
+
+
+def desativar_fatias(correntista_id):
+    """
+    Devolve o saldo dos subsaldos para a linha da conta e remove os
+    subsaldos. Deve ser chamada dentro de uma transação.
+    """
+    try:
+        correntista = Correntista.objects.select_for_update(no_key=True).get(pk=correntista_id)
+    except Correntista.DoesNotExist:
+        raise ContaNaoEncontrada("Correntista não encontrado.")
+
+    correntista.saldo += consolidar_subsaldos(correntista)
+    SubSaldo.objects.filter(correntista=correntista).delete()
+    correntista.fatias = 0
+    correntista.save(update_fields=['saldo', 'fatias'])
+    return correntista
+
+
+def operacao_condicional(sql, tipo, user, valor, descricao):
+    """
+    Altera o saldo e grava a movimentação numa única instrução (modo
+    'otimista'), com o UPDATE condicional travando a linha só até o fim da
+    transação, sem ida e volta entre a leitura e a escrita. Retorna None se a
+    condição não foi atendida (sem saldo na linha, conta fatiada ou
+    inexistente): o chamador segue então pelo caminho com lock, que decide o
+    resultado.
+    """
+    data = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {
+            'valor': valor, 'user_id': user.pk, 'tipo': tipo, 'data': data, 'descricao': descricao,
+        })
+        linha = cursor.fetchone()
+    if linha is None:
+        return None
+
+    movimentacao_id, correntista_id, saldo, fatias = linha
+    correntista = Correntista(pk=correntista_id, user=user, saldo=saldo, fatias=fatias)
+    registrar_escrita(correntista)
+    movimentacao = Movimentacao(
+        pk=movimentacao_id,
+        tipo_operacao=tipo,
+        correntista=correntista,
+        valor_operacao=valor,
+        data_operacao=data,
+        descricao=descricao,
+    )
+    resumos.registrar([movimentacao])
+    return movimentacao
+
+
+def debitar(user, valor, descricao):
+    """
+    Debita 'valor' da conta do usuário e registra a movimentação.
+    Deve ser chamada dentro de uma transação.
+    """
+    if diario.ativo():
+        return diario.debitar(user, valor, descricao)
+    if settings.OPERACOES_MODO == 'otimista':
+        movimentacao = operacao_condicional(_DEBITO_CONDICIONAL, 'D', user, valor, descricao)
+        if movimentacao is not None:
+            return movimentacao
+    correntista = travar_conta(user)
+
+    if correntista.saldo < valor:
+        if not correntista.fatias:
+            raise SaldoInsuficiente("Saldo insuficiente.")
+        correntista.saldo += cobrir_com_subsaldos(correntista, valor - correntista.saldo)
+
+    correntista.saldo -= valor
+    correntista.save(update_fields=['saldo'])
+    registrar_escrita(correntista)
+
+    movimentacao = Movimentacao.objects.create(
+        tipo_operacao='D',
+        correntista=correntista,
+        valor_operacao=valor,
+        descricao=descricao,
+    )
+    resumos.registrar([movimentacao])
+    return movimentacao
+
+
+def creditar(user, valor, descricao):
+    """
+    Credita 'valor' na conta do usuário e registra a movimentação.
+    Deve ser chamada dentro de uma transação.
+
+    Contas fatiadas não são travadas: o crédito vai para um subsaldo.
+    """
+    if diario.ativo():
+        return diario.creditar(user, valor, descricao)
+    if settings.OPERACOES_MODO == 'otimista':
+        movimentacao = operacao_condicional(_CREDITO_CONDICIONAL, 'C', user, valor, descricao)
+        if movimentacao is not None:
+            return movimentacao
+    # Só trava a linha de contas não fatiadas
+    correntista = Correntista.objects.select_for_update(no_key=True).filter(user=user, fatias=0).first()
+    creditado = False
+    if correntista is None:
+        # Conta fatiada (ou inexistente): lida sem lock
+        correntista = Correntista.objects.filter(user=user).first()
+        if correntista is None:
+            raise ContaNaoEncontrada("Correntista não encontrado.")
+        creditado = creditar_subsaldo(correntista.pk, correntista.fatias, valor)
+        if not creditado:
+            # Fatiamento desfeito entre a leitura e o crédito: trava a linha
+            correntista = travar_conta(user)
+
+    if not creditado:
+        correntista.saldo += valor
+        correntista.save(update_fields=['saldo'])
+    registrar_escrita(correntista)
+
+    movimentacao = Movimentacao.objects.create(
+        tipo_operacao='C',
+        correntista=correntista,
+        valor_operacao=valor,
+        descricao=descricao,
+    )
+    resumos.registrar([movimentacao])
+    return movimentacao
+
+
+def pagar(user, valor, descricao):
+    return debitar(user, valor, descricao_pagamento(descricao))
+
+
+def sacar(user, valor):
+    return debitar(user, valor, "Saque realizado")
+
+
+def depositar(user, valor):
+    return creditar(user, valor, "Depósito realizado")
+
+
+def transferir(user, destino_id, valor):
+    """
+    Transfere 'valor' da conta do usuário para a conta 'destino_id'.
+    Deve ser chamada dentro de uma transação. Retorna as movimentações de
+    débito e crédito criadas.
+
+    As duas contas são travadas em uma única consulta, sempre em ordem de
+    chave primária, para que transferências simultâneas em sentidos opostos
+    entre as mesmas contas não entrem em deadlock.
+
+    Um destino fatiado não é travado: o crédito vai para um de seus
+    subsaldos, então vários créditos simultâneos na mesma conta não esperam
+    uns pelos outros.
+    """
+    if diario.ativo():
+        return diario.transferir(user, destino_id, valor)
+    contas = list(
+        Correntista.objects.select_for_update(no_key=True)
+        .filter(Q(user=user) | Q(pk=destino_id, fatias=0))
+        .order_by('pk')
+    )
+    origem = next((conta for conta in contas if conta.user_id == user.pk), None)
+    destino = next((conta for conta in contas if conta.pk == destino_id), None)
+    if destino is None and origem is not None and origem.pk != destino_id:
+        # Destino fatiado (ou inexistente): lido sem lock
+        destino = Correntista.objects.filter(pk=destino_id).first()
+
+    if origem is None or destino is None:
+        raise ContaNaoEncontrada("Correntista de origem ou destino não encontrado.")
+
+    if origem.pk == destino.pk:
+        raise MesmaConta("A conta de origem e destino não podem ser a mesma.")
+
+    debito_principal = valor
+    if origem.saldo < valor:
+        if not origem.fatias:
+            raise SaldoInsuficiente("Saldo insuficiente no correntista de origem.")
+        try:
+            debito_principal -= cobrir_com_subsaldos(origem, valor - origem.saldo)
+        except SaldoInsuficiente:
+            raise SaldoInsuficiente("Saldo insuficiente no correntista de origem.")
+
+    credito_principal = destino in contas or not creditar_subsaldo(destino.pk, destino.fatias, valor)
+    if credito_principal and destino not in contas:
+        # Fatiamento desfeito entre a leitura e o crédito: trava a linha
+        destino = Correntista.objects.select_for_update(no_key=True).get(pk=destino_id)
+
+    # Débito e crédito em um único UPDATE, calculado pelo banco
+    Correntista.objects.filter(pk__in=[origem.pk, destino.pk] if credito_principal else [origem.pk]).update(
+        saldo=Case(
+            When(pk=origem.pk, then=F('saldo') - debito_principal),
+            default=F('saldo') + valor,
+        )
+    )
+    origem.saldo -= debito_principal
+    if credito_principal:
+        destino.saldo += valor
+    registrar_escrita(origem)
+    registrar_escrita(destino)
+
+    debito, credito = Movimentacao.objects.bulk_create([
+        Movimentacao(
+            tipo_operacao='D',
+            correntista=origem,
+            valor_operacao=valor,
+            descricao=descricao_transferencia_enviada(destino),
+            correntista_beneficiario=destino,
+        ),
+        Movimentacao(
+            tipo_operacao='C',
+            correntista=destino,
+            valor_operacao=valor,
+            descricao=descricao_transferencia_recebida(origem),
+            correntista_beneficiario=origem,
+        ),
+    ])
+    resumos.registrar([debito, credito])
+    return debito, credito
+
+
+def processar_lote(user, itens, atomico):
+    """
+    Aplica uma lista de operações (indice, tipo, dados validados) da conta do
+    usuário em uma única passada. Deve ser chamada dentro de uma transação.
+
+    Todas as contas envolvidas são travadas uma única vez, em ordem de chave
+    primária; os saldos são calculados em memória e gravados no fim com um
+    bulk_update, junto de um único bulk_create das movimentações.
+
+    No modo atômico, qualquer operação recusada levanta LoteRejeitado sem
+    gravar nada. No modo de melhor esforço, as recusadas aparecem nos
+    resultados e as demais são aplicadas.
+
+    Retorna (resultados, movimentacoes).
+    """
+    if diario.ativo():
+        return diario.processar_lote(user, itens, atomico)
+    destino_ids = {dados['correntista_destino_id'] for _, tipo, dados in itens if tipo == 'transferencia'}
+    contas = {
+        conta.pk: conta
+        for conta in Correntista.objects.select_for_update(no_key=True)
+        .filter(Q(user=user) | Q(pk__in=destino_ids))
+        .order_by('pk')
+    }
+    origem = next((conta for conta in contas.values() if conta.user_id == user.pk), None)
+    if origem is None:
+        raise ContaNaoEncontrada("Correntista não encontrado.")
+    if origem.fatias:
+        # Os saldos do lote são calculados em memória sobre a linha da conta, já
+        # gravada com os subsaldos zerados (mesmo que nenhum item seja aplicado)
+        origem.saldo += consolidar_subsaldos(origem)
+        origem.save(update_fields=['saldo'])
+
+    resultados = []
+    movimentacoes = []
+    alteradas = {}
+
+    for indice, tipo, dados in itens:
+        try:
+            novas = aplicar_item_lote(origem, contas, tipo, dados)
+        except OperacaoError as erro:
+            resultados.append({'indice': indice, 'status': erro.status, 'erro': erro.mensagem})
+            continue
+
+        for movimentacao in novas:
+            alteradas[movimentacao.correntista.pk] = movimentacao.correntista
+        movimentacoes.extend(novas)
+        resultados.append({'indice': indice, 'status': 200})
+
+    if atomico and any('erro' in resultado for resultado in resultados):
+        raise LoteRejeitado("Lote rejeitado: nenhuma operação foi aplicada.", resultados)
+
+    if alteradas:
+        Correntista.objects.bulk_update(alteradas.values(), ['saldo'], batch_size=500)
+        for conta in alteradas.values():
+            registrar_escrita(conta)
+        movimentacoes = Movimentacao.objects.bulk_create(movimentacoes, batch_size=1000)
+        resumos.registrar(movimentacoes)
+
+    return resultados, movimentacoes
+
+
+def aplicar_item_lote(origem, contas, tipo, dados):
+    """
+    Aplica uma operação do lote aos saldos em memória e devolve as
+    movimentações (ainda não gravadas) que ela gera.
+    """
+    valor = dados['valor']
+
+    if tipo == 'deposito':
+        origem.saldo += valor
+        return [Movimentacao(tipo_operacao='C', correntista=origem, valor_operacao=valor, descricao="Depósito realizado")]
+
+    if tipo == 'transferencia':
+        destino = contas.get(dados['correntista_destino_id'])
+        if destino is None:
+            raise ContaNaoEncontrada("Correntista de origem ou destino não encontrado.")
+        if destino.pk == origem.pk:
+            raise MesmaConta("A conta de origem e destino não podem ser a mesma.")
+
+    if origem.saldo < valor:
+        raise SaldoInsuficiente("Saldo insuficiente.")
+    origem.saldo -= valor
+
+    if tipo == 'pagamento':
+        return [Movimentacao(
+            tipo_operacao='D', correntista=origem, valor_operacao=valor,
+            descricao=descricao_pagamento(dados['descricao']),
+        )]
+
+    if tipo == 'saque':
+        return [Movimentacao(tipo_operacao='D', correntista=origem, valor_operacao=valor, descricao="Saque realizado")]
+
+    destino.saldo += valor
+    return [
+        Movimentacao(
+            tipo_operacao='D', correntista=origem, valor_operacao=valor,
+            descricao=descricao_transferencia_enviada(destino), correntista_beneficiario=destino,
+        ),
+        Movimentacao(
+            tipo_operacao='C', correntista=destino, valor_operacao=valor,
+            descricao=descricao_transferencia_recebida(origem), correntista_beneficiario=origem,
+        ),
+    ]
@@ -0,0 +1,111 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class ExtratoCursorPagination(BasePagination):
+    """
+    Paginação por cursor (keyset) sobre (data_operacao, id), do mais recente
+    para o mais antigo. Cada página é uma busca direta no índice
+    (correntista, -data_operacao, -id), então o custo não cresce com o
+    tamanho do histórico da conta.
+    """
+    page_size = 50
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'tamanho'
+    invalid_cursor_message = 'Cursor inválido.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.finalizar_pagina(list(self.consulta_pagina(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        Versão para views assíncronas, com o ORM assíncrono.
+        """
+        return self.finalizar_pagina([item async for item in self.consulta_pagina(queryset, request)])
+
+    def consulta_pagina(self, queryset, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.tamanho = self.get_page_size(request)
+
+        posicao = self.decode_cursor(request)
+        if posicao is not None:
+            data_operacao, pk = posicao
+            # O filtro redundante em data_operacao__lte limita a varredura do
+            # índice; o exclude descarta os empates já entregues.
+            queryset = queryset.filter(data_operacao__lte=data_operacao).exclude(
+                data_operacao=data_operacao, id__gte=pk
+            )
+
+        # Busca um item a mais para saber se existe próxima página
+        return queryset.order_by('-data_operacao', '-id')[:self.tamanho + 1]
+
+    def finalizar_pagina(self, pagina):
+        self.has_next = len(pagina) > self.tamanho
+        pagina = pagina[:self.tamanho]
+        self.next_position = self.get_position(pagina[-1]) if self.has_next else None
+        return pagina
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            tamanho = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if tamanho <= 0:
+            return self.page_size
+        return min(tamanho, self.max_page_size)
+
+    def get_position(self, item):
+        # Aceita tanto instâncias do modelo quanto linhas de .values()
+        if isinstance(item, dict):
+            return item['data_operacao'], item['id']
+        return item.data_operacao, item.id
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, self.encode_cursor(self.next_position)
+        )
+
+    def encode_cursor(self, posicao):
+        data_operacao, pk = posicao
+        valor = f'{data_operacao.isoformat()}|{pk}'
+        return urlsafe_b64encode(valor.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            data_str, pk_str = urlsafe_b64decode(encoded.encode('ascii')).decode('ascii').split('|')
+            data_operacao = parse_datetime(data_str)
+            pk = int(pk_str)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if data_operacao is None:
+            raise NotFound(self.invalid_cursor_message)
+        return data_operacao, pk
@@ -0,0 +1,103 @@
+"""
+Partições mensais de core_movimentacao (Postgres), criadas pelo
+0007_particionar_movimentacao e mantidas pelo comando particoes_movimentacao.
+
+Cada mês (em UTC) fica em core_movimentacao_pAAAA_MM; a partição padrão
+core_movimentacao_padrao recebe o que cair fora delas, para nenhuma
+inserção falhar. Partições antigas podem ser arquivadas em
+core_movimentacao_arquivo, uma tabela comum com um único índice.
+"""
+import re
+from datetime import date, datetime, timezone
+
+TABELA = 'core_movimentacao'
+PADRAO = 'core_movimentacao_padrao'
+ARQUIVO = 'core_movimentacao_arquivo'
+_NOME = re.compile(r'^core_movimentacao_p(\d{4})_(\d{2})$')
+
+
+def mes_seguinte(mes):
+    return date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+
+def mes_anterior(mes):
+    return date(mes.year - (mes.month == 1), (mes.month - 2) % 12 + 1, 1)
+
+
+def nome_particao(mes):
+    return f"{TABELA}_p{mes.year:04d}_{mes.month:02d}"
+
+
+def limite(mes):
+    # Limites em UTC, independentes do fuso da sessão
+    return datetime(mes.year, mes.month, 1, tzinfo=timezone.utc)
+
+
+def listar_particoes(cursor):
+    """
+    Meses (date do dia 1) das partições mensais existentes, em ordem.
+    """
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = %s::regclass",
+        [TABELA],
+    )
+    meses = []
+    for (nome,) in cursor.fetchall():
+        encontrado = _NOME.match(nome)
+        if encontrado:
+            meses.append(date(int(encontrado[1]), int(encontrado[2]), 1))
+    return sorted(meses)
+
+
+def linhas_na_padrao(cursor):
+    cursor.execute(f"SELECT count(*) FROM {PADRAO}")
+    return cursor.fetchone()[0]
+
+
+def criar_particao(cursor, mes):
+    """
+    Cria a partição do mês. As linhas desse mês que estiverem na partição
+    padrão são movidas para ela antes de anexá-la, como o Postgres exige.
+    Deve ser chamada dentro de uma transação.
+    """
+    nome = nome_particao(mes)
+    inicio, fim = limite(mes), limite(mes_seguinte(mes))
+    cursor.execute(f"CREATE TABLE {nome} (LIKE {TABELA} INCLUDING DEFAULTS)")
+    cursor.execute(
+        f"WITH movidas AS (DELETE FROM {PADRAO} WHERE data_operacao >= %s AND data_operacao < %s RETURNING *) "
+        f"INSERT INTO {nome} SELECT * FROM movidas",
+        [inicio, fim],
+    )
+    movidas = cursor.rowcount
+    cursor.execute(f"ALTER TABLE {TABELA} ATTACH PARTITION {nome} FOR VALUES FROM (%s) TO (%s)", [inicio, fim])
+    return movidas
+
+
+def contas_sem_checkpoint(cursor, mes):
+    """
+    Contas com movimentações no mês posteriores ao checkpoint mais recente.
+    Essas movimentações ainda entram na conciliação e não podem ser arquivadas.
+    """
+    cursor.execute(
+        f"SELECT m.correntista_id FROM ("
+        f"  SELECT correntista_id, max(id) AS ultima FROM {nome_particao(mes)} GROUP BY correntista_id"
+        f") m WHERE NOT EXISTS ("
+        f"  SELECT 1 FROM core_saldocheckpoint c"
+        f"  WHERE c.correntista_id = m.correntista_id AND c.movimentacao_id >= m.ultima"
+        f") ORDER BY 1"
+    )
+    return [linha[0] for linha in cursor.fetchall()]
+
+
+def arquivar_particao(cursor, mes):
+    """
+    Copia as linhas da partição do mês para a tabela de arquivo e remove a
+    partição. Deve ser chamada dentro de uma transação. Retorna as linhas arquivadas.
+    """
+    nome = nome_particao(mes)
+    cursor.execute(f"ALTER TABLE {TABELA} DETACH PARTITION {nome}")
+    cursor.execute(f"INSERT INTO {ARQUIVO} SELECT * FROM {nome} ORDER BY correntista_id, data_operacao")
+    arquivadas = cursor.rowcount
+    cursor.execute(f"DROP TABLE {nome}")
+    return arquivadas
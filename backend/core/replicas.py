@@ -0,0 +1,163 @@
+"""
+Leituras em réplicas do Postgres (REPLICAS_LEITURA), com read-your-writes.
+
+As views de leitura marcadas com @leitura_em_replica (extrato, exportação,
+resumo e saldo) rodam com o contextvar 'replica_atual' apontando para uma
+réplica, e o RoteadorReplicas manda para ela as consultas do ORM feitas
+nesse contexto. As escritas e todo o resto continuam no primário.
+
+Duas regras mantêm a consistência:
+- o usuário cuja conta foi alterada (cache_saldo.registrar_escrita chama
+  fixar_primario, inclusive para o destino de uma transferência) lê só do
+  primário por REPLICA_JANELA_PRIMARIO segundos após o commit;
+- cada processo mede o atraso das réplicas (no máximo uma vez a cada
+  REPLICA_VERIFICACAO_INTERVALO segundos) e deixa de fora as indisponíveis ou
+  atrasadas além de REPLICA_ATRASO_MAXIMO; sem nenhuma em dia, lê do primário.
+
+Com a janela maior que o atraso máximo mais o intervalo, uma leitura na
+réplica fora da janela já vê todas as escritas da conta. A marca do primário
+fica no cache 'default': com mais de um processo, use o backend 'redis'
+(CACHE_BACKEND).
+"""
+import contextvars
+import random
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, connections, transaction
+
+from . import metricas
+
+replica_atual = contextvars.ContextVar('replica_atual', default=None)
+
+# Zero no primário e numa réplica que já aplicou todo o WAL recebido; NULL se
+# a réplica ainda não aplicou nenhuma transação
+_ATRASO = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+    "            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "            ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+# alias: (instante da medição, atraso em segundos ou None), por processo
+_atrasos = {}
+
+
+class RoteadorReplicas:
+    """
+    Leituras na réplica escolhida para a view em andamento; todo o resto,
+    inclusive objetos lidos na réplica e salvos depois, no primário.
+    """
+
+    def db_for_read(self, model, **hints):
+        return replica_atual.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Primário e réplicas têm os mesmos dados
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None if db == 'default' else False
+
+
+def medir_atraso(alias):
+    """
+    Atraso da réplica em segundos, ou None se ela não responder.
+    """
+    conexao = connections[alias]
+    try:
+        with conexao.cursor() as cursor:
+            cursor.execute(_ATRASO)
+            atraso = cursor.fetchone()[0]
+    except DatabaseError:
+        conexao.close()
+        atraso = None
+    else:
+        atraso = None if atraso is None else float(atraso)
+    metricas.atraso_replica.definir(-1 if atraso is None else atraso, alias)
+    return atraso
+
+
+def atraso(alias):
+    """
+    Atraso da réplica, medido há no máximo REPLICA_VERIFICACAO_INTERVALO segundos.
+    """
+    agora = time.monotonic()
+    medicao = _atrasos.get(alias)
+    if medicao is None or agora - medicao[0] >= settings.REPLICA_VERIFICACAO_INTERVALO:
+        medicao = _atrasos[alias] = (agora, medir_atraso(alias))
+    return medicao[1]
+
+
+def replicas_disponiveis():
+    return [
+        alias for alias in settings.REPLICAS_LEITURA
+        if (valor := atraso(alias)) is not None and valor <= settings.REPLICA_ATRASO_MAXIMO
+    ]
+
+
+def chave_primario(user_id):
+    return f"replica:primario:{user_id}"
+
+
+def fixar_primario(user_id):
+    """
+    Faz o usuário ler do primário por REPLICA_JANELA_PRIMARIO segundos,
+    contados do commit da transação em andamento.
+    """
+    if settings.REPLICAS_LEITURA:
+        transaction.on_commit(
+            lambda: caches['default'].set(chave_primario(user_id), True, timeout=settings.REPLICA_JANELA_PRIMARIO)
+        )
+
+
+def escolher_replica(user_id):
+    """
+    Réplica de onde o usuário pode ler, ou None para o primário (escrita
+    recente ou nenhuma réplica em dia).
+    """
+    if caches['default'].get(chave_primario(user_id)):
+        metricas.leituras.somar(1, 'default', 'escrita_recente')
+        return None
+    disponiveis = replicas_disponiveis()
+    if not disponiveis:
+        metricas.leituras.somar(1, 'default', 'atraso')
+        return None
+    alias = random.choice(disponiveis)
+    metricas.leituras.somar(1, alias, 'replica')
+    return alias
+
+
+def leitura_em_replica(view):
+    """
+    Roda a view lendo de uma réplica, quando houver uma adequada ao usuário.
+    Vai abaixo do @api_view (ou do @api_async), com request.user já
+    autenticado; nas views de classe, com method_decorator.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if not settings.REPLICAS_LEITURA:
+                return await view(request, *args, **kwargs)
+            token = replica_atual.set(await sync_to_async(escolher_replica)(request.user.pk))
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                replica_atual.reset(token)
+        return wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.REPLICAS_LEITURA:
+            return view(request, *args, **kwargs)
+        token = replica_atual.set(escolher_replica(request.user.pk))
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            replica_atual.reset(token)
+    return wrapper
@@ -0,0 +1,199 @@
+"""
+Resumos do extrato por período, a partir da tabela ResumoDiario.
+
+As operações somam suas movimentações aos totais do dia na mesma transação
+(registrar), com um INSERT ... ON CONFLICT DO UPDATE por conta e dia. O
+resumo de um intervalo agrega essas linhas por dia, semana ou mês no banco,
+e o custo depende da quantidade de dias com movimentação, não da de
+movimentações.
+"""
+import random
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, DecimalField, F, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate, TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from . import particoes
+from .models import Correntista, Movimentacao, ResumoDiario, SubSaldo
+
+PERIODOS = {
+    'dia': TruncDay,
+    'semana': TruncWeek, # semanas começando na segunda-feira
+    'mes': TruncMonth,
+}
+
+ZERO = Value(Decimal('0.00'), output_field=DecimalField(max_digits=14, decimal_places=2))
+
+_SOMAR = (
+    "ON CONFLICT (correntista_id, dia, parte) DO UPDATE SET "
+    "creditos = {tabela}.creditos + EXCLUDED.creditos, "
+    "debitos = {tabela}.debitos + EXCLUDED.debitos, "
+    "qtd_creditos = {tabela}.qtd_creditos + EXCLUDED.qtd_creditos, "
+    "qtd_debitos = {tabela}.qtd_debitos + EXCLUDED.qtd_debitos"
+)
+_UPSERT = (
+    "INSERT INTO {tabela} (correntista_id, dia, parte, creditos, debitos, qtd_creditos, qtd_debitos) "
+    "VALUES {valores} " + _SOMAR
+)
+_UPSERT_INTERVALO = (
+    "INSERT INTO {tabela} (correntista_id, dia, parte, creditos, debitos, qtd_creditos, qtd_debitos) "
+    "SELECT correntista_id, (data_operacao AT TIME ZONE %s)::date, 0, "
+    "  coalesce(sum(valor_operacao) FILTER (WHERE tipo_operacao = 'C'), 0), "
+    "  coalesce(sum(valor_operacao) FILTER (WHERE tipo_operacao = 'D'), 0), "
+    "  count(*) FILTER (WHERE tipo_operacao = 'C'), count(*) FILTER (WHERE tipo_operacao = 'D') "
+    "FROM {movimentacoes} WHERE id BETWEEN %s AND %s GROUP BY 1, 2 ORDER BY 1, 2 " + _SOMAR
+)
+
+
+def registrar(movimentacoes):
+    """
+    Soma as movimentações recém-gravadas aos resumos diários das contas.
+    Deve ser chamada na transação que as gravou.
+
+    As linhas são atualizadas em ordem de (conta, dia, parte), como os locks
+    das contas, para que operações simultâneas não entrem em deadlock.
+    """
+    totais = defaultdict(lambda: [Decimal('0.00'), Decimal('0.00'), 0, 0])
+    for movimentacao in movimentacoes:
+        correntista = movimentacao.correntista
+        # Contas fatiadas espalham os totais do dia entre as partes, como o saldo entre os subsaldos
+        parte = random.randrange(correntista.fatias) if correntista.fatias else 0
+        chave = (correntista.pk, timezone.localdate(movimentacao.data_operacao), parte)
+        credito = movimentacao.tipo_operacao == 'C'
+        totais[chave][0 if credito else 1] += movimentacao.valor_operacao
+        totais[chave][2 if credito else 3] += 1
+    if not totais:
+        return
+
+    linhas = sorted(totais.items())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            _UPSERT.format(
+                tabela=ResumoDiario._meta.db_table,
+                valores=', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(linhas)),
+            ),
+            [valor for chave, total in linhas for valor in (*chave, *total)],
+        )
+
+
+def registrar_intervalo(primeiro_id, ultimo_id):
+    """
+    Soma aos resumos diários as movimentações com id entre 'primeiro_id' e
+    'ultimo_id' (inclusive), agregadas pelo banco, para cargas em massa que
+    não passam pelas operações. Só no Postgres; nos demais bancos, use
+    reconstruir. Contas fatiadas ficam com tudo na parte 0.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            _UPSERT_INTERVALO.format(tabela=ResumoDiario._meta.db_table, movimentacoes=Movimentacao._meta.db_table),
+            [timezone.get_current_timezone_name(), primeiro_id, ultimo_id],
+        )
+
+
+def resumo(correntista, periodo, data_inicio=None, data_fim=None):
+    """
+    Créditos, débitos, quantidades e saldo no fim de cada período (dia,
+    semana ou mês) com movimentação no intervalo, em ordem cronológica.
+
+    Os totais e o saldo de referência vêm da mesma consulta, portanto do
+    mesmo snapshot: o saldo no fim do último período é o saldo atual menos o
+    líquido dos dias posteriores, e os anteriores saem dele subtraindo o
+    líquido de cada período.
+    """
+    hoje = timezone.localdate()
+    data_fim = min(data_fim or hoje, hoje)
+    linhas = ResumoDiario.objects.filter(correntista=correntista, dia__lte=data_fim)
+    if data_inicio:
+        linhas = linhas.filter(dia__gte=data_inicio)
+
+    posteriores = (
+        ResumoDiario.objects.filter(correntista=correntista, dia__gt=data_fim).order_by()
+        .values('correntista').annotate(total=Sum(F('creditos') - F('debitos'))).values('total')
+    )
+    subsaldos = (
+        SubSaldo.objects.filter(correntista=correntista).order_by()
+        .values('correntista').annotate(total=Sum('saldo')).values('total')
+    )
+    periodos = list(
+        linhas.annotate(inicio=PERIODOS[periodo]('dia'))
+        .values('inicio')
+        .annotate(
+            creditos=Sum('creditos'),
+            debitos=Sum('debitos'),
+            qtd_creditos=Sum('qtd_creditos'),
+            qtd_debitos=Sum('qtd_debitos'),
+            saldo_atual=Subquery(Correntista.objects.filter(pk=correntista.pk).values('saldo')),
+            saldo_subsaldos=Coalesce(Subquery(subsaldos), ZERO),
+            liquido_posterior=Coalesce(Subquery(posteriores), ZERO),
+        )
+        .order_by('inicio')
+    )
+    if not periodos:
+        return []
+
+    ultimo = periodos[-1]
+    saldo = ultimo['saldo_atual'] + ultimo['saldo_subsaldos'] - ultimo['liquido_posterior']
+    for linha in reversed(periodos):
+        linha['saldo_final'] = saldo
+        saldo -= linha['creditos'] - linha['debitos']
+    return periodos
+
+
+def _totais_arquivados(correntista_ids):
+    """
+    Totais por (conta, dia) das movimentações arquivadas (só no Postgres).
+    """
+    if connection.vendor != 'postgresql':
+        return []
+    filtro, parametros = '', [timezone.get_current_timezone_name()]
+    if correntista_ids is not None:
+        filtro, parametros = 'WHERE correntista_id = ANY(%s)', parametros + [list(correntista_ids)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT correntista_id, (data_operacao AT TIME ZONE %s)::date, "
+            f"  coalesce(sum(valor_operacao) FILTER (WHERE tipo_operacao = 'C'), 0), "
+            f"  coalesce(sum(valor_operacao) FILTER (WHERE tipo_operacao = 'D'), 0), "
+            f"  count(*) FILTER (WHERE tipo_operacao = 'C'), count(*) FILTER (WHERE tipo_operacao = 'D') "
+            f"FROM {particoes.ARQUIVO} {filtro} GROUP BY 1, 2",
+            parametros,
+        )
+        return cursor.fetchall()
+
+
+def reconstruir(correntista_ids=None):
+    """
+    Recalcula do razão os resumos diários das contas (todas, sem
+    'correntista_ids'), para contas cujas movimentações foram gravadas sem
+    passar pelas operações, como as do bench_api.
+    """
+    movimentacoes = Movimentacao.objects.all()
+    resumos = ResumoDiario.objects.all()
+    if correntista_ids is not None:
+        movimentacoes = movimentacoes.filter(correntista_id__in=correntista_ids)
+        resumos = resumos.filter(correntista_id__in=correntista_ids)
+
+    totais = (
+        movimentacoes.annotate(dia=TruncDate('data_operacao')).order_by()
+        .values_list('correntista_id', 'dia')
+        .annotate(
+            creditos=Coalesce(Sum(Case(When(tipo_operacao='C', then=F('valor_operacao')))), ZERO),
+            debitos=Coalesce(Sum(Case(When(tipo_operacao='D', then=F('valor_operacao')))), ZERO),
+            qtd_creditos=Count('pk', filter=Q(tipo_operacao='C')),
+            qtd_debitos=Count('pk', filter=Q(tipo_operacao='D')),
+        )
+    )
+    novos = {}
+    for correntista_id, dia, *valores in [*totais, *_totais_arquivados(correntista_ids)]:
+        resumo_dia = novos.setdefault((correntista_id, dia), ResumoDiario(correntista_id=correntista_id, dia=dia))
+        resumo_dia.creditos += valores[0]
+        resumo_dia.debitos += valores[1]
+        resumo_dia.qtd_creditos += valores[2]
+        resumo_dia.qtd_debitos += valores[3]
+
+    with transaction.atomic():
+        resumos.delete()
+        ResumoDiario.objects.bulk_create(novos.values(), batch_size=1000)
+    return len(novos)
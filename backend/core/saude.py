@@ -0,0 +1,48 @@
+"""
+Health check do backend, para o Docker e balanceadores de carga.
+"""
+import logging
+
+from django.conf import settings
+from django.db import connection
+from django.http import JsonResponse
+
+from . import replicas
+
+# Números do psycopg_pool expostos no health check
+ESTATISTICAS_POOL = ('pool_min', 'pool_max', 'pool_size', 'pool_available', 'requests_waiting')
+
+logger = logging.getLogger(__name__)
+
+
+def estatisticas_pool():
+    """
+    Situação do pool de conexões deste processo, ou None sem pool.
+    """
+    pool = getattr(connection, 'pool', None)
+    if pool is None:
+        return None
+    estatisticas = pool.get_stats()
+    return {nome: estatisticas.get(nome, 0) for nome in ESTATISTICAS_POOL}
+
+
+def saude_view(request):
+    """
+    Confere se o banco responde (com uma conexão emprestada do pool, quando
+    houver) e devolve a situação do pool e o atraso de cada réplica de
+    leitura, em segundos (null se indisponível). Responde 503 se o primário
+    falhar; uma réplica indisponível só deixa de receber leituras.
+    Fica fora do DRF, sem autenticação: o motivo de uma falha (que pode
+    trazer host, banco e usuário) vai só para o log.
+    Acesso via /api/saude/
+    """
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    except Exception:
+        logger.exception("Health check: o banco não respondeu")
+        return JsonResponse({'banco': 'erro'}, status=503)
+    corpo = {'banco': 'ok', 'pool': estatisticas_pool()}
+    if settings.REPLICAS_LEITURA:
+        corpo['replicas'] = {alias: replicas.medir_atraso(alias) for alias in settings.REPLICAS_LEITURA}
+    return JsonResponse(corpo)
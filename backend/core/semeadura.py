@@ -0,0 +1,346 @@
+"""
+Geração de dados sintéticos em escala de produção (comando seed_bank).
+
+Tudo sai da semente: nomes, saldos de abertura e cada lote de
+movimentações usam um random.Random próprio, então o resultado não depende
+de quantos processos geraram os lotes nem da ordem em que terminaram. Os ids
+das movimentações são reservados antes (cada lote tem sua faixa), e cada
+lote cobre uma fatia do período, em ordem: id e data crescem juntos.
+
+Uma fração das contas (as quentes) recebe uma fatia desproporcional das
+operações, como origem e como destino. O saldo de abertura de cada conta é
+o sorteado, aumentado quando preciso para que nenhum saldo parcial fique
+negativo; o saldo final é a abertura mais o líquido das movimentações, e a
+abertura vira o checkpoint de conciliação da conta.
+"""
+import math
+import random
+from datetime import timezone as dt_timezone
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from . import operacoes, particoes, resumos
+from .models import (
+    ChaveIdempotencia,
+    Correntista,
+    Lancamento,
+    Movimentacao,
+    ResumoDiario,
+    SaldoCheckpoint,
+    SubSaldo,
+)
+
+PREFIXO = 'seed_'
+
+NOMES = (
+    'Ana', 'Bruno', 'Carla', 'Daniel', 'Eduarda', 'Felipe', 'Gabriela', 'Henrique', 'Isabela', 'João',
+    'Juliana', 'Lucas', 'Mariana', 'Mateus', 'Natália', 'Otávio', 'Patrícia', 'Rafael', 'Sofia', 'Thiago',
+)
+SOBRENOMES = (
+    'Almeida', 'Barbosa', 'Cardoso', 'Costa', 'Ferreira', 'Gomes', 'Lima', 'Martins', 'Oliveira', 'Pereira',
+    'Ribeiro', 'Rocha', 'Santos', 'Silva', 'Souza',
+)
+CONTAS_PAGAS = (
+    'Luz', 'Água', 'Internet', 'Telefone', 'Aluguel', 'Condomínio', 'Mercado', 'Farmácia', 'Escola',
+    'Cartão de crédito',
+)
+
+# tipo: (fração das operações, mediana do valor em reais, dispersão do lognormal)
+MISTURA = {
+    'transferencia': (0.45, 150, 1.0),
+    'pagamento': (0.35, 90, 0.9),
+    'saque': (0.10, 200, 0.6),
+    'deposito': (0.10, 2500, 0.5),
+}
+# Limites de uma operação, em centavos
+VALOR_MINIMO = 100
+VALOR_MAXIMO = 5_000_000
+# Saldos de abertura sorteados (centavos): mediana de R$ 2.000
+ABERTURA_MEDIANA = 200_000
+ABERTURA_DISPERSAO = 1.2
+ABERTURA_MAXIMA = 50_000_000
+# Limite do campo saldo (max_digits=10)
+SALDO_MAXIMO = 10 ** 10 - 1
+
+COLUNAS_MOVIMENTACAO = (
+    'id', 'tipo_operacao', 'correntista_id', 'valor_operacao', 'data_operacao', 'descricao',
+    'correntista_beneficiario_id',
+)
+
+
+class Distribuicao:
+    """
+    Sorteio enviesado de contas: com probabilidade 'trafego_quentes', uma
+    das primeiras 'fracao_quentes' das contas; senão, qualquer uma.
+    """
+
+    def __init__(self, total, fracao_quentes, trafego_quentes):
+        self.total = total
+        self.quentes = max(1, int(total * fracao_quentes)) if fracao_quentes else 0
+        self.trafego_quentes = trafego_quentes if self.quentes else 0
+
+    def sortear(self, rng):
+        if rng.random() < self.trafego_quentes:
+            return rng.randrange(self.quentes)
+        return rng.randrange(self.total)
+
+
+def centavos(valor):
+    sinal = '-' if valor < 0 else ''
+    valor = abs(valor)
+    return f"{sinal}{valor // 100}.{valor % 100:02d}"
+
+
+def nomes_contas(semente, total):
+    rng = random.Random(f'{semente}:nomes')
+    return [f'{rng.choice(NOMES)} {rng.choice(SOBRENOMES)}' for _ in range(total)]
+
+
+def aberturas_sorteadas(semente, total):
+    rng = random.Random(f'{semente}:abertura')
+    return [
+        min(int(rng.lognormvariate(math.log(ABERTURA_MEDIANA), ABERTURA_DISPERSAO)), ABERTURA_MAXIMA)
+        for _ in range(total)
+    ]
+
+
+def _valor(rng, tipo):
+    _, mediana, dispersao = MISTURA[tipo]
+    valor = int(rng.lognormvariate(math.log(mediana * 100), dispersao))
+    if tipo == 'saque':
+        valor = valor // 1000 * 1000 # em notas de R$ 10
+    return min(max(valor, VALOR_MINIMO), VALOR_MAXIMO)
+
+
+def gerar_lote(semente, numero, tamanho, ids, nomes, distribuicao, inicio, duracao):
+    """
+    Gera as 'tamanho' movimentações do lote 'numero', com datas crescentes
+    em [inicio, inicio + duracao). Transferências geram duas linhas (débito e
+    crédito, com a mesma data).
+
+    Retorna (linhas, totais): as linhas na ordem das COLUNAS_MOVIMENTACAO,
+    sem o id, e, por índice de conta, [líquido, menor saldo parcial] do lote
+    em centavos, relativos ao saldo da conta no início dele.
+    """
+    rng = random.Random(f'{semente}:lote:{numero}')
+    tipos, pesos = list(MISTURA), [fracao for fracao, _, _ in MISTURA.values()]
+    instantes = sorted(rng.random() for _ in range(tamanho))
+    linhas = []
+    totais = {}
+
+    def movimentar(indice, valor):
+        total = totais.get(indice)
+        if total is None:
+            total = totais[indice] = [0, 0]
+        total[0] += valor
+        if total[0] < total[1]:
+            total[1] = total[0]
+
+    while len(linhas) < tamanho:
+        data = inicio + duracao * instantes[len(linhas)]
+        tipo = rng.choices(tipos, pesos)[0]
+        if tipo == 'transferencia' and (tamanho - len(linhas) < 2 or distribuicao.total < 2):
+            tipo = 'pagamento'
+        origem = distribuicao.sortear(rng)
+        valor = _valor(rng, tipo)
+
+        if tipo == 'deposito':
+            linhas.append(('C', ids[origem], centavos(valor), data, "Depósito realizado", None))
+            movimentar(origem, valor)
+        elif tipo == 'saque':
+            linhas.append(('D', ids[origem], centavos(valor), data, "Saque realizado", None))
+            movimentar(origem, -valor)
+        elif tipo == 'pagamento':
+            descricao = operacoes.descricao_pagamento(rng.choice(CONTAS_PAGAS))
+            linhas.append(('D', ids[origem], centavos(valor), data, descricao, None))
+            movimentar(origem, -valor)
+        else:
+            destino = distribuicao.sortear(rng)
+            while destino == origem:
+                destino = distribuicao.sortear(rng)
+            # Como operacoes.descricao_transferencia_enviada/recebida
+            enviada = f"Transferência para {nomes[destino]}"
+            recebida = f"Transferência de {nomes[origem]}"
+            linhas.append(('D', ids[origem], centavos(valor), data, enviada, ids[destino]))
+            linhas.append(('C', ids[destino], centavos(valor), data, recebida, ids[origem]))
+            movimentar(origem, -valor)
+            movimentar(destino, valor)
+    return linhas, totais
+
+
+class Saldos:
+    """
+    Junta os totais dos lotes, recebidos em ordem, nos saldos de abertura e
+    final (centavos) de cada conta.
+    """
+
+    def __init__(self, aberturas):
+        self.aberturas = aberturas
+        self.liquido = [0] * len(aberturas)
+        self.minimo = [0] * len(aberturas)
+
+    def somar(self, totais):
+        for indice, (liquido, minimo) in totais.items():
+            self.minimo[indice] = min(self.minimo[indice], self.liquido[indice] + minimo)
+            self.liquido[indice] += liquido
+
+    def finais(self):
+        """
+        (abertura, saldo final) por conta, com a abertura cobrindo o menor
+        saldo parcial.
+        """
+        saldos = []
+        for sorteada, minimo, liquido in zip(self.aberturas, self.minimo, self.liquido):
+            abertura = max(sorteada, -minimo)
+            saldos.append((abertura, abertura + liquido))
+        return saldos
+
+
+def copiar(tabela, colunas, linhas):
+    """
+    Grava as linhas com COPY no Postgres e com executemany nos demais bancos.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            with cursor.copy(f"COPY {tabela} ({', '.join(colunas)}) FROM STDIN") as copia:
+                for linha in linhas:
+                    copia.write_row(linha)
+        else:
+            cursor.executemany(
+                f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join(['%s'] * len(colunas))})",
+                list(linhas),
+            )
+
+
+def reservar_ids_movimentacoes(quantidade):
+    """
+    Reserva 'quantidade' ids consecutivos de movimentação e devolve o primeiro.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence('core_movimentacao', 'id'), "
+                "nextval(pg_get_serial_sequence('core_movimentacao', 'id')) + %s - 1)",
+                [quantidade],
+            )
+            return cursor.fetchone()[0] - quantidade + 1
+        cursor.execute("SELECT coalesce(max(id), 0) FROM core_movimentacao")
+        return cursor.fetchone()[0] + 1
+
+
+def garantir_particoes(inicio, fim):
+    """
+    Cria antes da carga as partições mensais do período que faltarem, para
+    as movimentações não caírem na partição padrão (só no Postgres).
+    """
+    if connection.vendor != 'postgresql':
+        return
+    mes = inicio.astimezone(dt_timezone.utc).date().replace(day=1)
+    ultimo = fim.astimezone(dt_timezone.utc).date().replace(day=1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        existentes = set(particoes.listar_particoes(cursor))
+        while mes <= ultimo:
+            if mes not in existentes:
+                particoes.criar_particao(cursor, mes)
+            mes = particoes.mes_seguinte(mes)
+
+
+def criar_contas(nomes, prefixo=PREFIXO):
+    """
+    Cria usuários ('prefixo' seguido do índice, senha 123456, como os do
+    0002_seed_initial_data) e contas com saldo zero, com COPY. Retorna os ids
+    das contas, na ordem dos nomes.
+    """
+    senha = make_password('123456') # o mesmo hash para todos, calculado uma vez
+    agora = timezone.now()
+    usernames = [f'{prefixo}{indice:07d}' for indice in range(len(nomes))]
+    with transaction.atomic():
+        copiar(
+            'auth_user',
+            ('password', 'is_superuser', 'username', 'first_name', 'last_name', 'email', 'is_staff',
+             'is_active', 'date_joined'),
+            (
+                (senha, False, username, *nome.split(' ', 1), f'{username}@email.com', False, True, agora)
+                for username, nome in zip(usernames, nomes)
+            ),
+        )
+        usuarios = dict(User.objects.filter(username__startswith=prefixo).values_list('username', 'pk'))
+        copiar(
+            'core_correntista', ('user_id', 'nome_correntista', 'saldo', 'fatias'),
+            ((usuarios[username], nome, '0.00', 0) for username, nome in zip(usernames, nomes)),
+        )
+        contas = dict(
+            Correntista.objects.filter(user__username__startswith=prefixo).values_list('user_id', 'pk')
+        )
+    return [contas[usuarios[username]] for username in usernames]
+
+
+def gravar_lote(primeiro, linhas):
+    """
+    Grava com COPY as linhas de um lote de gerar_lote, com ids a partir de
+    'primeiro', e, no Postgres, soma-as aos resumos diários.
+    """
+    with transaction.atomic():
+        copiar(
+            'core_movimentacao', COLUNAS_MOVIMENTACAO,
+            ((primeiro + indice, *linha) for indice, linha in enumerate(linhas)),
+        )
+        if connection.vendor == 'postgresql' and linhas:
+            resumos.registrar_intervalo(primeiro, primeiro + len(linhas) - 1)
+
+
+def gravar_saldos(ids, finais):
+    """
+    Grava o saldo final das contas e, como checkpoint de conciliação
+    anterior a todas as movimentações, o de abertura.
+    """
+    agora = timezone.now()
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "CREATE TEMPORARY TABLE saldos_semeados (id bigint PRIMARY KEY, saldo numeric(10, 2)) "
+                "ON COMMIT DROP"
+            )
+            copiar(
+                'saldos_semeados', ('id', 'saldo'),
+                ((conta_id, centavos(final)) for conta_id, (_, final) in zip(ids, finais)),
+            )
+            cursor.execute(
+                "UPDATE core_correntista c SET saldo = s.saldo FROM saldos_semeados s WHERE c.id = s.id"
+            )
+        else:
+            cursor.executemany(
+                "UPDATE core_correntista SET saldo = %s WHERE id = %s",
+                [(centavos(final), conta_id) for conta_id, (_, final) in zip(ids, finais)],
+            )
+        copiar(
+            'core_saldocheckpoint', ('correntista_id', 'movimentacao_id', 'saldo', 'criado_em'),
+            ((conta_id, 0, centavos(abertura), agora) for conta_id, (abertura, _) in zip(ids, finais)),
+        )
+
+
+def apagar_contas(prefixo=PREFIXO):
+    """
+    Remove as contas semeadas com o prefixo e tudo o que depende delas com
+    DELETEs em massa (o delete() do ORM carregaria cada conta e cada usuário).
+    """
+    usuarios = User.objects.filter(username__startswith=prefixo)
+    contas = Correntista.objects.filter(user__in=usuarios)
+    with transaction.atomic():
+        Token.objects.filter(user__in=usuarios).delete()
+        ChaveIdempotencia.objects.filter(user__in=usuarios).delete()
+        for modelo in (Movimentacao, Lancamento):
+            modelo.objects.filter(correntista_beneficiario__in=contas).exclude(correntista__in=contas).update(
+                correntista_beneficiario=None
+            )
+        for modelo in (Movimentacao, Lancamento, ResumoDiario, SaldoCheckpoint, SubSaldo):
+            modelo.objects.filter(correntista__in=contas).delete()
+        with connection.cursor() as cursor:
+            semeados = "SELECT id FROM auth_user WHERE substr(username, 1, %s) = %s"
+            cursor.execute(f"DELETE FROM core_correntista WHERE user_id IN ({semeados})", [len(prefixo), prefixo])
+            cursor.execute(f"DELETE FROM auth_user WHERE id IN ({semeados})", [len(prefixo), prefixo])
+            return cursor.rowcount
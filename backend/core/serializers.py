@@ -1,8 +1,13 @@
+from django.conf import settings
 from rest_framework import serializers
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 from .models import Movimentacao, Correntista
 
 class SaldoSerializer(serializers.ModelSerializer):
+    # Saldo da linha da conta mais o dos subsaldos (contas fatiadas)
+    saldo = serializers.DecimalField(source='saldo_total', max_digits=10, decimal_places=2, read_only=True)
+
     class Meta:
         model = Correntista
         fields = ['saldo']
@@ -39,6 +44,80 @@ class MovimentacaoSerializer(serializers.ModelSerializer): # Serializer para o m
             'correntista_beneficiario'
         ]
 
+class MovimentacaoExtratoSerializer(serializers.BaseSerializer): # Serializer somente leitura do extrato, sem o maquinário de campos do DRF
+    """
+    Gera a mesma saída do MovimentacaoSerializer a partir das linhas de
+    Movimentacao.objects.values(*MovimentacaoExtratoSerializer.campos).
+    O correntista dono do extrato vem no contexto, então não precisa de JOIN.
+    """
+    campos = (
+        'id',
+        'tipo_operacao',
+        'valor_operacao',
+        'data_operacao',
+        'descricao',
+        'correntista_beneficiario_id',
+        'correntista_beneficiario__nome_correntista',
+    )
+    tipos_display = dict(Movimentacao.TIPO_OPERACAO_CHOICES)
+
+    def to_representation(self, linha):
+        correntista = self.context['correntista']
+        beneficiario_id = linha['correntista_beneficiario_id']
+        return {
+            'id': linha['id'],
+            'tipo_operacao': linha['tipo_operacao'],
+            'tipo_operacao_display': self.tipos_display.get(linha['tipo_operacao'], linha['tipo_operacao']),
+            'valor_operacao': str(linha['valor_operacao']),
+            'data_operacao': self.formatar_data(linha['data_operacao']),
+            'descricao': linha['descricao'],
+            'correntista': {'id': correntista.id, 'nome_correntista': correntista.nome_correntista},
+            'correntista_beneficiario': None if beneficiario_id is None else {
+                'id': beneficiario_id,
+                'nome_correntista': linha['correntista_beneficiario__nome_correntista'],
+            },
+        }
+
+    @staticmethod
+    def formatar_data(valor):
+        # Mesmo formato do DateTimeField do DRF (ISO 8601, 'Z' para UTC)
+        valor = timezone.localtime(valor).isoformat()
+        if valor.endswith('+00:00'):
+            valor = valor[:-6] + 'Z'
+        return valor
+
+class ExtratoFiltroSerializer(serializers.Serializer): # Serializer para os filtros opcionais do extrato
+    data_inicio = serializers.DateField(required=False)
+    data_fim = serializers.DateField(required=False)
+    tipo = serializers.ChoiceField(choices=Movimentacao.TIPO_OPERACAO_CHOICES, required=False)
+
+    def validate(self, data):
+        if 'data_inicio' in data and 'data_fim' in data and data['data_inicio'] > data['data_fim']:
+            raise serializers.ValidationError("A data inicial não pode ser posterior à data final.")
+        return data
+
+class ExtratoExportacaoSerializer(ExtratoFiltroSerializer): # Filtros do extrato mais o formato da exportação
+    formato = serializers.ChoiceField(choices=['csv', 'ndjson'], default='csv')
+    compactar = serializers.BooleanField(default=False)
+
+class ExtratoResumoFiltroSerializer(serializers.Serializer): # Intervalo e agrupamento do resumo do extrato
+    data_inicio = serializers.DateField(required=False)
+    data_fim = serializers.DateField(required=False)
+    periodo = serializers.ChoiceField(choices=['dia', 'semana', 'mes'], default='dia')
+
+    def validate(self, data):
+        if 'data_inicio' in data and 'data_fim' in data and data['data_inicio'] > data['data_fim']:
+            raise serializers.ValidationError("A data inicial não pode ser posterior à data final.")
+        return data
+
+class ResumoPeriodoSerializer(serializers.Serializer): # Totais de um período do resumo do extrato
+    inicio = serializers.DateField()
+    creditos = serializers.DecimalField(max_digits=14, decimal_places=2)
+    debitos = serializers.DecimalField(max_digits=14, decimal_places=2)
+    qtd_creditos = serializers.IntegerField()
+    qtd_debitos = serializers.IntegerField()
+    saldo_final = serializers.DecimalField(max_digits=14, decimal_places=2)
+
 class PagamentoSerializer(OperacaoBasicaSerializer): # Serializer para operações de Pagamento
     valor = serializers.DecimalField(
         max_digits=10, 
@@ -55,4 +134,46 @@ class TransferenciaSerializer(serializers.Serializer): # Serializer para operaç
         validators=[MinValueValidator(0.01)])
     
     def validate(self, data):
-        return data
\ No newline at end of file
+        return data
+
+class LoteSerializer(serializers.Serializer): # Serializer para um lote de operações
+    MODOS = [
+        ('tudo_ou_nada', 'Tudo ou nada'),
+        ('melhor_esforco', 'Melhor esforço'),
+    ]
+
+    # Cada operação do lote é validada pelo mesmo serializer da view individual
+    SERIALIZERS_POR_TIPO = {
+        'pagamento': PagamentoSerializer,
+        'transferencia': TransferenciaSerializer,
+        'saque': OperacaoBasicaSerializer,
+        'deposito': OperacaoBasicaSerializer,
+    }
+
+    modo = serializers.ChoiceField(choices=MODOS, default='tudo_ou_nada')
+    operacoes = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=settings.LOTE_MAX_OPERACOES,
+    )
+
+    def validar_operacoes(self):
+        """
+        Valida cada operação do lote. Retorna a lista de itens válidos
+        (indice, tipo, dados validados) e a lista de erros por índice.
+        """
+        itens = []
+        erros = []
+        for indice, operacao in enumerate(self.validated_data['operacoes']):
+            tipo = operacao.get('tipo')
+            serializer_class = self.SERIALIZERS_POR_TIPO.get(tipo)
+            if serializer_class is None:
+                erros.append({'indice': indice, 'status': 400, 'erro': {'tipo': [f"Tipo de operação inválido: {tipo}."]}})
+                continue
+
+            serializer = serializer_class(data=operacao)
+            if serializer.is_valid():
+                itens.append((indice, tipo, serializer.validated_data))
+            else:
+                erros.append({'indice': indice, 'status': 400, 'erro': serializer.errors})
+        return itens, erros
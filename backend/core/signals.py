@@ -0,0 +1,43 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidar_token
+from .metricas import medir_consulta
+from .models import Correntista, SaldoCheckpoint
+
+
+@receiver(post_delete, sender=Token)
+def invalidar_token_removido(sender, instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: invalidar_token(key), using=kwargs.get('using'))
+
+
+@receiver(post_save, sender=User)
+def invalidar_tokens_do_usuario(sender, instance, **kwargs):
+    # O cache guarda o is_active do usuário: qualquer alteração descarta os
+    # tokens dele. A remoção espera o commit; antes dele, outra requisição
+    # poderia ler o usuário ainda sem a alteração e repor o valor antigo.
+    # Alterações feitas com QuerySet.update() não disparam o sinal e expiram
+    # pelo TIMEOUT.
+    keys = list(Token.objects.filter(user_id=instance.pk).values_list('key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: [invalidar_token(key) for key in keys], using=kwargs.get('using'))
+
+
+@receiver(post_save, sender=Correntista)
+def criar_checkpoint_de_abertura(sender, instance, created, raw=False, **kwargs):
+    # Uma conta nova ainda não tem movimentações: o saldo inicial é o ponto
+    # de partida da conciliação
+    if created and not raw:
+        SaldoCheckpoint.objects.create(correntista=instance, movimentacao_id=0, saldo=instance.saldo)
+
+
+@receiver(connection_created)
+def instalar_medidor_de_consultas(sender, connection, **kwargs):
+    # O wrapper só mede as consultas de requisições amostradas
+    if medir_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.append(medir_consulta)
@@ -1,3 +1,1646 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from collections import Counter
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import (
+    diario,
+    exportacao,
+    historico_notificacoes,
+    limites,
+    metricas,
+    particoes,
+    replicas,
+    resumos,
+    semeadura,
+)
+from .authentication import chave_cache_token, obter_token
+from .middleware import get_user_from_token
+from .models import ChaveIdempotencia, Correntista, Lancamento, Movimentacao, ResumoDiario, SaldoCheckpoint
+from .notificacoes import DespachanteNotificacoes, grupo_notificacoes
+from .operacoes import transferir
+from .serializers import MovimentacaoSerializer
+from .views import consulta_extrato
+
+
+def criar_correntista(username, saldo='1000.00'):
+    user = User.objects.create_user(username=username, password='123456')
+    return Correntista.objects.create(user=user, nome_correntista=username.title(), saldo=Decimal(saldo))
+
+
+class ExtratoViewTests(TestCase):
+    def setUp(self):
+        self.correntista = criar_correntista('ana')
+        self.client = APIClient()
+        # Usuário recarregado, sem o correntista já em cache (como numa requisição real)
+        self.client.force_authenticate(User.objects.get(pk=self.correntista.user_id))
+
+    def criar_movimentacoes(self, quantidade, tipo='D'):
+        return [
+            Movimentacao.objects.create(
+                tipo_operacao=tipo,
+                correntista=self.correntista,
+                valor_operacao=Decimal('1.00'),
+                descricao=f"Movimentação {i}",
+            )
+            for i in range(quantidade)
+        ]
+
+    def test_pagina_por_cursor_sem_repetir_itens(self):
+        movimentacoes = self.criar_movimentacoes(7)
+        # Força empates em data_operacao para exercitar o desempate por id
+        Movimentacao.objects.filter(correntista=self.correntista).update(data_operacao=timezone.now())
+
+        vistos = []
+        url = '/api/extrato/?tamanho=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            vistos.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(vistos, sorted((m.id for m in movimentacoes), reverse=True))
+
+    def test_filtra_por_tipo_e_periodo(self):
+        self.criar_movimentacoes(2, tipo='C')
+        antiga = self.criar_movimentacoes(1, tipo='C')[0]
+        Movimentacao.objects.filter(pk=antiga.pk).update(data_operacao=timezone.now() - timedelta(days=10))
+        self.criar_movimentacoes(3, tipo='D')
+
+        hoje = timezone.now().date().isoformat()
+        response = self.client.get(f'/api/extrato/?tipo=C&data_inicio={hoje}&data_fim={hoje}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertTrue(all(item['tipo_operacao'] == 'C' for item in response.data['results']))
+
+    def test_numero_de_consultas_independe_do_tamanho_da_pagina(self):
+        beneficiario = criar_correntista('bruno')
+        for i in range(20):
+            Movimentacao.objects.create(
+                tipo_operacao='D',
+                correntista=self.correntista,
+                valor_operacao=Decimal('2.50'),
+                descricao=f"Transferência {i}",
+                correntista_beneficiario=beneficiario if i % 2 else None,
+            )
+
+        # Uma consulta para o correntista do usuário e uma para a página
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/extrato/?tamanho=20')
+
+        self.assertEqual(response.status_code, 200)
+        esperado = MovimentacaoSerializer(
+            Movimentacao.objects.filter(correntista=self.correntista).order_by('-data_operacao', '-id'),
+            many=True,
+        ).data
+        self.assertEqual(response.json()['results'], esperado)
+
+    def test_cursor_invalido(self):
+        response = self.client.get('/api/extrato/?cursor=invalido')
+        self.assertEqual(response.status_code, 404)
+
+    def test_periodo_invertido(self):
+        response = self.client.get('/api/extrato/?data_inicio=2025-02-01&data_fim=2025-01-01')
+        self.assertEqual(response.status_code, 400)
+
+
+@mock.patch.object(exportacao, 'TAMANHO_LOTE', 3)
+class ExportacaoExtratoTests(TestCase):
+    def setUp(self):
+        self.correntista = criar_correntista('ana')
+        beneficiario = criar_correntista('bruno')
+        for i in range(8):
+            Movimentacao.objects.create(
+                tipo_operacao='CD'[i % 2],
+                correntista=self.correntista,
+                valor_operacao=Decimal('1.50'),
+                descricao=f"Movimentação, \"{i}\"",
+                correntista_beneficiario=beneficiario if i % 3 == 0 else None,
+            )
+        self.token = Token.objects.create(user=self.correntista.user)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.get(pk=self.correntista.user_id))
+
+    def exportar(self, parametros=''):
+        response = self.client.get(f'/api/extrato/export/?{parametros}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response
+
+    def extrato_json(self, parametros=''):
+        return self.client.get(f'/api/extrato/?tamanho=500&{parametros}').json()['results']
+
+    def test_csv_com_todas_as_movimentacoes(self):
+        response = self.exportar()
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="extrato.csv"', response['Content-Disposition'])
+        linhas = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(linhas[0], list(exportacao.COLUNAS_CSV))
+        esperado = self.extrato_json()
+        self.assertEqual([int(linha[0]) for linha in linhas[1:]], [item['id'] for item in esperado])
+        self.assertEqual(linhas[1][4], esperado[0]['descricao'])
+
+    def test_ndjson_igual_ao_extrato_com_filtros(self):
+        hoje = timezone.now().date().isoformat()
+        response = self.exportar(f'formato=ndjson&tipo=C&data_inicio={hoje}&data_fim={hoje}')
+
+        linhas = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(linha) for linha in linhas], self.extrato_json(f'tipo=C&data_inicio={hoje}'))
+
+    def test_gzip(self):
+        compactado = b''.join(self.exportar('compactar=true').streaming_content)
+        self.assertEqual(gzip.decompress(compactado), b''.join(self.exportar().streaming_content))
+
+    def test_cabecalho_sai_antes_da_consulta_e_as_linhas_em_lotes(self):
+        pedacos = iter(self.exportar().streaming_content)
+        with self.assertNumQueries(0):
+            self.assertTrue(next(pedacos).startswith(b'id,'))
+        # 8 movimentações em lotes de 3
+        self.assertEqual([pedaco.count(b'\n') for pedaco in pedacos], [3, 3, 2])
+
+    def test_parametros_invalidos(self):
+        self.assertEqual(self.client.get('/api/extrato/export/?formato=xml').status_code, 400)
+
+    @mock.patch('channels.db.close_old_connections', lambda: None)
+    async def test_asgi_transmite_com_iterador_assincrono(self):
+        response = await AsyncClient().get(
+            '/api/extrato/export/?formato=ndjson', headers={'Authorization': f'Token {self.token.key}'}
+        )
+
+        self.assertTrue(response.is_async)
+        pedacos = [pedaco async for pedaco in response.streaming_content]
+        esperado = await sync_to_async(self.extrato_json)()
+        self.assertEqual([json.loads(linha) for linha in b''.join(pedacos).decode().splitlines()], esperado)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "Requer Postgres para o particionamento")
+class ParticoesTests(TransactionTestCase):
+    def setUp(self):
+        self.conta = criar_correntista('vera', saldo='100.00')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.get(pk=self.conta.user_id))
+        self.atual = timezone.now().astimezone(dt_timezone.utc).date().replace(day=1)
+
+    def mover_para(self, movimentacao, mes):
+        Movimentacao.objects.filter(pk=movimentacao.pk).update(
+            data_operacao=particoes.limite(mes) + timedelta(days=2)
+        )
+
+    def particao_de(self, movimentacao):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT tableoid::regclass::text FROM core_movimentacao WHERE id = %s", [movimentacao.pk])
+            return cursor.fetchone()[0]
+
+    def test_movimentacoes_vao_para_a_particao_do_mes_e_o_extrato_usa_so_ela(self):
+        self.client.post('/api/depositar/', {'valor': '10.00'})
+        movimentacao = Movimentacao.objects.get()
+        self.assertEqual(self.particao_de(movimentacao), particoes.nome_particao(self.atual))
+
+        hoje = timezone.localdate().isoformat()
+        plano = consulta_extrato(self.conta, {'data_inicio': timezone.localdate(), 'data_fim': timezone.localdate()}).explain()
+        self.assertIn(particoes.nome_particao(self.atual), plano)
+        self.assertNotIn(particoes.PADRAO, plano)
+        self.assertEqual(len(self.client.get(f'/api/extrato/?data_inicio={hoje}').data['results']), 1)
+
+    def test_cria_particoes_futuras_trazendo_linhas_da_padrao(self):
+        self.client.post('/api/depositar/', {'valor': '10.00'})
+        movimentacao = Movimentacao.objects.get()
+        distante = self.atual
+        for _ in range(8):
+            distante = particoes.mes_seguinte(distante)
+        self.mover_para(movimentacao, distante)
+        self.assertEqual(self.particao_de(movimentacao), particoes.PADRAO)
+
+        call_command('particoes_movimentacao', meses_futuros=8, stdout=io.StringIO())
+
+        self.assertEqual(self.particao_de(movimentacao), particoes.nome_particao(distante))
+        with connection.cursor() as cursor:
+            self.assertIn(distante, particoes.listar_particoes(cursor))
+            self.assertEqual(particoes.linhas_na_padrao(cursor), 0)
+
+    def test_arquiva_so_meses_cobertos_por_checkpoint(self):
+        antigo = particoes.mes_anterior(particoes.mes_anterior(particoes.mes_anterior(self.atual)))
+        self.client.post('/api/depositar/', {'valor': '10.00'})
+        self.client.post('/api/sacar/', {'valor': '5.00'})
+        antiga = Movimentacao.objects.order_by('id').first()
+        self.mover_para(antiga, antigo)
+        with transaction.atomic(), connection.cursor() as cursor:
+            particoes.criar_particao(cursor, antigo)
+
+        saida = io.StringIO()
+        call_command('particoes_movimentacao', manter_meses=2, stdout=saida)
+        self.assertIn('não arquivada', saida.getvalue())
+        self.assertTrue(Movimentacao.objects.filter(pk=antiga.pk).exists())
+
+        call_command('conciliar_saldos', processos=1, margem=0, registrar=True, stdout=io.StringIO())
+        call_command('particoes_movimentacao', manter_meses=2, stdout=io.StringIO())
+
+        self.assertEqual(list(Movimentacao.objects.values_list('tipo_operacao', flat=True)), ['D'])
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT id FROM {particoes.ARQUIVO}")
+            self.assertEqual(cursor.fetchall(), [(antiga.pk,)])
+            self.assertNotIn(antigo, particoes.listar_particoes(cursor))
+        # O checkpoint cobre as linhas arquivadas
+        call_command('conciliar_saldos', processos=1, margem=0, stdout=io.StringIO())
+
+
+class NotificacaoTests(TestCase):
+    def setUp(self):
+        self.correntista = criar_correntista('carla')
+        self.client = APIClient()
+        self.client.force_authenticate(self.correntista.user)
+
+    def test_notificacao_enfileirada_apos_commit_com_data_da_movimentacao(self):
+        with mock.patch('core.notificacoes.despachante.enfileirar') as enfileirar:
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.post('/api/depositar/', {'valor': '10.00'})
+                self.assertEqual(response.status_code, 200)
+                enfileirar.assert_not_called()
+
+            for callback in callbacks:
+                callback()
+
+        movimentacao = Movimentacao.objects.get(correntista=self.correntista)
+        grupo, evento, user_id = enfileirar.call_args.args
+        self.assertEqual(grupo, f"notifications_{self.correntista.user_id}")
+        self.assertEqual(user_id, self.correntista.user_id)
+        self.assertEqual(evento['notification']['timestamp'], str(movimentacao.data_operacao))
+
+    def test_despachante_entrega_lote_no_loop_vinculado(self):
+        despachante = DespachanteNotificacoes()
+        channel_layer = get_channel_layer()
+
+        async def cenario():
+            despachante.vincular_loop(asyncio.get_running_loop())
+            canal = await channel_layer.new_channel()
+            await channel_layer.group_add('notifications_teste', canal)
+
+            # Enfileira a partir de outra thread, como faz uma view síncrona
+            for i in range(3):
+                await asyncio.to_thread(
+                    despachante.enfileirar,
+                    'notifications_teste',
+                    {'type': 'send_notification', 'notification': {'message': str(i)}},
+                )
+
+            recebidas = [await asyncio.wait_for(channel_layer.receive(canal), 1) for _ in range(3)]
+            return [evento['notification']['message'] for evento in recebidas]
+
+        self.assertEqual(async_to_sync(cenario)(), ['0', '1', '2'])
+
+    def test_despachante_volta_a_agendar_apos_falha(self):
+        despachante = DespachanteNotificacoes()
+        channel_layer = get_channel_layer()
+
+        async def cenario():
+            despachante.vincular_loop(asyncio.get_running_loop())
+            canal = await channel_layer.new_channel()
+            await channel_layer.group_add('notifications_teste', canal)
+
+            with mock.patch('core.notificacoes.asyncio.run_coroutine_threadsafe', side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    await asyncio.to_thread(
+                        despachante.enfileirar,
+                        'notifications_teste',
+                        {'type': 'send_notification', 'notification': {'message': '0'}},
+                    )
+            await asyncio.to_thread(
+                despachante.enfileirar,
+                'notifications_teste',
+                {'type': 'send_notification', 'notification': {'message': '1'}},
+            )
+
+            recebidas = [await asyncio.wait_for(channel_layer.receive(canal), 1) for _ in range(2)]
+            return [evento['notification']['message'] for evento in recebidas]
+
+        # A notificação que ficou pendente sai junto com a seguinte
+        self.assertEqual(async_to_sync(cenario)(), ['0', '1'])
+
+    @override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'core.layers.CanalLocalLayer'}})
+    def test_layer_local_registra_notificacoes_enviadas(self):
+        channel_layer = get_channel_layer()
+
+        with mock.patch('core.notificacoes.despachante', DespachanteNotificacoes()):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/api/sacar/', {'valor': '5.00'})
+
+        # Sem loop ASGI vinculado, o despachante envia pela sua thread de fundo
+        limite = time.monotonic() + 2
+        while not channel_layer.enviados and time.monotonic() < limite:
+            time.sleep(0.01)
+
+        grupo, mensagem = channel_layer.enviados[0]
+        self.assertEqual(grupo, f"notifications_{self.correntista.user_id}")
+        self.assertIn('Saque de R$ 5.00', mensagem['notification']['message'])
+
+
+@mock.patch('channels.db.close_old_connections', lambda: None)
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'core.layers.CanalLocalLayer'}},
+    WS_JANELA_MS=100, WS_HEARTBEAT=0, WS_TIMEOUT_OCIOSO=0,
+)
+class ConsumerNotificacoesTests(TestCase):
+    def setUp(self):
+        self.correntista = criar_correntista('lia')
+        self.token = Token.objects.create(user=self.correntista.user)
+        self.grupo = f"notifications_{self.correntista.user_id}"
+
+    def receber(self, notificacoes, espera=0):
+        """
+        Conecta, publica as notificações no grupo do usuário e devolve os
+        frames recebidos depois da mensagem de boas-vindas.
+        """
+        from api.asgi import application
+
+        async def cenario():
+            communicator = WebsocketCommunicator(application, f"/ws/notifications/?token={self.token.key}")
+            conectado, _ = await communicator.connect()
+            self.assertTrue(conectado)
+            await communicator.receive_json_from()
+            channel_layer = get_channel_layer()
+            for mensagem in notificacoes:
+                await channel_layer.group_send(
+                    self.grupo, {'type': 'send_notification', 'notification': {'message': mensagem}}
+                )
+            await asyncio.sleep(espera)
+            frames = []
+            while not await communicator.receive_nothing(0.3):
+                saida = await communicator.receive_output()
+                if saida['type'] == 'websocket.close':
+                    frames.append(saida)
+                    break
+                frames.append(json.loads(saida['text']))
+            await communicator.disconnect()
+            return frames
+
+        return async_to_sync(cenario)()
+
+    def test_notificacoes_da_mesma_janela_saem_num_frame(self):
+        frames = self.receber(['a', 'b', 'c'])
+        self.assertEqual(frames, [[{'message': 'a'}, {'message': 'b'}, {'message': 'c'}]])
+
+    @override_settings(WS_JANELA_MS=0)
+    def test_notificacao_isolada_continua_como_objeto(self):
+        self.assertEqual(self.receber(['a']), [{'message': 'a'}])
+
+    @override_settings(WS_FILA_MAXIMA=2, WS_POLITICA_FILA='resumo')
+    def test_fila_cheia_resume_as_pendentes(self):
+        [frame] = self.receber(['1', '2', '3', '4', '5'])
+        self.assertEqual(frame[0]['resumidas'], 4)
+        self.assertEqual(frame[1:], [{'message': '5'}])
+
+    @override_settings(WS_FILA_MAXIMA=2, WS_POLITICA_FILA='descartar')
+    def test_fila_cheia_descarta_as_mais_antigas(self):
+        self.assertEqual(self.receber(['1', '2', '3', '4', '5']), [[{'message': '4'}, {'message': '5'}]])
+
+    @override_settings(WS_HEARTBEAT=0.05, WS_TIMEOUT_OCIOSO=0.2)
+    def test_heartbeat_e_fechamento_por_inatividade(self):
+        frames = self.receber([], espera=0.3)
+        self.assertIn({'tipo': 'ping'}, frames)
+        self.assertEqual(frames[-1], {'type': 'websocket.close', 'code': 4000})
+
+
+@mock.patch('channels.db.close_old_connections', lambda: None)
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'core.layers.CanalLocalLayer'}},
+    WS_JANELA_MS=0, WS_HEARTBEAT=0, WS_TIMEOUT_OCIOSO=0,
+)
+class ReenvioNotificacoesTests(TestCase):
+    def setUp(self):
+        caches['notificacoes'].clear()
+        self.correntista = criar_correntista('bia')
+        self.user_id = self.correntista.user_id
+        self.token = Token.objects.create(user=self.correntista.user)
+
+    def registrar(self, *mensagens):
+        for mensagem in mensagens:
+            historico_notificacoes.registrar(self.user_id, {'message': mensagem})
+
+    def conectar(self, seq=None, notificacoes_ao_vivo=()):
+        """
+        Conecta (com ?seq= se informado) e devolve as boas-vindas e os frames seguintes.
+        """
+        from api.asgi import application
+
+        async def cenario():
+            caminho = f"/ws/notifications/?token={self.token.key}"
+            if seq is not None:
+                caminho += f"&seq={seq}"
+            communicator = WebsocketCommunicator(application, caminho)
+            conectado, _ = await communicator.connect()
+            self.assertTrue(conectado)
+            boas_vindas = await communicator.receive_json_from()
+            for notificacao in notificacoes_ao_vivo:
+                await get_channel_layer().group_send(
+                    grupo_notificacoes(self.user_id), {'type': 'send_notification', 'notification': notificacao}
+                )
+            frames = []
+            while not await communicator.receive_nothing(0.2):
+                frames.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+            return boas_vindas, frames
+
+        return async_to_sync(cenario)()
+
+    def test_deposito_gera_notificacoes_com_sequencia_crescente(self):
+        client = APIClient()
+        client.force_authenticate(self.correntista.user)
+        channel_layer = get_channel_layer()
+        with mock.patch('core.notificacoes.despachante', DespachanteNotificacoes()):
+            with self.captureOnCommitCallbacks(execute=True):
+                client.post('/api/depositar/', {'valor': '10.00'})
+                client.post('/api/depositar/', {'valor': '20.00'})
+
+        # A sequência é dada pelo despachante, na sua thread de fundo
+        limite = time.monotonic() + 2
+        while len(channel_layer.enviados) < 2 and time.monotonic() < limite:
+            time.sleep(0.01)
+
+        primeira, segunda = (mensagem['notification']['seq'] for _, mensagem in channel_layer.enviados)
+        self.assertEqual(segunda, primeira + 1)
+        perdidas, lacuna = async_to_sync(historico_notificacoes.aperdidas)(self.user_id, primeira - 1)
+        self.assertEqual([n['seq'] for n in perdidas], [primeira, segunda])
+        self.assertFalse(lacuna)
+
+    def test_reconexao_recebe_so_as_notificacoes_perdidas(self):
+        boas_vindas, frames = self.conectar()
+        self.assertEqual(frames, [])
+        self.registrar('a', 'b', 'c')
+
+        _, frames = self.conectar(seq=boas_vindas['seq'] + 1)
+        self.assertEqual([n['message'] for n in frames[0]], ['b', 'c'])
+
+    def test_notificacao_ao_vivo_ja_reenviada_nao_se_repete(self):
+        boas_vindas, _ = self.conectar()
+        self.registrar('a')
+        reenviada = {'message': 'a', 'seq': boas_vindas['seq'] + 1}
+
+        _, frames = self.conectar(seq=boas_vindas['seq'], notificacoes_ao_vivo=[reenviada])
+        self.assertEqual(frames, [reenviada])
+
+    def test_notificacoes_ao_vivo_fora_de_ordem_sao_entregues(self):
+        boas_vindas, _ = self.conectar()
+        seq = boas_vindas['seq']
+        ao_vivo = [{'message': 'c', 'seq': seq + 2}, {'message': 'b', 'seq': seq + 1}]
+
+        _, frames = self.conectar(notificacoes_ao_vivo=ao_vivo)
+        # Num frame só ou em dois, conforme a janela de envio
+        recebidas = [n for frame in frames for n in (frame if isinstance(frame, list) else [frame])]
+        self.assertEqual(recebidas, ao_vivo)
+
+    @override_settings(NOTIFICACOES_HISTORICO_MAX=2)
+    def test_lacuna_quando_o_historico_nao_cobre_o_intervalo(self):
+        boas_vindas, _ = self.conectar()
+        self.registrar('a', 'b', 'c')
+
+        _, frames = self.conectar(seq=boas_vindas['seq'])
+        self.assertEqual(frames[0]['tipo'], 'lacuna')
+        self.assertEqual([n['message'] for n in frames[1]], ['b', 'c'])
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'core.layers.CanalLocalLayer'}},
+    WS_JANELA_MS=0, WS_HEARTBEAT=0, WS_TIMEOUT_OCIOSO=0,
+)
+class NotificacoesAsgiTests(TransactionTestCase):
+    def setUp(self):
+        caches['notificacoes'].clear()
+        self.correntista = criar_correntista('rui')
+        self.token = Token.objects.create(user=self.correntista.user)
+
+    def test_operacoes_pelo_asgi_entregam_sequencia_consecutiva(self):
+        from api.asgi import application
+
+        async def cenario():
+            communicator = WebsocketCommunicator(application, f"/ws/notifications/?token={self.token.key}")
+            conectado, _ = await communicator.connect()
+            self.assertTrue(conectado)
+            boas_vindas = await communicator.receive_json_from()
+            for valor in ('10.00', '20.00', '30.00'):
+                response = await AsyncClient().post(
+                    '/api/depositar/', {'valor': valor}, content_type='application/json',
+                    headers={'Authorization': f'Token {self.token.key}'},
+                )
+                self.assertEqual(response.status_code, 200)
+            frames = []
+            while not await communicator.receive_nothing(0.5):
+                frames.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+            return boas_vindas, frames
+
+        with mock.patch('core.notificacoes.despachante', DespachanteNotificacoes()):
+            with self.assertNoLogs('core', level='WARNING'):
+                # Um event loop próprio, como o do bench_api: as views
+                # síncronas rodam no executor de thread única do asgiref
+                boas_vindas, frames = asyncio.run(cenario())
+
+        recebidas = [n for frame in frames for n in (frame if isinstance(frame, list) else [frame])]
+        self.assertEqual([n.get('seq') for n in recebidas], [boas_vindas['seq'] + i for i in (1, 2, 3)])
+
+
+@override_settings(CACHES={**settings.CACHES, 'tokens': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tokens-testes',
+}})
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        caches['tokens'].clear()
+        self.correntista = criar_correntista('diego')
+        self.token = Token.objects.create(user=self.correntista.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_token_em_cache_dispensa_consultas_de_autenticacao(self):
+        self.assertEqual(self.client.get('/api/saldo/').status_code, 200)
+
+        # Token e saldo em cache: nenhuma consulta
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/saldo/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_cache_guarda_so_o_id_e_o_is_active(self):
+        self.assertEqual(self.client.get('/api/saldo/').status_code, 200)
+        self.assertEqual(
+            caches['tokens'].get(chave_cache_token(self.token.key)),
+            (self.correntista.user_id, True),
+        )
+
+        # Os demais campos do usuário vêm do banco quando usados
+        user = obter_token(self.token.key).user
+        with self.assertNumQueries(1):
+            self.assertEqual(user.username, 'diego')
+
+    def test_leitura_anterior_a_invalidacao_nao_volta_para_o_cache(self):
+        antigo = Token.objects.select_related('user').get(key=self.token.key)
+        user = self.correntista.user
+        user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+
+        # Uma requisição que leu o token antes do commit termina depois da invalidação
+        with mock.patch('core.authentication.Token.objects.select_related') as select_related:
+            select_related.return_value.get.return_value = antigo
+            obter_token(self.token.key)
+        self.assertEqual(self.client.get('/api/saldo/').status_code, 401)
+
+    def test_token_removido_e_invalidado(self):
+        self.assertEqual(self.client.get('/api/saldo/').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        self.assertEqual(self.client.get('/api/saldo/').status_code, 401)
+
+    def test_usuario_desativado_e_invalidado_apos_o_commit(self):
+        self.assertEqual(self.client.get('/api/saldo/').status_code, 200)
+        user = self.correntista.user
+        user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+            # Antes do commit, o cache ainda vale
+            self.assertIsNotNone(caches['tokens'].get(chave_cache_token(self.token.key)))
+
+        self.assertEqual(self.client.get('/api/saldo/').status_code, 401)
+        usuario_ws = async_to_sync(get_user_from_token)(self.token.key)
+        self.assertFalse(usuario_ws.is_authenticated)
+
+    def test_websocket_compartilha_o_cache(self):
+        async_to_sync(get_user_from_token)(self.token.key)
+        with self.assertNumQueries(0):
+            usuario_ws = async_to_sync(get_user_from_token)(self.token.key)
+        self.assertEqual(usuario_ws.pk, self.correntista.user_id)
+
+
+class TransferenciaTests(TestCase):
+    def setUp(self):
+        self.origem = criar_correntista('eva', saldo='100.00')
+        self.destino = criar_correntista('fabio', saldo='50.00')
+        self.client = APIClient()
+        self.client.force_authenticate(self.origem.user)
+
+    def transferir(self, destino_id, valor):
+        return self.client.post('/api/transferir/', {'correntista_destino_id': destino_id, 'valor': valor})
+
+    def test_transfere_e_registra_as_duas_pernas(self):
+        response = self.transferir(self.destino.pk, '30.00')
+
+        self.assertEqual(response.status_code, 200)
+        self.origem.refresh_from_db()
+        self.destino.refresh_from_db()
+        self.assertEqual(self.origem.saldo, Decimal('70.00'))
+        self.assertEqual(self.destino.saldo, Decimal('80.00'))
+        self.assertEqual(
+            sorted(Movimentacao.objects.values_list('correntista_id', 'tipo_operacao')),
+            sorted([(self.origem.pk, 'D'), (self.destino.pk, 'C')]),
+        )
+
+    def test_erros_de_regra_de_negocio(self):
+        self.assertEqual(self.transferir(self.destino.pk, '300.00').status_code, 400)
+        self.assertEqual(self.transferir(self.origem.pk, '1.00').status_code, 400)
+        self.assertEqual(self.transferir(999999, '1.00').status_code, 404)
+        self.assertFalse(Movimentacao.objects.exists())
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "Requer Postgres para os locks de linha")
+class TransferenciaConcorrenteTests(TransactionTestCase):
+    threads = 8
+    transferencias_por_thread = 25
+
+    def test_transferencias_opostas_nao_travam_e_conservam_o_saldo(self):
+        conta_a = criar_correntista('gabi', saldo='1000.00')
+        conta_b = criar_correntista('hugo', saldo='1000.00')
+        erros = []
+
+        def trabalhador(indice):
+            # Metade das threads transfere de A para B, a outra metade de B para A
+            origem, destino = (conta_a, conta_b) if indice % 2 else (conta_b, conta_a)
+            try:
+                for _ in range(self.transferencias_por_thread):
+                    with transaction.atomic():
+                        transferir(origem.user, destino.pk, Decimal('1.00'))
+            except Exception as erro:
+                erros.append(erro)
+            finally:
+                connection.close()
+
+        trabalhadores = [threading.Thread(target=trabalhador, args=(i,)) for i in range(self.threads)]
+        for thread in trabalhadores:
+            thread.start()
+        for thread in trabalhadores:
+            thread.join()
+
+        self.assertEqual(erros, [])
+        conta_a.refresh_from_db()
+        conta_b.refresh_from_db()
+        self.assertEqual(conta_a.saldo + conta_b.saldo, Decimal('2000.00'))
+        self.assertEqual(conta_a.saldo, Decimal('1000.00'))
+        self.assertEqual(
+            Movimentacao.objects.count(),
+            2 * self.threads * self.transferencias_por_thread,
+        )
+
+
+class LoteTests(TestCase):
+    def setUp(self):
+        self.origem = criar_correntista('iris', saldo='100.00')
+        self.destino = criar_correntista('joel', saldo='0.00')
+        self.client = APIClient()
+        self.client.force_authenticate(self.origem.user)
+
+    def enviar_lote(self, operacoes, modo='tudo_ou_nada'):
+        return self.client.post('/api/lote/', {'modo': modo, 'operacoes': operacoes}, format='json')
+
+    def test_lote_aplica_todas_as_operacoes(self):
+        response = self.enviar_lote([
+            {'tipo': 'deposito', 'valor': '50.00'},
+            {'tipo': 'pagamento', 'valor': '20.00', 'descricao': 'Luz'},
+            {'tipo': 'transferencia', 'valor': '30.00', 'correntista_destino_id': self.destino.pk},
+            {'tipo': 'saque', 'valor': '10.00'},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['aplicadas'], 4)
+        self.origem.refresh_from_db()
+        self.destino.refresh_from_db()
+        self.assertEqual(self.origem.saldo, Decimal('90.00'))
+        self.assertEqual(self.destino.saldo, Decimal('30.00'))
+        self.assertEqual(Movimentacao.objects.count(), 5)
+
+    def test_tudo_ou_nada_nao_grava_nada_se_uma_operacao_falhar(self):
+        response = self.enviar_lote([
+            {'tipo': 'pagamento', 'valor': '60.00', 'descricao': 'Aluguel'},
+            {'tipo': 'saque', 'valor': '60.00'},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([r['status'] for r in response.data['resultados']], [200, 400])
+        self.origem.refresh_from_db()
+        self.assertEqual(self.origem.saldo, Decimal('100.00'))
+        self.assertFalse(Movimentacao.objects.exists())
+
+    def test_melhor_esforco_aplica_as_operacoes_validas(self):
+        response = self.enviar_lote([
+            {'tipo': 'pagamento', 'valor': '60.00', 'descricao': 'Aluguel'},
+            {'tipo': 'saque', 'valor': '60.00'},
+            {'tipo': 'estorno', 'valor': '1.00'},
+            {'tipo': 'transferencia', 'valor': '10.00', 'correntista_destino_id': 999999},
+            {'tipo': 'deposito', 'valor': '5.00'},
+        ], modo='melhor_esforco')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in response.data['resultados']], [200, 400, 400, 404, 200])
+        self.origem.refresh_from_db()
+        self.assertEqual(self.origem.saldo, Decimal('45.00'))
+
+    def test_consultas_nao_crescem_com_o_tamanho_do_lote(self):
+        operacoes = [
+            {'tipo': 'transferencia', 'valor': '0.50', 'correntista_destino_id': self.destino.pk}
+            for _ in range(100)
+        ]
+        # Savepoint do atomic, travar contas, bulk_update dos saldos,
+        # bulk_create das movimentações, resumos diários e liberação do savepoint
+        with self.assertNumQueries(6):
+            response = self.enviar_lote(operacoes)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Movimentacao.objects.count(), 200)
+
+
+class ResumoExtratoTests(TestCase):
+    def setUp(self):
+        self.conta = criar_correntista('nina', saldo='100.00')
+        self.outra = criar_correntista('otto', saldo='0.00')
+        self.client = APIClient()
+        self.client.force_authenticate(self.conta.user)
+
+    def test_operacoes_mantem_resumo_do_dia(self):
+        self.client.post('/api/depositar/', {'valor': '50.00'})
+        self.client.post('/api/sacar/', {'valor': '20.00'})
+        self.client.post('/api/transferir/', {'correntista_destino_id': self.outra.pk, 'valor': '5.00'})
+
+        response = self.client.get('/api/extrato/resumo/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['resultados'], [{
+            'inicio': str(timezone.localdate()),
+            'creditos': '50.00', 'debitos': '25.00',
+            'qtd_creditos': 1, 'qtd_debitos': 2,
+            'saldo_final': '125.00',
+        }])
+        resumo_destino = ResumoDiario.objects.get(correntista=self.outra)
+        self.assertEqual((resumo_destino.creditos, resumo_destino.qtd_creditos), (Decimal('5.00'), 1))
+
+    def test_saldo_final_por_mes_e_intervalo(self):
+        hoje = timezone.localdate()
+        inicio_mes = hoje.replace(day=1)
+        mes_passado = particoes.mes_anterior(inicio_mes)
+        self.client.post('/api/depositar/', {'valor': '40.00'})
+        self.client.post('/api/sacar/', {'valor': '10.00'})
+        # O depósito passa para o mês passado, e os resumos são recalculados do razão
+        Movimentacao.objects.filter(tipo_operacao='C').update(
+            data_operacao=timezone.make_aware(datetime.combine(mes_passado, datetime.min.time()))
+        )
+        resumos.reconstruir([self.conta.pk])
+
+        response = self.client.get('/api/extrato/resumo/', {'periodo': 'mes'})
+        self.assertEqual(
+            [(r['inicio'], r['creditos'], r['debitos'], r['saldo_final']) for r in response.data['resultados']],
+            [(str(mes_passado), '40.00', '0.00', '140.00'), (str(inicio_mes), '0.00', '10.00', '130.00')],
+        )
+
+        # Só o mês passado: o saldo no fim dele desconta o que veio depois
+        response = self.client.get('/api/extrato/resumo/', {'periodo': 'mes', 'data_fim': str(inicio_mes - timedelta(days=1))})
+        self.assertEqual([r['saldo_final'] for r in response.data['resultados']], ['140.00'])
+
+    def test_consulta_unica_sem_ler_movimentacoes(self):
+        for _ in range(3):
+            self.client.post('/api/depositar/', {'valor': '1.00'})
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get('/api/extrato/resumo/', {'periodo': 'semana'})
+        sql = [consulta['sql'] for consulta in consultas if 'core_resumodiario' in consulta['sql']]
+        self.assertEqual(len(sql), 1)
+        self.assertNotIn('core_movimentacao', sql[0])
+
+    def test_periodo_invalido(self):
+        response = self.client.get('/api/extrato/resumo/', {'periodo': 'ano'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(OPERACOES_MODO='diario')
+class DiarioTests(TestCase):
+    def setUp(self):
+        self.conta = criar_correntista('paula', saldo='100.00')
+        self.outra = criar_correntista('quim', saldo='0.00')
+        self.client = APIClient()
+        self.client.force_authenticate(self.conta.user)
+
+    def test_operacoes_so_lancam_no_diario(self):
+        self.client.post('/api/depositar/', {'valor': '50.00'})
+        self.client.post('/api/sacar/', {'valor': '30.00'})
+        response = self.client.post('/api/transferir/', {'correntista_destino_id': self.outra.pk, 'valor': '20.00'})
+        self.assertEqual(response.status_code, 200)
+
+        self.conta.refresh_from_db()
+        self.assertEqual(self.conta.saldo, Decimal('100.00'))
+        self.assertFalse(Movimentacao.objects.exists())
+        self.assertEqual(Lancamento.objects.count(), 4)
+        # O saldo já considera os lançamentos pendentes
+        self.assertEqual(self.client.get('/api/saldo/').data['saldo'], '100.00')
+
+    def test_debito_conferido_contra_pendentes(self):
+        self.client.post('/api/sacar/', {'valor': '80.00'})
+        response = self.client.post('/api/sacar/', {'valor': '30.00'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/lote/', {'modo': 'melhor_esforco', 'operacoes': [
+            {'tipo': 'saque', 'valor': '15.00'},
+            {'tipo': 'saque', 'valor': '15.00'},
+        ]}, format='json')
+        self.assertEqual([r['status'] for r in response.data['resultados']], [200, 400])
+        self.assertEqual(diario.disponivel(self.conta), Decimal('5.00'))
+
+    def test_projetor_aplica_saldos_extrato_e_resumos(self):
+        self.client.post('/api/depositar/', {'valor': '50.00'})
+        self.client.post('/api/transferir/', {'correntista_destino_id': self.outra.pk, 'valor': '20.00'})
+        data = Lancamento.objects.order_by('id').first().data_operacao
+
+        self.assertEqual(diario.projetar(limite=2), 2)
+        self.assertEqual(diario.pendentes(), 1)
+        call_command('projetar_diario', stdout=io.StringIO())
+        self.assertEqual(diario.pendentes(), 0)
+
+        self.conta.refresh_from_db()
+        self.outra.refresh_from_db()
+        self.assertEqual((self.conta.saldo, self.outra.saldo), (Decimal('130.00'), Decimal('20.00')))
+        self.assertEqual(Movimentacao.objects.count(), 3)
+        self.assertEqual(Movimentacao.objects.order_by('id').first().data_operacao, data)
+        resumo = ResumoDiario.objects.get(correntista=self.conta)
+        self.assertEqual((resumo.creditos, resumo.debitos), (Decimal('50.00'), Decimal('20.00')))
+        self.assertEqual(self.client.get('/api/saldo/').data['saldo'], '130.00')
+        self.assertEqual(diario.projetar(), 0)
+
+
+@override_settings(OPERACOES_MODO='otimista')
+class OperacaoOtimistaTests(TestCase):
+    def setUp(self):
+        self.conta = criar_correntista('rui', saldo='100.00')
+        self.client = APIClient()
+        self.client.force_authenticate(self.conta.user)
+
+    def test_uma_instrucao_sem_select_for_update(self):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.post('/api/sacar/', {'valor': '30.00'})
+        self.assertEqual(response.status_code, 200)
+        sql = [consulta['sql'] for consulta in consultas]
+        self.assertFalse(any('FOR NO KEY UPDATE' in comando for comando in sql))
+        self.assertEqual(len([comando for comando in sql if 'core_correntista' in comando]), 1)
+
+        self.client.post('/api/depositar/', {'valor': '5.00'})
+        self.client.post('/api/pagar/', {'valor': '10.00', 'descricao': 'Luz'})
+        self.conta.refresh_from_db()
+        self.assertEqual(self.conta.saldo, Decimal('65.00'))
+        self.assertEqual(self.client.get('/api/saldo/').data['saldo'], '65.00')
+        self.assertEqual(
+            list(Movimentacao.objects.order_by('id').values_list('tipo_operacao', 'valor_operacao', 'descricao')),
+            [('D', Decimal('30.00'), 'Saque realizado'), ('C', Decimal('5.00'), 'Depósito realizado'),
+             ('D', Decimal('10.00'), 'Pagamento: Luz')],
+        )
+        resumo = ResumoDiario.objects.get(correntista=self.conta)
+        self.assertEqual((resumo.creditos, resumo.debitos, resumo.qtd_debitos), (Decimal('5.00'), Decimal('40.00'), 2))
+
+    def test_sem_saldo_recusa_sem_gravar(self):
+        response = self.client.post('/api/sacar/', {'valor': '100.01'})
+        self.assertEqual(response.status_code, 400)
+        self.conta.refresh_from_db()
+        self.assertEqual(self.conta.saldo, Decimal('100.00'))
+        self.assertFalse(Movimentacao.objects.exists())
+
+    def test_conta_fatiada_segue_pelo_caminho_com_lock(self):
+        call_command('fatiar_saldo', self.conta.pk, fatias=2, stdout=io.StringIO())
+        self.client.post('/api/depositar/', {'valor': '50.00'})
+        self.assertEqual(self.client.post('/api/sacar/', {'valor': '120.00'}).status_code, 200)
+        self.conta.refresh_from_db()
+        self.assertEqual(self.conta.saldo_total, Decimal('30.00'))
+
+
+class ConciliacaoTests(TestCase):
+    def setUp(self):
+        self.conta = criar_correntista('karen', saldo='100.00')
+        self.outra = criar_correntista('lucas', saldo='10.00')
+        self.client = APIClient()
+        self.client.force_authenticate(self.conta.user)
+        self.client.post('/api/depositar/', {'valor': '50.00'})
+        self.client.post('/api/transferir/', {'correntista_destino_id': self.outra.pk, 'valor': '30.00'})
+
+    def conciliar(self, **opcoes):
+        call_command('conciliar_saldos', processos=1, margem=0, stdout=io.StringIO(), **opcoes)
+
+    def test_registra_checkpoint_na_ultima_movimentacao(self):
+        self.conciliar(registrar=True)
+
+        checkpoint = SaldoCheckpoint.objects.filter(correntista=self.conta).latest('movimentacao_id')
+        ultima = Movimentacao.objects.filter(correntista=self.conta).latest('id')
+        self.assertEqual(checkpoint.movimentacao_id, ultima.pk)
+        self.assertEqual(checkpoint.saldo, Decimal('120.00'))
+
+        # A conciliação seguinte parte do checkpoint e continua consistente
+        self.client.post('/api/sacar/', {'valor': '20.00'})
+        self.conciliar()
+
+    def test_relata_divergencia(self):
+        Correntista.objects.filter(pk=self.outra.pk).update(saldo=Decimal('999.00'))
+
+        with self.assertRaisesMessage(CommandError, "1 conta(s) com divergência."):
+            self.conciliar(registrar=True)
+        self.assertFalse(SaldoCheckpoint.objects.filter(correntista=self.outra, movimentacao_id__gt=0).exists())
+
+
+class FatiasTests(TestCase):
+    def setUp(self):
+        self.conta = criar_correntista('olga', saldo='100.00')
+        self.outra = criar_correntista('paulo', saldo='500.00')
+        call_command('fatiar_saldo', self.conta.pk, fatias=4, stdout=io.StringIO())
+        self.client = APIClient()
+
+    def saldo(self):
+        # Usuário relido: o de self.conta guarda o correntista da criação
+        self.client.force_authenticate(User.objects.get(pk=self.conta.user_id))
+        return Decimal(self.client.get('/api/saldo/').data['saldo'])
+
+    def test_creditos_vao_para_os_subsaldos_e_o_saldo_e_a_soma(self):
+        self.client.force_authenticate(self.outra.user)
+        for _ in range(3):
+            self.client.post('/api/transferir/', {'correntista_destino_id': self.conta.pk, 'valor': '10.00'})
+        self.client.force_authenticate(self.conta.user)
+        self.client.post('/api/depositar/', {'valor': '5.00'})
+
+        self.conta.refresh_from_db()
+        self.assertEqual(self.conta.saldo, Decimal('100.00'))
+        self.assertEqual(sum(self.conta.subsaldos.values_list('saldo', flat=True)), Decimal('35.00'))
+        self.assertEqual(self.saldo(), Decimal('135.00'))
+
+    def test_debito_maior_que_a_linha_da_conta_usa_os_subsaldos(self):
+        self.client.force_authenticate(self.outra.user)
+        self.client.post('/api/transferir/', {'correntista_destino_id': self.conta.pk, 'valor': '50.00'})
+        self.client.force_authenticate(self.conta.user)
+
+        self.assertEqual(self.client.post('/api/sacar/', {'valor': '200.00'}).status_code, 400)
+        self.assertEqual(self.client.post('/api/sacar/', {'valor': '120.00'}).status_code, 200)
+        self.assertEqual(self.saldo(), Decimal('30.00'))
+        self.conta.refresh_from_db()
+        self.assertGreaterEqual(self.conta.saldo, 0)
+
+    def test_lote_recusado_nao_perde_os_subsaldos(self):
+        self.client.force_authenticate(self.outra.user)
+        self.client.post('/api/transferir/', {'correntista_destino_id': self.conta.pk, 'valor': '300.00'})
+        self.client.force_authenticate(self.conta.user)
+
+        for modo in ('tudo_ou_nada', 'melhor_esforco'):
+            with self.subTest(modo=modo):
+                response = self.client.post('/api/lote/', {
+                    'modo': modo, 'operacoes': [{'tipo': 'saque', 'valor': '1000.00'}],
+                }, format='json')
+                self.assertEqual(response.status_code, 400 if modo == 'tudo_ou_nada' else 200)
+                self.assertEqual(self.saldo(), Decimal('400.00'))
+                self.conta.refresh_from_db()
+                self.assertEqual(self.conta.saldo_total, Decimal('400.00'))
+
+    def test_desfazer_consolida_e_concilia(self):
+        self.client.force_authenticate(self.outra.user)
+        self.client.post('/api/transferir/', {'correntista_destino_id': self.conta.pk, 'valor': '25.00'})
+        call_command('conciliar_saldos', processos=1, margem=0, stdout=io.StringIO())
+
+        call_command('fatiar_saldo', self.conta.pk, desfazer=True, stdout=io.StringIO())
+
+        self.conta.refresh_from_db()
+        self.assertEqual((self.conta.fatias, self.conta.saldo), (0, Decimal('125.00')))
+        self.assertFalse(self.conta.subsaldos.exists())
+        call_command('conciliar_saldos', processos=1, margem=0, stdout=io.StringIO())
+
+    def test_quantidade_de_fatias_invalida(self):
+        with self.assertRaises(CommandError):
+            call_command('fatiar_saldo', self.conta.pk, fatias=0, stdout=io.StringIO())
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "Requer Postgres para os locks de linha")
+class FatiasConcorrenteTests(TransactionTestCase):
+    def test_credito_em_conta_fatiada_nao_espera_o_lock_da_conta(self):
+        conta = criar_correntista('quel', saldo='100.00')
+        origem = criar_correntista('rui', saldo='100.00')
+        call_command('fatiar_saldo', conta.pk, fatias=2, stdout=io.StringIO())
+        travada = threading.Event()
+        liberar = threading.Event()
+
+        def segurar_lock():
+            try:
+                with transaction.atomic():
+                    # O mesmo lock dos débitos da conta
+                    Correntista.objects.select_for_update(no_key=True).get(pk=conta.pk)
+                    travada.set()
+                    liberar.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=segurar_lock)
+        thread.start()
+        try:
+            travada.wait(10)
+            with transaction.atomic():
+                # Sem o fatiamento esta transação esperaria pelo lock até o timeout
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL lock_timeout = '2s'")
+                transferir(origem.user, conta.pk, Decimal('10.00'))
+        finally:
+            liberar.set()
+            thread.join()
+
+        conta.refresh_from_db()
+        self.assertEqual(conta.saldo_total, Decimal('110.00'))
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "Requer Postgres para os advisory locks")
+class ProjecaoConciliacaoTests(TransactionTestCase):
+    def test_checkpoint_nao_passa_de_projecao_em_andamento(self):
+        conta = criar_correntista('vera', saldo='100.00')
+        Lancamento.objects.create(tipo_operacao='C', correntista=conta, valor_operacao=Decimal('10.00'),
+                                  descricao="Depósito realizado")
+        projetado = threading.Event()
+        liberar = threading.Event()
+
+        def projetar_sem_commit():
+            try:
+                with transaction.atomic():
+                    diario.projetar()
+                    projetado.set()
+                    liberar.wait(10)
+            finally:
+                connection.close()
+
+        def conciliar():
+            try:
+                call_command('conciliar_saldos', processos=1, margem=0, registrar=True, stdout=io.StringIO())
+            finally:
+                connection.close()
+
+        projetor = threading.Thread(target=projetar_sem_commit)
+        projetor.start()
+        try:
+            projetado.wait(10)
+            # Movimentações já confirmadas, com ids maiores que o da projetada
+            for tipo in 'CD':
+                Movimentacao.objects.create(tipo_operacao=tipo, correntista=conta, valor_operacao=Decimal('5.00'),
+                                            descricao="Ajuste")
+            conciliador = threading.Thread(target=conciliar)
+            conciliador.start()
+            time.sleep(0.3)
+        finally:
+            liberar.set()
+            projetor.join()
+        conciliador.join()
+
+        # O checkpoint gravado durante a projeção cobre a movimentação projetada
+        call_command('conciliar_saldos', processos=1, margem=0, stdout=io.StringIO())
+
+
+class CacheSaldoTests(TestCase):
+    def setUp(self):
+        caches['saldos'].clear()
+        self.conta = criar_correntista('sara', saldo='100.00')
+        self.outra = criar_correntista('tiago', saldo='100.00')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.get(pk=self.conta.user_id))
+
+    def depositar(self, valor):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/depositar/', {'valor': valor})
+
+    def test_segunda_leitura_vem_do_cache(self):
+        serie = 'saldo_cache_total{resultado="hit"}'
+        hits = valor_metrica(metricas.exportar(), serie)
+        self.assertEqual(self.client.get('/api/saldo/').data['saldo'], '100.00')
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/saldo/')
+        self.assertEqual(response.data['saldo'], '100.00')
+        self.assertEqual(valor_metrica(metricas.exportar(), serie), hits + 1)
+
+    def test_operacao_grava_o_saldo_novo_apos_o_commit(self):
+        self.client.get('/api/saldo/')
+        self.depositar('10.00')
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/saldo/')
+        self.assertEqual(response.data['saldo'], '110.00')
+
+    def test_gravacoes_fora_de_ordem_nao_voltam_o_saldo(self):
+        with self.captureOnCommitCallbacks() as primeira:
+            self.client.post('/api/depositar/', {'valor': '10.00'})
+        with self.captureOnCommitCallbacks() as segunda:
+            self.client.post('/api/depositar/', {'valor': '20.00'})
+        for callback in segunda + primeira:
+            callback()
+
+        self.assertEqual(self.client.get('/api/saldo/').data['saldo'], '130.00')
+
+    def test_credito_em_conta_fatiada_invalida_o_saldo(self):
+        call_command('fatiar_saldo', self.outra.pk, fatias=2, stdout=io.StringIO())
+        cliente_outra = APIClient()
+        cliente_outra.force_authenticate(User.objects.get(pk=self.outra.user_id))
+        self.assertEqual(cliente_outra.get('/api/saldo/').data['saldo'], '100.00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/transferir/', {'correntista_destino_id': self.outra.pk, 'valor': '15.00'})
+
+        self.assertEqual(cliente_outra.get('/api/saldo/').data['saldo'], '115.00')
+        self.assertEqual(self.client.get('/api/saldo/').data['saldo'], '85.00')
+
+    def test_etag_devolve_304_sem_consultas(self):
+        etag = self.client.get('/api/saldo/')['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/saldo/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.content)
+
+        self.depositar('1.00')
+        response = self.client.get('/api/saldo/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class IdempotenciaTests(TestCase):
+    def setUp(self):
+        self.conta = criar_correntista('mara', saldo='100.00')
+        self.client = APIClient()
+        self.client.force_authenticate(self.conta.user)
+
+    def sacar(self, valor, chave='saque-1'):
+        return self.client.post('/api/sacar/', {'valor': valor}, format='json', HTTP_IDEMPOTENCY_KEY=chave)
+
+    def test_repeticao_devolve_a_mesma_resposta_sem_nova_operacao(self):
+        primeira = self.sacar('40.00')
+        # Uma única leitura da chave, sem travar a conta
+        with self.assertNumQueries(1):
+            repetida = self.sacar('40.00')
+
+        self.assertEqual(repetida.status_code, primeira.status_code)
+        self.assertEqual(repetida.data, primeira.data)
+        self.assertEqual(repetida['Idempotent-Replayed'], 'true')
+        self.conta.refresh_from_db()
+        self.assertEqual(self.conta.saldo, Decimal('60.00'))
+        self.assertEqual(Movimentacao.objects.count(), 1)
+
+    def test_recusa_guardada_tambem_e_repetida(self):
+        self.assertEqual(self.sacar('500.00').status_code, 400)
+        Correntista.objects.filter(pk=self.conta.pk).update(saldo=Decimal('1000.00'))
+
+        response = self.sacar('500.00')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"erro": "Saldo insuficiente."})
+
+    def test_chave_reutilizada_com_outro_corpo(self):
+        self.sacar('10.00')
+        response = self.sacar('20.00')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Movimentacao.objects.count(), 1)
+
+    def test_chave_expirada_e_removida_e_pode_ser_reusada(self):
+        self.sacar('10.00')
+        ChaveIdempotencia.objects.update(criado_em=timezone.now() - timedelta(days=2))
+
+        response = self.sacar('10.00')
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Movimentacao.objects.count(), 2)
+
+        ChaveIdempotencia.objects.update(criado_em=timezone.now() - timedelta(days=2))
+        call_command('limpar_idempotencia', stdout=io.StringIO())
+        self.assertFalse(ChaveIdempotencia.objects.exists())
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "Requer Postgres para o índice único concorrente")
+class IdempotenciaConcorrenteTests(TransactionTestCase):
+    threads = 6
+
+    def test_mesma_chave_em_paralelo_executa_uma_vez(self):
+        conta = criar_correntista('nina', saldo='100.00')
+        token = Token.objects.create(user=conta.user)
+        respostas = []
+
+        def trabalhador():
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+            try:
+                respostas.append(client.post(
+                    '/api/sacar/', {'valor': '10.00'}, format='json', HTTP_IDEMPOTENCY_KEY='paralela'
+                ))
+            finally:
+                connection.close()
+
+        trabalhadores = [threading.Thread(target=trabalhador) for _ in range(self.threads)]
+        for thread in trabalhadores:
+            thread.start()
+        for thread in trabalhadores:
+            thread.join()
+
+        self.assertEqual([r.status_code for r in respostas], [200] * self.threads)
+        self.assertEqual(sum(1 for r in respostas if 'Idempotent-Replayed' in r), self.threads - 1)
+        conta.refresh_from_db()
+        self.assertEqual(conta.saldo, Decimal('90.00'))
+        self.assertEqual(Movimentacao.objects.count(), 1)
+
+
+class BenchApiTests(TransactionTestCase):
+    def test_bench_api_grava_resultado_e_mantem_saldos_conciliados(self):
+        with tempfile.TemporaryDirectory() as pasta:
+            caminho = os.path.join(pasta, 'bench.json')
+            call_command(
+                'bench_api', contas=4, movimentacoes=40, requisicoes=6, concorrencia=2,
+                ws_mensagens=3, saida=caminho, stdout=io.StringIO(),
+            )
+            with open(caminho, encoding='utf-8') as arquivo:
+                resultado = json.load(arquivo)
+
+        self.assertEqual(set(resultado['endpoints']), {'extrato', 'saldo', 'resumo', 'pagamento', 'transferencia', 'saque', 'deposito'})
+        for endpoint, dados in resultado['endpoints'].items():
+            self.assertEqual(dados['requisicoes'], 6, endpoint)
+            self.assertEqual(dados['erros'], 0, endpoint)
+            self.assertIsNotNone(dados['latencia']['p99_ms'])
+        self.assertGreater(resultado['endpoints']['saque']['consultas_por_requisicao']['media'], 0)
+        self.assertEqual(resultado['websocket']['perdidas'], 0)
+
+        call_command('conciliar_saldos', processos=1, margem=0, stdout=io.StringIO())
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'saque': '2/min'}},
+                       OPERACOES_SIMULTANEAS_MAX=1)
+    def test_bench_api_mede_sem_os_limites_das_operacoes(self):
+        limites.baldes().limpar()
+        with tempfile.TemporaryDirectory() as pasta:
+            caminho = os.path.join(pasta, 'bench.json')
+            call_command(
+                'bench_api', contas=2, movimentacoes=0, requisicoes=6, concorrencia=2, contas_ativas=1,
+                endpoints='saque', ws_mensagens=0, saida=caminho, stdout=io.StringIO(),
+            )
+            with open(caminho, encoding='utf-8') as arquivo:
+                resultado = json.load(arquivo)
+        self.assertEqual(resultado['endpoints']['saque']['erros'], 0)
+
+
+class SeedBankTests(TransactionTestCase):
+    def semear(self, **opcoes):
+        call_command('seed_bank', contas=30, movimentacoes=601, lote=100, dias=3, stdout=io.StringIO(), **opcoes)
+        contas = {
+            pk: indice
+            for indice, pk in enumerate(
+                Correntista.objects.filter(user__username__startswith=semeadura.PREFIXO)
+                .order_by('user__username').values_list('pk', flat=True)
+            )
+        }
+        razao = [
+            (tipo, contas[conta], valor, descricao)
+            for tipo, conta, valor, descricao in Movimentacao.objects.order_by('id')
+            .values_list('tipo_operacao', 'correntista_id', 'valor_operacao', 'descricao')
+        ]
+        saldos = list(
+            Correntista.objects.filter(pk__in=contas).order_by('user__username').values_list('saldo', flat=True)
+        )
+        return razao, saldos
+
+    def test_semeia_razao_deterministico_e_conciliado(self):
+        razao, saldos = self.semear(processos=1)
+        self.assertEqual(len(razao), 601)
+        self.assertTrue(all(saldo >= 0 for saldo in saldos))
+        self.assertEqual(Movimentacao.objects.filter(tipo_operacao='D', correntista_beneficiario__isnull=False).count(),
+                         Movimentacao.objects.filter(tipo_operacao='C', correntista_beneficiario__isnull=False).count())
+        # A conta quente (a primeira) concentra as operações
+        por_conta = Counter(conta for _, conta, _, _ in razao)
+        self.assertEqual(por_conta.most_common(1)[0][0], 0)
+        call_command('conciliar_saldos', processos=1, margem=0, stdout=io.StringIO())
+        self.assertEqual(
+            sum(ResumoDiario.objects.values_list('qtd_creditos', flat=True))
+            + sum(ResumoDiario.objects.values_list('qtd_debitos', flat=True)),
+            601,
+        )
+
+        with self.assertRaises(CommandError):
+            self.semear(processos=1)
+        # Mesma semente, outro número de processos: mesmos dados
+        self.assertEqual(self.semear(processos=2, recriar=True), (razao, saldos))
+        self.assertEqual(User.objects.filter(username__startswith=semeadura.PREFIXO).count(), 30)
+
+
+def valor_metrica(texto, serie):
+    """
+    Valor de uma série (nome com labels) no texto do Prometheus, 0 se ausente.
+    """
+    for linha in texto.splitlines():
+        if linha.startswith(serie + ' '):
+            return float(linha.rsplit(' ', 1)[1])
+    return 0.0
+
+
+@override_settings(REPLICAS_LEITURA=['replica1'], SALDO_CACHE_ATIVO=False)
+class ReplicasTests(TransactionTestCase):
+    # 'replica1' espelha o banco de testes por outra conexão (TEST MIRROR)
+    databases = {'default', 'replica1'}
+
+    @classmethod
+    def tearDownClass(cls):
+        # O pool da réplica mantém conexões ao banco de testes, que é apagado no fim
+        replica = connections['replica1']
+        replica.close()
+        if getattr(replica, 'pool', None) is not None:
+            replica.close_pool()
+        super().tearDownClass()
+
+    def setUp(self):
+        caches['default'].clear()
+        replicas._atrasos.clear()
+        self.conta = criar_correntista('rui', saldo='100.00')
+        self.outra = criar_correntista('sol', saldo='100.00')
+        # Por token, que vale também para as views assíncronas
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.conta.user).key}')
+
+    def consultas(self, url):
+        """
+        Consultas às tabelas das contas no primário e na réplica (a
+        autenticação, feita antes da escolha, fica sempre no primário).
+        """
+        with CaptureQueriesContext(connection) as primario, \
+                CaptureQueriesContext(connections['replica1']) as replica:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return (
+            sum('core_' in consulta['sql'] for consulta in primario),
+            sum('core_' in consulta['sql'] for consulta in replica),
+        )
+
+    def test_leituras_vao_para_a_replica(self):
+        for url in ('/api/extrato/', '/api/saldo/', '/api/extrato/resumo/', '/api/async/extrato/',
+                    '/api/async/saldo/'):
+            with self.subTest(url=url):
+                primario, replica = self.consultas(url)
+                self.assertEqual(primario, 0)
+                self.assertGreater(replica, 0)
+
+        with CaptureQueriesContext(connections['replica1']) as replica:
+            response = self.client.get('/api/extrato/export/')
+            b''.join(response.streaming_content)
+        self.assertGreater(len(replica), 0)
+
+    def test_quem_escreveu_le_do_primario_durante_a_janela(self):
+        response = self.client.post('/api/transferir/', {'correntista_destino_id': self.outra.pk, 'valor': '10.00'})
+        self.assertEqual(response.status_code, 200)
+
+        primario, replica = self.consultas('/api/extrato/')
+        self.assertEqual(replica, 0)
+        self.assertGreater(primario, 0)
+        # O destino da transferência também
+        self.assertTrue(caches['default'].get(replicas.chave_primario(self.outra.user_id)))
+
+        caches['default'].delete(replicas.chave_primario(self.conta.user_id))
+        primario, replica = self.consultas('/api/extrato/')
+        self.assertEqual(primario, 0)
+        self.assertGreater(replica, 0)
+
+    def test_replica_atrasada_fica_de_fora(self):
+        self.assertEqual(replicas.medir_atraso('replica1'), 0.0)
+        with mock.patch('core.replicas.medir_atraso', return_value=5.0):
+            primario, replica = self.consultas('/api/saldo/')
+        self.assertEqual(replica, 0)
+        self.assertGreater(primario, 0)
+        self.assertIn('db_replica_atraso_segundos{replica="replica1"} 0.0', metricas.exportar())
+
+    def test_escritas_e_migracoes_ficam_no_primario(self):
+        roteador = replicas.RoteadorReplicas()
+        token = replicas.replica_atual.set('replica1')
+        try:
+            self.assertEqual(roteador.db_for_read(Movimentacao), 'replica1')
+            self.assertEqual(roteador.db_for_write(Movimentacao), 'default')
+        finally:
+            replicas.replica_atual.reset(token)
+        self.assertIsNone(roteador.db_for_read(Movimentacao))
+        self.assertFalse(roteador.allow_migrate('replica1', 'core'))
+
+    def test_saude_mostra_o_atraso_das_replicas(self):
+        self.assertEqual(APIClient().get('/api/saude/').json()['replicas'], {'replica1': 0.0})
+
+
+@override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'saque': '2/min'}})
+class LimitesTests(TestCase):
+    def setUp(self):
+        limites.baldes().limpar()
+        self.conta = criar_correntista('vera', saldo='100.00')
+        self.token = Token.objects.create(user=self.conta.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def sacar(self, client=None, caminho='/api/sacar/'):
+        return (client or self.client).post(caminho, {'valor': '1.00'}, format='json')
+
+    def test_balde_repoe_as_fichas_com_o_tempo(self):
+        baldes = limites.BaldesMemoria()
+        with mock.patch('core.limites.time.monotonic', return_value=100.0):
+            self.assertEqual([baldes.consumir('x', 2, 0.5)[0] for _ in range(3)], [True, True, False])
+            self.assertEqual(baldes.consumir('x', 2, 0.5), (False, 2.0))
+        with mock.patch('core.limites.time.monotonic', return_value=102.0):
+            self.assertEqual(baldes.consumir('x', 2, 0.5), (True, 0))
+        self.assertEqual(limites.interpretar_taxa('30/min'), (30, 0.5))
+
+    def test_usuario_acima_do_limite_recebe_429(self):
+        self.assertEqual([self.sacar().status_code for _ in range(2)], [200, 200])
+
+        response = self.sacar()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(Movimentacao.objects.filter(correntista=self.conta).count(), 2)
+        # A versão assíncrona gasta do mesmo balde
+        self.assertEqual(self.sacar(caminho='/api/async/sacar/').status_code, 429)
+
+        # Outros endpoints e outros usuários não são afetados
+        self.assertEqual(self.client.post('/api/depositar/', {'valor': '1.00'}).status_code, 200)
+        outro = APIClient()
+        outro.force_authenticate(criar_correntista('wagner').user)
+        self.assertEqual(self.sacar(outro).status_code, 200)
+
+    def test_repeticao_da_idempotency_key_nao_gasta_fichas(self):
+        caminhos = {'sync': '/api/sacar/', 'async': '/api/async/sacar/'}
+        originais = {}
+        for chave, caminho in caminhos.items():
+            originais[chave] = self.client.post(caminho, {'valor': '1.00'}, format='json', HTTP_IDEMPOTENCY_KEY=chave)
+            self.assertEqual(originais[chave].status_code, 200)
+        # Balde vazio
+        self.assertEqual(self.sacar().status_code, 429)
+
+        for chave, caminho in caminhos.items():
+            response = self.client.post(caminho, {'valor': '1.00'}, format='json', HTTP_IDEMPOTENCY_KEY=chave)
+            self.assertEqual(response.status_code, 200, caminho)
+            self.assertEqual(response['Idempotent-Replayed'], 'true')
+            self.assertEqual(response.json(), originais[chave].json())
+        self.assertEqual(Movimentacao.objects.filter(correntista=self.conta).count(), 2)
+
+    @override_settings(OPERACOES_SIMULTANEAS_MAX=1)
+    def test_acima_das_operacoes_simultaneas_recebe_503(self):
+        with limites.admitir('transferencia'):
+            for caminho in ('/api/depositar/', '/api/async/depositar/'):
+                response = self.client.post(caminho, {'valor': '1.00'}, format='json')
+                self.assertEqual(response.status_code, 503, caminho)
+                self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(Movimentacao.objects.filter(correntista=self.conta).exists())
+
+        self.assertEqual(self.client.post('/api/depositar/', {'valor': '1.00'}).status_code, 200)
+        self.assertEqual(limites.admissao.em_andamento, 0)
+
+
+class SaudeTests(TestCase):
+    def test_banco_ok_com_situacao_do_pool(self):
+        response = APIClient().get('/api/saude/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['banco'], 'ok')
+        if connection.pool is not None:
+            self.assertLessEqual(response.json()['pool']['pool_size'], response.json()['pool']['pool_max'])
+
+    def test_banco_indisponivel_responde_503(self):
+        erro = OperationalError('connection to server at "db" (10.0.0.5), port 5432 failed: FATAL: role "admin"')
+        with mock.patch('core.saude.connection.cursor', side_effect=erro):
+            with self.assertLogs('core.saude', level='ERROR') as logs:
+                response = APIClient().get('/api/saude/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {'banco': 'erro'})
+        self.assertNotIn(b'10.0.0.5', response.content)
+        self.assertIn('10.0.0.5', logs.output[0])
+
+
+@mock.patch('channels.db.close_old_connections', lambda: None)
+@override_settings(METRICAS_AMOSTRAGEM=1.0, METRICAS_TOKEN='segredo')
+class MetricasTests(TestCase):
+    def setUp(self):
+        self.conta = criar_correntista('olga')
+        self.client = APIClient()
+        self.client.force_authenticate(self.conta.user)
+
+    def metricas(self):
+        response = self.client.get('/api/metricas/', HTTP_AUTHORIZATION='Bearer segredo')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_requisicao_amostrada_registra_banco_lock_e_serializacao(self):
+        antes = self.metricas()
+        self.client.post('/api/sacar/', {'valor': '5.00'}, format='json')
+        depois = self.metricas()
+
+        for serie in (
+            'api_requisicao_segundos_count{view="saque",metodo="POST",status="200"}',
+            'api_banco_consultas_count{view="saque"}',
+            'api_lock_espera_segundos_count{view="saque"}',
+            'api_serializacao_segundos_count{view="saque"}',
+        ):
+            self.assertEqual(valor_metrica(depois, serie) - valor_metrica(antes, serie), 1, serie)
+        # Savepoint do atomic, travar a conta, atualizar o saldo, gravar a
+        # movimentação, somá-la ao resumo do dia e liberação do savepoint
+        consultas = 'api_banco_consultas_sum{view="saque"}'
+        self.assertEqual(valor_metrica(depois, consultas) - valor_metrica(antes, consultas), 6)
+        self.assertGreater(valor_metrica(depois, 'api_lock_espera_segundos_sum{view="saque"}'), 0)
+
+    def test_scrape_exige_token_ou_staff(self):
+        self.assertEqual(self.client.get('/api/metricas/').status_code, 403)
+        self.assertEqual(self.client.get('/api/metricas/', HTTP_AUTHORIZATION='Bearer outro').status_code, 403)
+        self.assertEqual(self.client.get('/api/metricas/', HTTP_AUTHORIZATION='Bearer segredo').status_code, 200)
+
+        staff = User.objects.create_user(username='admin_metricas', password='123456', is_staff=True)
+        sessao = APIClient()
+        sessao.force_login(staff)
+        self.assertEqual(sessao.get('/api/metricas/').status_code, 200)
+
+    @override_settings(METRICAS_TOKEN='')
+    def test_scrape_negado_por_padrao(self):
+        self.assertEqual(self.client.get('/api/metricas/', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+        self.assertEqual(self.client.get('/api/metricas/').status_code, 403)
+
+    def test_websocket_conta_conexoes_e_mensagens(self):
+        from api.asgi import application
+
+        token = Token.objects.create(user=self.conta.user)
+        abertas = 'ws_conexoes_abertas{rota="notificacoes"}'
+        saida = 'ws_mensagens_total{rota="notificacoes",direcao="saida"}'
+        antes = self.metricas()
+
+        async def cenario():
+            communicator = WebsocketCommunicator(application, f"/ws/notifications/?token={token.key}")
+            conectado, _ = await communicator.connect()
+            self.assertTrue(conectado)
+            await communicator.receive_json_from()
+            durante = metricas.exportar()
+            await communicator.disconnect()
+            return durante
+
+        durante = async_to_sync(cenario)()
+        depois = self.metricas()
+
+        self.assertEqual(valor_metrica(durante, abertas) - valor_metrica(antes, abertas), 1)
+        self.assertEqual(valor_metrica(depois, abertas), valor_metrica(antes, abertas))
+        self.assertEqual(valor_metrica(depois, saida) - valor_metrica(antes, saida), 1)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'core.layers.CanalLocalLayer'}})
+class ViewsAsyncTests(TestCase):
+    def setUp(self):
+        caches['tokens'].clear()
+        self.conta = criar_correntista('paula', saldo='100.00')
+        self.outra = criar_correntista('rui', saldo='0.00')
+        self.token = Token.objects.create(user=self.conta.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.async_client = AsyncClient()
+
+    def aget(self, caminho):
+        return self.async_client.get(caminho, headers={'Authorization': f'Token {self.token.key}'})
+
+    def apost(self, caminho, dados, chave=None):
+        headers = {'Authorization': f'Token {self.token.key}'}
+        if chave:
+            headers['Idempotency-Key'] = chave
+        return self.async_client.post(caminho, dados, content_type='application/json', headers=headers)
+
+    async def test_saldo_e_extrato_iguais_aos_sincronos(self):
+        await self.apost('/api/async/depositar/', {'valor': '10.00'})
+        await self.apost('/api/async/transferir/', {'correntista_destino_id': self.outra.pk, 'valor': '30.00'})
+
+        for caminho in ('saldo/', 'extrato/', 'extrato/?tipo=D', 'extrato/?tamanho=1'):
+            sincrona = await sync_to_async(self.client.get)(f'/api/{caminho}')
+            assincrona = await self.aget(f'/api/async/{caminho}')
+            self.assertEqual(assincrona.status_code, 200, caminho)
+            esperado = sincrona.json()
+            if esperado.get('next'):
+                esperado['next'] = esperado['next'].replace('/api/', '/api/async/')
+            self.assertEqual(assincrona.json(), esperado, caminho)
+
+    async def test_operacao_envia_notificacao_sem_esperar_o_despachante(self):
+        channel_layer = get_channel_layer()
+        response = await self.apost('/api/async/sacar/', {'valor': '5.00'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"sucesso": "Saque realizado com sucesso."})
+        # Enviada com await antes da resposta, sem a thread do despachante
+        grupo, mensagem = channel_layer.enviados[-1]
+        self.assertEqual(grupo, f"notifications_{self.conta.user_id}")
+        self.assertIn('Saque de R$ 5.00', mensagem['notification']['message'])
+        conta = await Correntista.objects.aget(pk=self.conta.pk)
+        self.assertEqual(conta.saldo, Decimal('95.00'))
+
+    async def test_erros_e_idempotencia(self):
+        response = await self.async_client.get('/api/async/saldo/')
+        self.assertEqual(response.status_code, 401)
+
+        response = await self.apost('/api/async/sacar/', {'valor': '500.00'})
+        self.assertEqual((response.status_code, response.json()), (400, {"erro": "Saldo insuficiente."}))
+
+        for _ in range(2):
+            response = await self.apost('/api/async/depositar/', {'valor': '1.00'}, chave='async-1')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(await Movimentacao.objects.filter(correntista=self.conta).acount(), 1)
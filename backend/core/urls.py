@@ -1,13 +1,19 @@
 from django.urls import path
 from rest_framework.authtoken.views import obtain_auth_token
 
+from . import views_async
+from .metricas import metricas_view
+from .saude import saude_view
 from .views import (
     ExtratoView,
+    exportar_extrato_view,
+    resumo_extrato_view,
     saldo_view,
     pagamento_view,
     transferencia_view,
     saque_view,
-    deposito_view
+    deposito_view,
+    lote_view
 )
 
 urlpatterns = [
@@ -16,10 +22,26 @@ urlpatterns = [
 
     # Rotas GET para extrato e saldo
     path('extrato/', ExtratoView.as_view(), name='extrato'),
+    path('extrato/export/', exportar_extrato_view, name='extrato_exportacao'),
+    path('extrato/resumo/', resumo_extrato_view, name='extrato_resumo'),
     path('saldo/', saldo_view, name='saldo'),
     # Rota POST para operações
     path('pagar/', pagamento_view, name='pagamento'),
     path('transferir/', transferencia_view, name='transferencia'),
     path('sacar/', saque_view, name='saque'),
     path('depositar/', deposito_view, name='deposito'),
+    path('lote/', lote_view, name='lote'),
+
+    # Versões assíncronas (mesmas respostas, sem ocupar uma thread por requisição)
+    path('async/extrato/', views_async.extrato_view, name='extrato_async'),
+    path('async/saldo/', views_async.saldo_view, name='saldo_async'),
+    path('async/pagar/', views_async.pagamento_view, name='pagamento_async'),
+    path('async/transferir/', views_async.transferencia_view, name='transferencia_async'),
+    path('async/sacar/', views_async.saque_view, name='saque_async'),
+    path('async/depositar/', views_async.deposito_view, name='deposito_async'),
+
+    # Métricas de desempenho no formato do Prometheus
+    path('metricas/', metricas_view, name='metricas'),
+    # Health check (banco e pool de conexões)
+    path('saude/', saude_view, name='saude'),
 ]
\ No newline at end of file
@@ -1,254 +1,389 @@
-from django.db import transaction
+from datetime import datetime, time, timedelta
+
+from django.db import router, transaction
+from django.http import StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.utils import timezone
 
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.generics import ListAPIView
 
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-
-from .models import Movimentacao, Correntista
+from . import cache_saldo, exportacao, resumos
+from .idempotencia import idempotente
+from .limites import limitar
+from .models import Correntista, Movimentacao
+from .notificacoes import enviar_notificacao
+from .replicas import leitura_em_replica
+from .operacoes import (
+    LoteRejeitado,
+    OperacaoError,
+    depositar,
+    pagar,
+    processar_lote,
+    sacar,
+    transferir
+)
+from .pagination import ExtratoCursorPagination
 from .serializers import (
-    MovimentacaoSerializer,
+    ExtratoExportacaoSerializer,
+    ExtratoFiltroSerializer,
+    ExtratoResumoFiltroSerializer,
+    LoteSerializer,
+    MovimentacaoExtratoSerializer,
     OperacaoBasicaSerializer,
     PagamentoSerializer,
+    ResumoPeriodoSerializer,
     TransferenciaSerializer,
     SaldoSerializer
 )
 
 
-def enviar_notificacao(user_id, mensagem, tipo='info'):
+def inicio_do_dia(data):
+    """
+    Converte uma data no primeiro instante desse dia no fuso horário atual.
+    """
+    return timezone.make_aware(datetime.combine(data, time.min))
+
+
+def notificar_lote(user, movimentacoes):
     """
-    Envia uma notificação via WebSocket para um usuário específico
+    Envia um resumo do lote ao usuário e uma notificação por beneficiário,
+    em vez de uma notificação por operação.
     """
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"notifications_{user_id}",
-        {
-            'type': 'send_notification',
-            'notification': {
-                'message': mensagem,
-                'tipo': tipo,
-                'timestamp': str(Movimentacao.objects.latest('data_operacao').data_operacao) if Movimentacao.objects.exists() else ''
-            }
-        }
+    if not movimentacoes:
+        return
+
+    operacoes = 0
+    recebidos = {}
+    for movimentacao in movimentacoes:
+        if movimentacao.correntista.user_id == user.pk:
+            operacoes += 1 # cada operação gera exatamente uma movimentação na conta de origem
+            continue
+        total, origem = recebidos.get(movimentacao.correntista, (0, movimentacao.correntista_beneficiario))
+        recebidos[movimentacao.correntista] = (total + movimentacao.valor_operacao, origem)
+
+    ultima = movimentacoes[-1].data_operacao
+    enviar_notificacao(
+        user.pk,
+        f"Lote com {operacoes} operações processado com sucesso.",
+        'success',
+        ultima
     )
+    for destino, (total, origem) in recebidos.items():
+        enviar_notificacao(
+            destino.user_id,
+            f"Você recebeu R$ {total:.2f} de {origem.nome_correntista}.",
+            'info',
+            ultima
+        )
+
+
+def consulta_extrato(correntista, filtros):
+    """
+    Movimentações do correntista com os filtros validados do extrato, só com
+    as colunas do MovimentacaoExtratoSerializer.
+    """
+    # Filtra as movimentações apenas para esse correntista
+    queryset = Movimentacao.objects.filter(correntista=correntista)
+
+    # Compara com limites de data/hora (e não com __date) para o índice ser usado
+    if 'data_inicio' in filtros:
+        queryset = queryset.filter(data_operacao__gte=inicio_do_dia(filtros['data_inicio']))
+    if 'data_fim' in filtros:
+        queryset = queryset.filter(data_operacao__lt=inicio_do_dia(filtros['data_fim'] + timedelta(days=1)))
+    if 'tipo' in filtros:
+        queryset = queryset.filter(tipo_operacao=filtros['tipo'])
+
+    # Busca só as colunas do extrato (e o nome do beneficiário) em uma única consulta
+    return queryset.order_by('-data_operacao', '-id').values(*MovimentacaoExtratoSerializer.campos)
+
+
+# As funções operacao_* executam cada operação a partir dos dados validados e
+# devolvem o corpo da resposta de sucesso e as notificações
+# (user_id, mensagem, tipo, timestamp) a enviar depois do commit. São usadas
+# pelas views síncronas abaixo e pelas assíncronas (views_async.py).
+# Devem ser chamadas dentro de uma transação.
+
+def operacao_pagamento(user, dados):
+    valor = dados['valor']
+    descricao = dados['descricao']
+    movimentacao = pagar(user, valor, descricao)
+    return {"sucesso": "Pagamento realizado com sucesso."}, [(
+        movimentacao.correntista.user_id,
+        f"Pagamento de R$ {valor:.2f} ({descricao}) realizado com sucesso.",
+        'success',
+        movimentacao.data_operacao,
+    )]
+
+
+def operacao_transferencia(user, dados):
+    valor = dados['valor']
+    debito, credito = transferir(user, dados['correntista_destino_id'], valor)
+    correntista_origem = debito.correntista
+    correntista_destino = credito.correntista
+    return {"sucesso": "Transferência realizada com sucesso."}, [
+        (
+            correntista_origem.user_id,
+            f"Transferência de R$ {valor:.2f} para {correntista_destino.nome_correntista} realizada com sucesso.",
+            'success',
+            debito.data_operacao,
+        ),
+        (
+            correntista_destino.user_id,
+            f"Você recebeu R$ {valor:.2f} de {correntista_origem.nome_correntista}.",
+            'info',
+            credito.data_operacao,
+        ),
+    ]
+
+
+def operacao_saque(user, dados):
+    valor = dados['valor']
+    movimentacao = sacar(user, valor)
+    return {"sucesso": "Saque realizado com sucesso."}, [(
+        movimentacao.correntista.user_id,
+        f"Saque de R$ {valor:.2f} realizado com sucesso.",
+        'success',
+        movimentacao.data_operacao,
+    )]
+
+
+def operacao_deposito(user, dados):
+    valor = dados['valor']
+    movimentacao = depositar(user, valor)
+    return {"sucesso": "Depósito realizado com sucesso."}, [(
+        movimentacao.correntista.user_id,
+        f"Depósito de R$ {valor:.2f} realizado com sucesso.",
+        'success',
+        movimentacao.data_operacao,
+    )]
+
+
+def executar_operacao(request, serializer_class, operacao):
+    """
+    Corpo comum das views síncronas de operação: valida, executa e agenda
+    as notificações para depois do commit.
+    """
+    serializer = serializer_class(data=request.data)
+    serializer.is_valid(raise_exception=True)
+
+    try:
+        corpo, notificacoes = operacao(request.user, serializer.validated_data)
+    except OperacaoError as erro:
+        return Response({"erro": erro.mensagem}, status=erro.status)
+
+    # Enviar notificações via WebSocket (após o commit)
+    for notificacao in notificacoes:
+        enviar_notificacao(*notificacao)
+
+    return Response(corpo, status=status.HTTP_200_OK)
 
 
 # 1. EXTRATO
+@method_decorator(leitura_em_replica, name='get')
 class ExtratoView(ListAPIView):
     """
-    View para listar todas as movimentações de um correntista específico.
-    Acesso via /api/correntistas/<id>/extrato/
+    View para listar as movimentações do correntista autenticado, paginadas por cursor.
+    Aceita os filtros opcionais 'data_inicio', 'data_fim' (AAAA-MM-DD) e 'tipo' (C ou D).
+    Acesso via /api/extrato/
     """
-    serializer_class = MovimentacaoSerializer
+    serializer_class = MovimentacaoExtratoSerializer
+    pagination_class = ExtratoCursorPagination
 
     def get_queryset(self):
+        filtros = ExtratoFiltroSerializer(data=self.request.query_params)
+        filtros.is_valid(raise_exception=True)
+
         # Pega o correntista associado ao usuário que fez a requisição
         correntista = self.request.user.correntista
-        # Filtra as movimentações apenas para esse correntista
-        return Movimentacao.objects.filter(correntista=correntista).order_by('-data_operacao')
+        return consulta_extrato(correntista, filtros.validated_data)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['correntista'] = self.request.user.correntista
+        return context
 
 # 1.1 SALDO
 @api_view(['GET'])
+@leitura_em_replica
 def saldo_view(request):
     """
     View para retornar o saldo atual do correntista.
+    O saldo vem do cache (core/cache_saldo.py). A resposta leva um ETag, e
+    um If-None-Match com o mesmo valor recebe 304 sem corpo.
+    """
+    saldo = cache_saldo.obter_saldo(request.user.pk)
+    if saldo is None:
+        return Response({"erro": "Correntista não encontrado."}, status=status.HTTP_404_NOT_FOUND)
+
+    if cache_saldo.etag_confere(request, saldo):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(SaldoSerializer({'saldo_total': saldo}).data, status=status.HTTP_200_OK)
+    response['ETag'] = cache_saldo.etag(saldo)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+# 1.2 EXPORTAÇÃO DO EXTRATO
+@api_view(['GET'])
+@leitura_em_replica
+def exportar_extrato_view(request):
+    """
+    View para baixar o extrato completo em CSV ou NDJSON, gerado enquanto é
+    enviado (core/exportacao.py). Aceita os filtros do extrato, 'formato'
+    (csv ou ndjson) e 'compactar' (gzip).
+    Acesso via /api/extrato/export/
+    """
+    filtros = ExtratoExportacaoSerializer(data=request.query_params)
+    if not filtros.is_valid():
+        return Response(filtros.errors, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        correntista = request.user.correntista
+    except Correntista.DoesNotExist:
+        return Response({"erro": "Correntista não encontrado."}, status=status.HTTP_404_NOT_FOUND)
+
+    dados = filtros.validated_data
+    # Lido depois que a view retorna: o banco (réplica ou primário) é fixado aqui
+    queryset = consulta_extrato(correntista, dados).using(router.db_for_read(Movimentacao))
+    formatador = exportacao.Formatador(dados['formato'], correntista)
+    # No ASGI (Daphne) o Django só transmite aos poucos iteradores assíncronos.
+    # O servidor WSGI sempre preenche 'wsgi.input' (PEP 3333); o ASGI, não
+    gerar = exportacao.gerar if 'wsgi.input' in request.META else exportacao.agerar
+
+    content_type, extensao = exportacao.FORMATOS[dados['formato']]
+    nome = f"extrato.{extensao}"
+    if dados['compactar']:
+        content_type, nome = 'application/gzip', f"{nome}.gz"
+    response = StreamingHttpResponse(gerar(queryset, formatador, dados['compactar']), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{nome}"'
+    response['X-Accel-Buffering'] = 'no' # proxies como o nginx repassam cada pedaço sem esperar o fim
+    return response
+
+
+# 1.3 RESUMO DO EXTRATO
+@api_view(['GET'])
+@leitura_em_replica
+def resumo_extrato_view(request):
     """
+    View para os totais de créditos e débitos, as quantidades e o saldo no
+    fim de cada dia, semana ou mês ('periodo') com movimentação, entre
+    'data_inicio' e 'data_fim' (AAAA-MM-DD, opcionais). Calculado a partir
+    dos resumos diários (core/resumos.py), sem ler as movimentações.
+    Acesso via /api/extrato/resumo/
+    """
+    filtros = ExtratoResumoFiltroSerializer(data=request.query_params)
+    if not filtros.is_valid():
+        return Response(filtros.errors, status=status.HTTP_400_BAD_REQUEST)
     try:
         correntista = request.user.correntista
-        serializer = SaldoSerializer(correntista)
-        return Response(serializer.data, status=status.HTTP_200_OK)
     except Correntista.DoesNotExist:
         return Response({"erro": "Correntista não encontrado."}, status=status.HTTP_404_NOT_FOUND)
-    
+
+    dados = filtros.validated_data
+    periodos = resumos.resumo(correntista, dados['periodo'], dados.get('data_inicio'), dados.get('data_fim'))
+    return Response({
+        'periodo': dados['periodo'],
+        'resultados': ResumoPeriodoSerializer(periodos, many=True).data,
+    })
+
+
 # 2. PAGAMENTO
 @api_view(['POST'])
+@idempotente('pagamento')
+@limitar('pagamento')
 @transaction.atomic # garante que todas as operações no banco ou funcionam ou falham juntas
 def pagamento_view(request):
     """
     View para processar um pagamento (débito) de um correntista.
     Espera um JSON com 'correntista_id', 'valor' e 'descricao'.
     """
-    serializer = PagamentoSerializer(data=request.data)
-    serializer.is_valid(raise_exception=True)
+    return executar_operacao(request, PagamentoSerializer, operacao_pagamento)
 
-    dados = serializer.validated_data
-    valor = dados['valor']
-    descricao = dados['descricao']
 
-    try:
-        correntista = Correntista.objects.select_for_update().get(user=request.user)
-
-        if correntista.saldo < valor:
-            return Response({"erro": "Saldo insuficiente."}, status=status.HTTP_400_BAD_REQUEST)
-        
-        correntista.saldo -= valor
-        correntista.save()
-
-        Movimentacao.objects.create(
-            tipo_operacao='D',
-            correntista=correntista,
-            valor_operacao=valor,
-            descricao=f"Pagamento: {descricao}"
-        )
-        
-        # Enviar notificação via WebSocket
-        enviar_notificacao(
-            correntista.user.id,
-            f"Pagamento de R$ {valor:.2f} ({descricao}) realizado com sucesso.",
-            'success'
-        )
-        
-        return Response({"sucesso": "Pagamento realizado com sucesso."}, status=status.HTTP_200_OK)
-    
-    except Correntista.DoesNotExist:
-        return Response({"erro": "Correntista não encontrado."}, status=status.HTTP_404_NOT_FOUND)
-    
 # 3. TRANSFERÊNCIA
 @api_view(['POST'])
+@idempotente('transferencia')
+@limitar('transferencia')
 @transaction.atomic
 def transferencia_view(request):
     """
     View para processar uma transferência entre dois correntistas.
     Espera um JSON com 'correntista_origem_id', 'correntista_destino_id' e 'valor'.
     """
-    serializer = TransferenciaSerializer(data=request.data)
-    serializer.is_valid(raise_exception=True)
-
-    dados = serializer.validated_data
-    destino_id = dados['correntista_destino_id']
-    valor = dados['valor']
-
-    try:
-        correntista_origem = Correntista.objects.select_for_update().get(user=request.user)
-        destino = Correntista.objects.select_for_update().get(pk=destino_id)
-
-        if correntista_origem.id == destino_id:
-            return Response({"erro": "A conta de origem e destino não podem ser a mesma."}, status=status.HTTP_400_BAD_REQUEST)
-        
-        correntista_destino = Correntista.objects.select_for_update().get(pk=destino_id)
-
-        if correntista_origem.saldo < valor:
-            return Response({"erro": "Saldo insuficiente no correntista de origem."}, status=status.HTTP_400_BAD_REQUEST)
-        
-        correntista_origem.saldo -= valor
-        correntista_destino.saldo += valor
-
-        Movimentacao.objects.create(
-            tipo_operacao='D',
-            correntista=correntista_origem,
-            valor_operacao=valor,
-            descricao=f"Transferência para {correntista_destino.nome_correntista}",
-            correntista_beneficiario=correntista_destino
-        )
-        Movimentacao.objects.create(
-            tipo_operacao='C',
-            correntista=correntista_destino,
-            valor_operacao=valor,
-            descricao=f"Transferência de {correntista_origem.nome_correntista}",
-            correntista_beneficiario=correntista_origem
-        )
+    return executar_operacao(request, TransferenciaSerializer, operacao_transferencia)
 
-        correntista_origem.save()
-        correntista_destino.save()
 
-        # Enviar notificações via WebSocket
-        enviar_notificacao(
-            correntista_origem.user.id, 
-            f"Transferência de R$ {valor:.2f} para {correntista_destino.nome_correntista} realizada com sucesso.",
-            'success'
-        )
-        enviar_notificacao(
-            correntista_destino.user.id,
-            f"Você recebeu R$ {valor:.2f} de {correntista_origem.nome_correntista}.",
-            'info'
-        )
-
-        return Response({"sucesso": "Transferência realizada com sucesso."}, status=status.HTTP_200_OK)
-    
-    except Correntista.DoesNotExist:
-        return Response({"erro": "Correntista de origem ou destino não encontrado."}, status=status.HTTP_404_NOT_FOUND)
-
-    
 # 4. SAQUE
 @api_view(['POST'])
+@idempotente('saque')
+@limitar('saque')
 @transaction.atomic
 def saque_view(request):
     """
     View para processar um saque (débito) de um correntista.
     Espera um JSON com 'correntista_id' e 'valor'.
     """
-    serializer = OperacaoBasicaSerializer(data=request.data)
-    serializer.is_valid(raise_exception=True)
+    return executar_operacao(request, OperacaoBasicaSerializer, operacao_saque)
 
-    dados = serializer.validated_data
-    valor = dados['valor']
 
-    try:
-        correntista = Correntista.objects.select_for_update().get(user=request.user)
-
-        if correntista.saldo < valor:
-            return Response({"erro": "Saldo insuficiente."}, status=status.HTTP_400_BAD_REQUEST)
-        
-        correntista.saldo -= valor
-        correntista.save()
-
-        Movimentacao.objects.create(
-            tipo_operacao='D',
-            correntista=correntista,
-            valor_operacao=valor,
-            descricao="Saque realizado"
-        )
-        
-        # Enviar notificação via WebSocket
-        enviar_notificacao(
-            correntista.user.id,
-            f"Saque de R$ {valor:.2f} realizado com sucesso.",
-            'success'
-        )
-        
-        return Response({"sucesso": "Saque realizado com sucesso."}, status=status.HTTP_200_OK)
-    
-    except Correntista.DoesNotExist:
-        return Response({"erro": "Correntista não encontrado."}, status=status.HTTP_404_NOT_FOUND)
-    
 # 5. DEPÓSITO
 @api_view(['POST'])
+@idempotente('deposito')
+@limitar('deposito')
 @transaction.atomic
 def deposito_view(request):
     """
     View para processar um depósito (crédito) em um correntista.
     Espera um JSON com 'correntista_id' e 'valor'.
     """
-    serializer = OperacaoBasicaSerializer(data=request.data)
+    return executar_operacao(request, OperacaoBasicaSerializer, operacao_deposito)
+
+
+# 6. LOTE
+@api_view(['POST'])
+@idempotente('lote')
+@limitar('lote')
+@transaction.atomic
+def lote_view(request):
+    """
+    View para processar um lote de operações em uma única transação.
+    Espera um JSON com 'modo' ('tudo_ou_nada' ou 'melhor_esforco') e 'operacoes',
+    uma lista de objetos com 'tipo' ('pagamento', 'transferencia', 'saque' ou 'deposito')
+    e os mesmos campos da operação individual.
+    """
+    serializer = LoteSerializer(data=request.data)
     serializer.is_valid(raise_exception=True)
 
-    dados = serializer.validated_data
-    valor = dados['valor']
+    atomico = serializer.validated_data['modo'] == 'tudo_ou_nada'
+    itens, invalidos = serializer.validar_operacoes()
 
-    try:
-        correntista = Correntista.objects.select_for_update().get(user=request.user)
-        
-        correntista.saldo += valor
-        correntista.save()
-
-        Movimentacao.objects.create(
-            tipo_operacao='C',
-            correntista=correntista,
-            valor_operacao=valor,
-            descricao="Depósito realizado"
-        )
-        
-        # Enviar notificação via WebSocket
-        enviar_notificacao(
-            correntista.user.id,
-            f"Depósito de R$ {valor:.2f} realizado com sucesso.",
-            'success'
+    if invalidos and atomico:
+        return Response(
+            {"erro": "Lote rejeitado: há operações inválidas.", "resultados": invalidos},
+            status=status.HTTP_400_BAD_REQUEST
         )
-        
-        return Response({"sucesso": "Depósito realizado com sucesso."}, status=status.HTTP_200_OK)
-    
-    except Correntista.DoesNotExist:
-        return Response({"erro": "Correntista não encontrado."}, status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+
+    try:
+        resultados, movimentacoes = processar_lote(request.user, itens, atomico)
+    except LoteRejeitado as erro:
+        # A resposta é normal, mas nada do que o lote já gravou pode ser confirmado
+        transaction.set_rollback(True)
+        return Response({"erro": erro.mensagem, "resultados": erro.resultados}, status=erro.status)
+    except OperacaoError as erro:
+        transaction.set_rollback(True)
+        return Response({"erro": erro.mensagem}, status=erro.status)
+
+    resultados = sorted(resultados + invalidos, key=lambda resultado: resultado['indice'])
+    aplicadas = sum(1 for resultado in resultados if 'erro' not in resultado)
+
+    notificar_lote(request.user, movimentacoes)
+
+    return Response({
+        "sucesso": "Lote processado.",
+        "aplicadas": aplicadas,
+        "recusadas": len(resultados) - aplicadas,
+        "resultados": resultados,
+    }, status=status.HTTP_200_OK)
@@ -0,0 +1,253 @@
+"""
+Versões assíncronas das views de saldo, extrato e operações, para o Daphne
+atender a requisição no próprio event loop, sem ocupar uma thread do pool
+durante toda a requisição.
+
+As leituras usam o ORM assíncrono. Cada operação roda o bloco com a
+transação e os locks de linha (e o registro da Idempotency-Key) em uma única
+chamada síncrona, e as notificações vão direto ao channel layer com await,
+depois do commit. As respostas são as mesmas das views síncronas.
+Acesso via /api/async/...
+"""
+import json
+from collections import namedtuple
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import HttpResponseNotModified, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+
+from . import cache_saldo
+from .authentication import CachedTokenAuthentication, autenticar_async
+from .idempotencia import (
+    HEADER,
+    HEADER_REPETIDA,
+    chave_valida,
+    executar_idempotente,
+    hash_requisicao,
+    limite_validade,
+    resposta_guardada,
+)
+from .limites import aexecutar_limitado
+from .models import ChaveIdempotencia, Correntista
+from .notificacoes import aenviar_notificacoes
+from .operacoes import OperacaoError
+from .pagination import ExtratoCursorPagination
+from .replicas import leitura_em_replica
+from .serializers import (
+    ExtratoFiltroSerializer,
+    MovimentacaoExtratoSerializer,
+    OperacaoBasicaSerializer,
+    PagamentoSerializer,
+    SaldoSerializer,
+    TransferenciaSerializer
+)
+from .views import (
+    consulta_extrato,
+    operacao_deposito,
+    operacao_pagamento,
+    operacao_saque,
+    operacao_transferencia
+)
+
+# Resultado do bloco síncrono de uma operação (status_code e data, como um Response)
+ResultadoOperacao = namedtuple('ResultadoOperacao', 'status_code data notificacoes')
+
+
+def resposta_json(corpo, status=status.HTTP_200_OK):
+    # Mesma saída do JSONRenderer do DRF (UTF-8 sem escapes)
+    return JsonResponse(corpo, status=status, safe=False, json_dumps_params={'ensure_ascii': False})
+
+
+def api_async(metodo):
+    """
+    Equivalente do @api_view para as views assíncronas: aceita só 'metodo',
+    dispensa o CSRF e autentica pelo token com o mesmo cache do DRF,
+    deixando o usuário em request.user, e responde às APIException da view.
+    """
+    def decorator(view):
+        @csrf_exempt
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != metodo:
+                erro = exceptions.MethodNotAllowed(request.method)
+                return resposta_json({"detail": erro.detail}, status=erro.status_code)
+
+            try:
+                user = await autenticar_async(request)
+            except exceptions.AuthenticationFailed as erro:
+                user, detalhe = None, erro.detail
+            else:
+                detalhe = exceptions.NotAuthenticated.default_detail
+            if user is None:
+                response = resposta_json({"detail": detalhe}, status=status.HTTP_401_UNAUTHORIZED)
+                response['WWW-Authenticate'] = CachedTokenAuthentication.keyword
+                return response
+
+            request.user = user
+            try:
+                return await view(request, *args, **kwargs)
+            except exceptions.APIException as erro:
+                # Como no tratamento de exceções do DRF (ex.: limites e sobrecarga, de core/limites.py)
+                response = resposta_json({"detail": erro.detail}, status=erro.status_code)
+                if getattr(erro, 'wait', None):
+                    response['Retry-After'] = '%d' % erro.wait
+                return response
+        return wrapper
+    return decorator
+
+
+def _dados_requisicao(request):
+    """
+    Corpo da requisição como o request.data do DRF: JSON ou formulário.
+    """
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            raise exceptions.ParseError()
+    return request.POST
+
+
+def _transacao(user, dados, operacao, endpoint, chave, hash_atual, expirado):
+    """
+    Bloco síncrono da operação: transação, locks de linha e, com
+    Idempotency-Key, o registro da chave no mesmo commit.
+    Retorna (resultado, registro de outra requisição com a mesma chave).
+    """
+    def executar():
+        with transaction.atomic():
+            try:
+                corpo, notificacoes = operacao(user, dados)
+            except OperacaoError as erro:
+                return ResultadoOperacao(erro.status, {"erro": erro.mensagem}, [])
+            return ResultadoOperacao(status.HTTP_200_OK, corpo, notificacoes)
+
+    if not chave:
+        return executar(), None
+    return executar_idempotente(user, chave, endpoint, hash_atual, executar, expirado)
+
+
+def _repetir(registro, hash_atual):
+    status_code, corpo, repetida = resposta_guardada(registro, hash_atual)
+    response = resposta_json(corpo, status=status_code)
+    if repetida:
+        response[HEADER_REPETIDA] = 'true'
+    return response
+
+
+async def executar_operacao(request, endpoint, serializer_class, operacao):
+    """
+    Corpo comum das views assíncronas de operação: repetição pela
+    Idempotency-Key com uma leitura assíncrona e, com os limites da operação
+    (core/limites.py), validação, bloco síncrono da transação e envio das
+    notificações com await. As repetições não gastam fichas nem vaga.
+    """
+    try:
+        dados_brutos = _dados_requisicao(request)
+    except exceptions.ParseError as erro:
+        return resposta_json({"detail": erro.detail}, status=erro.status_code)
+
+    chave = request.headers.get(HEADER)
+    hash_atual = expirado = None
+    if chave:
+        if not chave_valida(chave):
+            return resposta_json({"erro": f"{HEADER} muito longa."}, status=status.HTTP_400_BAD_REQUEST)
+        hash_atual = hash_requisicao(request.path, dados_brutos)
+        expirado = await ChaveIdempotencia.objects.filter(user=request.user, chave=chave).afirst()
+        if expirado is not None and expirado.criado_em >= limite_validade():
+            return _repetir(expirado, hash_atual)
+
+    return await aexecutar_limitado(
+        endpoint, request.user.pk,
+        lambda: _executar(request, endpoint, serializer_class, operacao, dados_brutos, chave, hash_atual, expirado),
+    )
+
+
+async def _executar(request, endpoint, serializer_class, operacao, dados_brutos, chave, hash_atual, expirado):
+    serializer = serializer_class(data=dados_brutos)
+    if not serializer.is_valid():
+        return resposta_json(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    resultado, anterior = await sync_to_async(_transacao)(
+        request.user, serializer.validated_data, operacao, endpoint, chave, hash_atual, expirado
+    )
+    if anterior is not None:
+        return _repetir(anterior, hash_atual)
+
+    await aenviar_notificacoes(resultado.notificacoes)
+    return resposta_json(resultado.data, status=resultado.status_code)
+
+
+# 1. EXTRATO
+@api_async('GET')
+@leitura_em_replica
+async def extrato_view(request):
+    """
+    Versão assíncrona de /api/extrato/, com os mesmos filtros e paginação por cursor.
+    """
+    filtros = ExtratoFiltroSerializer(data=request.GET)
+    if not filtros.is_valid():
+        return resposta_json(filtros.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    correntista = await Correntista.objects.filter(user=request.user).afirst()
+    if correntista is None:
+        return resposta_json({"erro": "Correntista não encontrado."}, status=status.HTTP_404_NOT_FOUND)
+
+    paginacao = ExtratoCursorPagination()
+    try:
+        pagina = await paginacao.apaginate_queryset(
+            consulta_extrato(correntista, filtros.validated_data), Request(request)
+        )
+    except exceptions.NotFound as erro:
+        return resposta_json({"detail": erro.detail}, status=erro.status_code)
+
+    serializer = MovimentacaoExtratoSerializer(pagina, many=True, context={'correntista': correntista})
+    return resposta_json({'next': paginacao.get_next_link(), 'results': serializer.data})
+
+
+# 1.1 SALDO
+@api_async('GET')
+@leitura_em_replica
+async def saldo_view(request):
+    """
+    Versão assíncrona de /api/saldo/, com o mesmo cache e ETag.
+    """
+    saldo = await cache_saldo.aobter_saldo(request.user.pk)
+    if saldo is None:
+        return resposta_json({"erro": "Correntista não encontrado."}, status=status.HTTP_404_NOT_FOUND)
+
+    if cache_saldo.etag_confere(request, saldo):
+        response = HttpResponseNotModified()
+    else:
+        response = resposta_json(SaldoSerializer({'saldo_total': saldo}).data)
+    response['ETag'] = cache_saldo.etag(saldo)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+# 2. PAGAMENTO
+@api_async('POST')
+async def pagamento_view(request):
+    return await executar_operacao(request, 'pagamento', PagamentoSerializer, operacao_pagamento)
+
+
+# 3. TRANSFERÊNCIA
+@api_async('POST')
+async def transferencia_view(request):
+    return await executar_operacao(request, 'transferencia', TransferenciaSerializer, operacao_transferencia)
+
+
+# 4. SAQUE
+@api_async('POST')
+async def saque_view(request):
+    return await executar_operacao(request, 'saque', OperacaoBasicaSerializer, operacao_saque)
+
+
+# 5. DEPÓSITO
+@api_async('POST')
+async def deposito_view(request):
+    return await executar_operacao(request, 'deposito', OperacaoBasicaSerializer, operacao_deposito)
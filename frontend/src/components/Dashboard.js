@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback, useMemo } from 'react';
+import React, { useState, useEffect, useCallback, useMemo, useRef } from 'react';
 import axios from 'axios';
 
 const API_URL = 'http://localhost:8000/api';
@@ -6,6 +6,7 @@ const WS_URL = 'ws://localhost:8000/ws/notifications/';
 
 const Dashboard = ({ token, onLogout }) => {
   const [extrato, setExtrato] = useState([]);
+  const [proximaPagina, setProximaPagina] = useState(null);
   const [saldo, setSaldo] = useState(0);
   const [error, setError] = useState('');
   const [success, setSuccess] = useState('');
@@ -30,7 +31,8 @@ const Dashboard = ({ token, onLogout }) => {
         api.get('/extrato/'),
         api.get('/saldo/')
       ]);
-      setExtrato(extratoResponse.data);
+      setExtrato(extratoResponse.data.results);
+      setProximaPagina(extratoResponse.data.next);
       setSaldo(parseFloat(saldoResponse.data.saldo));
     } catch (err) {
       console.error(err);
@@ -38,41 +40,92 @@ const Dashboard = ({ token, onLogout }) => {
     }
   }, [api]);
 
+  const carregarMais = async () => {
+    try {
+      const response = await api.get(proximaPagina);
+      setExtrato(prev => [...prev, ...response.data.results]);
+      setProximaPagina(response.data.next);
+    } catch (err) {
+      console.error(err);
+      setError('Não foi possível carregar o extrato.');
+    }
+  };
+
   useEffect(() => {
     fetchExtrato();
   }, [fetchExtrato]);
 
+  // Última sequência de notificação recebida, informada ao reconectar
+  const ultimaSeq = useRef(null);
+
   // WebSocket para notificações em tempo real
   useEffect(() => {
-    const ws = new WebSocket(`${WS_URL}?token=${token}`);
-    
-    ws.onopen = () => {
-      console.log('WebSocket conectado');
-    };
-    
-    ws.onmessage = (event) => {
-      const data = JSON.parse(event.data);
-      // O backend agora envia diretamente a notificação
-      setNotifications(prev => [...prev, data]);
-      
-      // Auto-remover notificação após 5 segundos
-      setTimeout(() => {
-        setNotifications(prev => prev.filter(n => n !== data));
-      }, 5000);
-      
-      // Atualizar extrato quando receber notificação
-      fetchExtrato();
-    };
-    
-    ws.onerror = (error) => {
-      console.error('WebSocket error:', error);
-    };
-    
-    ws.onclose = () => {
-      console.log('WebSocket desconectado');
+    let ws;
+    let reconexao;
+    let encerrado = false;
+
+    const conectar = () => {
+      const seq = ultimaSeq.current === null ? '' : `&seq=${ultimaSeq.current}`;
+      ws = new WebSocket(`${WS_URL}?token=${token}${seq}`);
+
+      ws.onopen = () => {
+        console.log('WebSocket conectado');
+      };
+
+      ws.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+
+        // Heartbeat do servidor: responde para a conexão não ser fechada por inatividade
+        if (data.tipo === 'ping') {
+          ws.send(JSON.stringify({ tipo: 'pong' }));
+          return;
+        }
+
+        // Notificações próximas (ou reenviadas ao reconectar) chegam juntas num único frame, como lista
+        const recebidas = Array.isArray(data) ? data : [data];
+        recebidas.forEach(n => {
+          if (n.seq !== undefined && (ultimaSeq.current === null || n.seq > ultimaSeq.current)) {
+            ultimaSeq.current = n.seq;
+          }
+        });
+
+        // Parte das notificações perdidas não está mais no servidor
+        if (!Array.isArray(data) && data.tipo === 'lacuna') {
+          fetchExtrato();
+          return;
+        }
+
+        setNotifications(prev => [...prev, ...recebidas]);
+
+        // Auto-remover notificações após 5 segundos
+        setTimeout(() => {
+          setNotifications(prev => prev.filter(n => !recebidas.includes(n)));
+        }, 5000);
+
+        // Atualizar extrato quando receber notificação; as boas-vindas não
+        // mudam nada, e o que foi perdido desconectado é reenviado pelo servidor
+        if (!data.conectado) {
+          fetchExtrato();
+        }
+      };
+
+      ws.onerror = (error) => {
+        console.error('WebSocket error:', error);
+      };
+
+      ws.onclose = () => {
+        console.log('WebSocket desconectado');
+        if (!encerrado) {
+          reconexao = setTimeout(conectar, 2000);
+        }
+      };
     };
-    
+
+    conectar();
+
     return () => {
+      encerrado = true;
+      clearTimeout(reconexao);
       ws.close();
     };
   }, [token, fetchExtrato]);
@@ -219,6 +272,11 @@ const Dashboard = ({ token, onLogout }) => {
                   </div>
                 ))
               )}
+              {proximaPagina && (
+                <button onClick={carregarMais}>
+                  Carregar mais
+                </button>
+              )}
             </div>
           </div>
         );